@@ -0,0 +1,183 @@
+"""
+Edge aggregation for the LoRa gateway.
+
+Instead of forwarding every reading to water/raw, the gateway keeps running
+min/max/mean/last/count per station and channel over fixed windows and
+publishes one rollup per station per window to water/rollup. A reading that
+trips a critical ExpertRules threshold is still forwarded raw straight away,
+so alerts are not held back by the window.
+"""
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+sys.path.insert(0, BACKEND_DIR)
+from logic import ExpertRules
+from sensor_frames import CHANNELS, TOPIC_RAW, parse_batch
+
+class EdgeAggregator:
+    """
+    Per-station streaming aggregates over wall-clock aligned windows.
+
+    add() takes the packets the gateway drained in one go, updates the
+    aggregates with array operations and returns the packets to forward raw.
+    flush() returns the rollups of a window once it has ended.
+    """
+
+    def __init__(self, window=60.0, clock=time.time):
+        """
+        Args:
+            window: Window length in seconds; windows start at multiples of it.
+            clock: Time source (epoch seconds).
+        """
+        self.window = window
+        self.clock = clock
+        self._index = {} # station -> row
+        self._stations = []
+        self._allocate(64)
+        self._start = self._window_start(clock())
+        self.frames = 0
+        self.malformed = 0
+        self.critical = 0
+        self.windows = 0
+        self.rollups = 0
+
+    def _allocate(self, rows):
+        shape = (rows, len(CHANNELS))
+        self._min = np.full(shape, np.nan)
+        self._max = np.full(shape, np.nan)
+        self._sum = np.zeros(shape)
+        self._count = np.zeros(shape, dtype=np.int64)
+        self._last = np.full(shape, np.nan)
+        self._frames = np.zeros(rows, dtype=np.int64)
+
+    def _grow(self):
+        old = (self._min, self._max, self._sum, self._count, self._last, self._frames)
+        self._allocate(2 * len(self._frames))
+        for new, values in zip((self._min, self._max, self._sum, self._count, self._last, self._frames), old):
+            new[:len(values)] = values
+
+    def _window_start(self, now):
+        return now - now % self.window
+
+    def _codes(self, stations):
+        codes = np.empty(len(stations), dtype=np.int64)
+        index = self._index
+        for i, station in enumerate(stations):
+            row = index.get(station)
+            if row is None:
+                row = index[station] = len(self._stations)
+                self._stations.append(station)
+                if row == len(self._frames):
+                    self._grow()
+            codes[i] = row
+        return codes
+
+    def add(self, payloads):
+        """
+        Fold a batch of raw frames into the current window.
+
+        Returns:
+            The payloads with at least one critical reading, to be forwarded raw now.
+        """
+        columns, stations, malformed, source = parse_batch([(TOPIC_RAW, p) for p in payloads], return_index=True)
+        self.malformed += malformed
+        if not stations:
+            return []
+        self.frames += len(stations)
+
+        scores = ExpertRules.score_batch(
+            columns["temperature"], columns["ph"], columns["dissolved_oxygen"], columns["turbidity"], columns["ammonia"]
+        )
+        critical = np.flatnonzero(scores["risk_level"] == 2)
+        self.critical += len(critical)
+
+        codes = self._codes(stations)
+        values = np.column_stack([columns[name] for name in CHANNELS])
+        present = ~np.isnan(values)
+        np.fmin.at(self._min, codes, values)
+        np.fmax.at(self._max, codes, values)
+        np.add.at(self._sum, codes, np.where(present, values, 0.0))
+        np.add.at(self._count, codes, present)
+        np.add.at(self._frames, codes, 1)
+        for c in range(len(CHANNELS)):
+            # Latest value of each station in this batch, for the channels the frame carried
+            rows = np.flatnonzero(present[:, c])
+            if len(rows):
+                _, first_from_end = np.unique(codes[rows][::-1], return_index=True)
+                latest = rows[len(rows) - 1 - first_from_end]
+                self._last[codes[latest], c] = values[latest, c]
+
+        return [payloads[i] for i in source[critical].tolist()]
+
+    def due_in(self):
+        """Seconds until the current window ends."""
+        return self._start + self.window - self.clock()
+
+    def flush(self, force=False):
+        """
+        Close the current window if it has ended (or `force`) and start the next one.
+
+        Returns:
+            One JSON rollup (bytes) per station that reported in the window.
+        """
+        now = self.clock()
+        if not force and now < self._start + self.window:
+            return []
+        start = self._start
+        if force:
+            end = self._start = min(now, start + self.window)
+        else:
+            end = start + self.window
+            self._start = self._window_start(now)
+        self.windows += 1
+
+        rollups = []
+        rows = np.flatnonzero(self._frames[:len(self._stations)])
+        if len(rows):
+            count = self._count[rows]
+            with np.errstate(invalid="ignore"):
+                mean = np.round(self._sum[rows] / count, 4)
+            stats = {"min": self._min[rows].tolist(), "max": self._max[rows].tolist(),
+                     "mean": mean.tolist(), "last": self._last[rows].tolist()}
+            frames = self._frames[rows].tolist()
+            count = count.tolist()
+            for i, row in enumerate(rows.tolist()):
+                channels = {
+                    name: {
+                        "min": stats["min"][i][c], "max": stats["max"][i][c], "mean": stats["mean"][i][c],
+                        "last": stats["last"][i][c], "count": count[i][c]
+                    }
+                    for c, name in enumerate(CHANNELS) if count[i][c]
+                }
+                rollups.append(json.dumps({
+                    "station": self._stations[row],
+                    "window_start": start,
+                    "window_end": end,
+                    "frames": frames[i],
+                    "channels": channels
+                }).encode())
+        self.rollups += len(rollups)
+
+        self._min.fill(np.nan)
+        self._max.fill(np.nan)
+        self._sum.fill(0.0)
+        self._count.fill(0)
+        self._last.fill(np.nan)
+        self._frames.fill(0)
+        return rollups
+
+    def stats(self):
+        return {
+            "window": self.window,
+            "stations": len(self._stations),
+            "frames": self.frames,
+            "malformed": self.malformed,
+            "critical_forwarded": self.critical,
+            "windows": self.windows,
+            "rollups": self.rollups
+        }
@@ -1,21 +1,268 @@
-import paho.mqtt.client as mqtt
-from sx127x import SX127x   # abstraction for LoRa HAT
-
-BROKER = "localhost"
-TOPIC_RAW = "water/raw"
-
-mqtt_client = mqtt.Client()
-mqtt_client.connect(BROKER, 1883)
-
-lora = SX127x(freq=868e6)
-
-def on_receive(payload):
-    decoded = payload.decode()
-    print("LoRa RX:", decoded)
-    mqtt_client.publish(TOPIC_RAW, decoded)
-
-lora.on_receive = on_receive
-lora.start_rx()
-
-while True:
-    pass
+"""
+LoRa -> MQTT gateway.
+
+The radio's receive callback only appends the packet to a bounded queue; a
+publisher thread drains it to the broker. The main thread sleeps on an event
+until SIGINT/SIGTERM, so an idle gateway uses no CPU, and a slow or unreachable
+broker never stalls the radio.
+
+Packets that cannot be published go to a disk spool (spool.py). Once the broker
+is reachable again a drain thread republishes them in batches, rate limited so
+the backlog does not starve live traffic, stamped with their receive time
+(sensor_frames.stamp_frame) so consumers can tell replayed readings from live ones.
+
+Packets are forwarded as received: legacy text frames or binary frames
+(sensor_frames.encode_frame), which consumers tell apart by the first byte.
+With GATEWAY_ROLLUP_WINDOW set, readings are instead aggregated per station
+(aggregator.py) and published as rollups to water/rollup once per window;
+only readings that trip a critical expert rule are forwarded raw, immediately.
+
+Usage:
+    python gateway_lora_rx.py                    # SX127x HAT
+    LORA_RADIO=sim python gateway_lora_rx.py     # simulated SX127x (SIM_NODES, SIM_RATE, SIM_BINARY)
+"""
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+from aggregator import EdgeAggregator
+from radio import SimulatedSX127x, SX127xRadio
+from spool import DiskSpool
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+sys.path.insert(0, BACKEND_DIR)
+from sensor_frames import TOPIC_RAW, TOPIC_ROLLUP, stamp_frame
+
+BROKER = os.getenv("GATEWAY_BROKER", "localhost")
+PORT = int(os.getenv("GATEWAY_PORT", "1883"))
+
+# Packets kept while the publisher is behind; the oldest are dropped beyond this
+QUEUE_SIZE = int(os.getenv("GATEWAY_QUEUE_SIZE", "10000"))
+STATS_INTERVAL = float(os.getenv("GATEWAY_STATS_INTERVAL", "60"))
+
+# Store-and-forward while the broker is unreachable
+SPOOL_DIR = os.getenv("GATEWAY_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+SPOOL_MAX_MB = int(os.getenv("GATEWAY_SPOOL_MAX_MB", "256"))
+DRAIN_RATE = float(os.getenv("GATEWAY_DRAIN_RATE", "2000")) # spooled packets/s once the broker is back (0 = unlimited)
+DRAIN_BATCH = int(os.getenv("GATEWAY_DRAIN_BATCH", "500"))
+RETRY_INTERVAL = float(os.getenv("GATEWAY_RETRY_INTERVAL", "5"))
+
+# Edge aggregation window in seconds (0 = forward every packet)
+ROLLUP_WINDOW = float(os.getenv("GATEWAY_ROLLUP_WINDOW", "0"))
+
+class LoRaGateway:
+    """
+    Receive queue between a Radio and a publisher thread.
+
+    on_receive() runs on the radio's thread and only appends to a deque;
+    the publisher blocks on a condition until packets arrive and publishes
+    them in order. With a spool, packets whose publish fails are written to
+    disk and a drain thread republishes them once `connected()` is true.
+    With an aggregator, each drained batch is folded into per-station rollups
+    and only critical packets are published raw.
+    """
+
+    def __init__(self, radio, publish, topic=TOPIC_RAW, queue_size=QUEUE_SIZE, spool=None, connected=None,
+                 drain_rate=DRAIN_RATE, drain_batch=DRAIN_BATCH, retry_interval=RETRY_INTERVAL,
+                 aggregator=None, rollup_topic=TOPIC_ROLLUP):
+        """
+        Args:
+            radio: Radio implementation (SX127xRadio, SimulatedSX127x, ...).
+            publish: Callable (topic, payload) sending one packet to the broker.
+            topic: Topic raw packets are published to.
+            queue_size: Packets buffered before the oldest is dropped.
+            spool: Optional DiskSpool for packets that could not be published.
+            connected: Callable returning whether the broker is reachable (e.g. client.is_connected).
+            drain_rate: Spooled packets republished per second (0 or None = unlimited).
+            drain_batch: Spooled packets read and committed together.
+            retry_interval: Seconds between drain attempts while the broker is down.
+            aggregator: Optional EdgeAggregator.
+            rollup_topic: Topic rollups are published to.
+        """
+        self.radio = radio
+        self.publish = publish
+        self.topic = topic
+        self.queue_size = queue_size
+        self.spool = spool
+        self.connected = connected or (lambda: True)
+        self.drain_rate = drain_rate
+        self.drain_batch = drain_batch
+        self.retry_interval = retry_interval
+        self.aggregator = aggregator
+        self.rollup_topic = rollup_topic
+        self._queue = deque(maxlen=queue_size)
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._stopping = threading.Event()
+        self._worker = None
+        self._drainer = None
+        self._broker_up = True
+        self.received = 0
+        self.dropped = 0
+        self.published = 0
+        self.publish_errors = 0
+        self.spooled = 0
+        self.replayed = 0
+
+    def on_receive(self, payload):
+        with self._cond:
+            if len(self._queue) == self.queue_size:
+                self.dropped += 1 # the deque discards the oldest packet
+            self._queue.append((time.time(), payload))
+            self.received += 1
+            self._cond.notify()
+
+    def start(self):
+        self._worker = threading.Thread(target=self._publish_loop, name="lora-publisher", daemon=True)
+        self._worker.start()
+        if self.spool is not None:
+            self._drainer = threading.Thread(target=self._drain_loop, name="lora-spool-drain", daemon=True)
+            self._drainer.start()
+        self.radio.start(self.on_receive)
+        return self
+
+    def stop(self):
+        """Stop the radio, publish (or spool) what is queued and stop the worker threads."""
+        self.radio.stop()
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._worker is not None:
+            self._worker.join()
+        self._stopping.set()
+        if self._drainer is not None:
+            self._drainer.join()
+        if self.spool is not None:
+            self.spool.close()
+
+    def _publish_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopped:
+                    if self.aggregator is None:
+                        self._cond.wait()
+                        continue
+                    # Wake up at the end of the window even if no packet arrives
+                    timeout = self.aggregator.due_in()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                stopped = self._stopped
+                packets = list(self._queue)
+                self._queue.clear()
+            if self.aggregator is None:
+                for received_at, payload in packets:
+                    self._forward(payload, received_at)
+            else:
+                if packets:
+                    received_at = packets[-1][0]
+                    for payload in self.aggregator.add([payload for _, payload in packets]):
+                        self._forward(payload, received_at)
+                for rollup in self.aggregator.flush(force=stopped and not self._queue):
+                    self._forward(rollup, topic=self.rollup_topic)
+            if stopped and not self._queue:
+                return
+
+    def _forward(self, payload, received_at=None, topic=None):
+        # Publish, or spool on failure
+        if self._publish(payload, topic):
+            self.published += 1
+            return
+        self.publish_errors += 1
+        if self.spool is not None:
+            self.spool.append(payload, received_at)
+            self.spooled += 1
+
+    def _publish(self, payload, topic=None):
+        """Publish one packet; returns False if the broker did not take it."""
+        try:
+            result = self.publish(topic or self.topic, payload)
+            # paho returns MQTTMessageInfo; rc != 0 means it was not queued (e.g. not connected)
+            ok = getattr(result, "rc", mqtt.MQTT_ERR_SUCCESS) == mqtt.MQTT_ERR_SUCCESS
+            error = f"rc={result.rc}" if not ok else None
+        except Exception as e:
+            ok, error = False, str(e)
+        if ok != self._broker_up:
+            # Log state changes only, not every packet of an outage
+            self._broker_up = ok
+            if ok:
+                print("Broker reachable again")
+            else:
+                print(f"Publish failed: {error}" + ("; spooling to disk" if self.spool is not None else ""))
+        return ok
+
+    def _drain_loop(self):
+        # Republish spooled packets oldest first while the broker is up, at most drain_rate per second
+        while not self._stopping.is_set():
+            if not self.connected() or self.spool.empty():
+                self.spool.sync()
+                self._stopping.wait(self.retry_interval)
+                continue
+            started = time.monotonic()
+            records = self.spool.read_batch(self.drain_batch)
+            sent = 0
+            for received_at, payload in records:
+                # Rollups (JSON) carry their own window times; sensor frames get their receive time
+                if payload[:1] == b"{":
+                    ok = self._publish(payload, self.rollup_topic)
+                else:
+                    ok = self._publish(stamp_frame(payload, received_at))
+                if not ok:
+                    break
+                sent += 1
+            self.spool.commit(sent)
+            self.replayed += sent
+            if sent < len(records):
+                self._stopping.wait(self.retry_interval)
+            elif self.drain_rate:
+                self._stopping.wait(max(0.0, sent / self.drain_rate - (time.monotonic() - started)))
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "published": self.published,
+            "queued": len(self._queue),
+            "dropped": self.dropped,
+            "publish_errors": self.publish_errors,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "spool": self.spool.stats() if self.spool is not None else None,
+            "aggregation": self.aggregator.stats() if self.aggregator is not None else None
+        }
+
+def make_radio():
+    if os.getenv("LORA_RADIO", "sx127x") == "sim":
+        return SimulatedSX127x(nodes=int(os.getenv("SIM_NODES", "10")), rate=float(os.getenv("SIM_RATE", "1")),
+                               binary=os.getenv("SIM_BINARY", "0") == "1")
+    return SX127xRadio(freq=float(os.getenv("LORA_FREQ", "868e6")))
+
+def main():
+    mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    # Connect (and reconnect) on paho's network thread; never block startup on the broker
+    mqtt_client.connect_async(BROKER, PORT)
+    mqtt_client.loop_start()
+
+    spool = DiskSpool(SPOOL_DIR, max_bytes=SPOOL_MAX_MB << 20)
+    aggregator = EdgeAggregator(ROLLUP_WINDOW) if ROLLUP_WINDOW > 0 else None
+    gateway = LoRaGateway(make_radio(), mqtt_client.publish, spool=spool, connected=mqtt_client.is_connected,
+                          aggregator=aggregator).start()
+    print(f"LoRa gateway running, publishing to {BROKER}:{PORT}/{TOPIC_RAW}")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    while not stop.wait(STATS_INTERVAL):
+        print("Gateway stats:", gateway.stats())
+
+    gateway.stop()
+    mqtt_client.loop_stop()
+    mqtt_client.disconnect()
+    print("Gateway stopped:", gateway.stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Append-only disk spool for packets the gateway could not publish.
+
+Records are appended to numbered segment files in the spool directory:
+
+    <seq>.seg:  [length u32][crc32 u32][received_at f64][payload] ...
+
+Appends are buffered and fsync'd every `fsync_every` records or
+`fsync_interval` seconds, so a power cut loses at most that window. A new
+segment is started once the current one reaches `segment_bytes`; when the
+spool grows past `max_bytes` the oldest segments are deleted (the oldest
+readings are given up first). The drain position is kept in a `cursor` file,
+so a restarted gateway resumes where the last drain stopped (delivery is
+at-least-once).
+"""
+import os
+import struct
+import threading
+import time
+import zlib
+
+HEADER = struct.Struct("<IId") # payload length, crc32(payload), receive time
+
+class DiskSpool:
+    """
+    Segmented store-and-forward queue on disk.
+
+    append() is called by the publisher when the broker is unreachable;
+    read_batch()/commit() are called by the drain loop once it is back.
+    Both sides may run on different threads.
+    """
+
+    def __init__(self, directory, segment_bytes=4 << 20, max_bytes=256 << 20, fsync_every=256, fsync_interval=1.0):
+        """
+        Args:
+            directory: Spool directory (created if missing).
+            segment_bytes: Size at which a new segment file is started.
+            max_bytes: Spool size cap; the oldest segments are deleted beyond it.
+            fsync_every: Records appended between fsyncs.
+            fsync_interval: Maximum seconds between fsyncs while appending.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._segments = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith(".seg"))
+        self._sizes = {seq: os.path.getsize(self._path(seq)) for seq in self._segments}
+        self._writer = None
+        self._write_seq = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._read_seq, self._read_offset = self._load_cursor()
+        self._pending = [] # (seq, end offset) of each record handed out by the last read_batch
+        self._cache = None # (seq, start offset, bytes) of the segment being drained
+        self.appended = 0
+        self.drained = 0
+        self.dropped_segments = 0
+        self.dropped_bytes = 0
+        self.corrupt = 0
+        self.fsyncs = 0
+        # Segments before the cursor were fully drained by a previous run
+        while self._segments and self._segments[0] < self._read_seq:
+            self._remove(self._segments[0])
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}.seg")
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, "cursor")) as f:
+                seq, offset = (int(x) for x in f.read().split())
+        except (OSError, ValueError):
+            return (self._segments[0] if self._segments else 0), 0
+        if seq not in self._sizes:
+            # The cursor's segment is gone (dropped by the size cap): start at the oldest left
+            later = [s for s in self._segments if s > seq]
+            return (later[0] if later else seq), 0
+        return seq, offset
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, "cursor")
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self._read_seq} {self._read_offset}")
+        os.replace(path + ".tmp", path)
+
+    def _remove(self, seq):
+        self._segments.remove(seq)
+        self._sizes.pop(seq)
+        os.remove(self._path(seq))
+
+    # ---------------------------
+    # Writing
+    # ---------------------------
+    def append(self, payload, received_at=None):
+        """Append one packet (bytes) with its receive time (default: now)."""
+        record = HEADER.pack(len(payload), zlib.crc32(payload), received_at or time.time()) + payload
+        with self._lock:
+            if self._writer is None or self._sizes[self._write_seq] >= self.segment_bytes:
+                self._rotate()
+            self._writer.write(record)
+            self._sizes[self._write_seq] += len(record)
+            self.appended += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+            if sum(self._sizes.values()) > self.max_bytes:
+                self._enforce_cap()
+
+    def _rotate(self):
+        # Never append to a segment left by a previous run: its tail may be torn
+        if self._writer is not None:
+            self._sync()
+            self._writer.close()
+        self._write_seq = self._segments[-1] + 1 if self._segments else self._read_seq
+        self._writer = open(self._path(self._write_seq), "ab")
+        self._segments.append(self._write_seq)
+        self._sizes[self._write_seq] = 0
+
+    def _sync(self):
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self.fsyncs += 1
+
+    def sync(self):
+        """fsync appended records that are not on disk yet."""
+        with self._lock:
+            if self._writer is not None and self._unsynced:
+                self._sync()
+
+    def _enforce_cap(self):
+        while sum(self._sizes.values()) > self.max_bytes and len(self._segments) > 1:
+            seq = self._segments[0]
+            self.dropped_bytes += self._sizes[seq]
+            self.dropped_segments += 1
+            self._remove(seq)
+            if self._read_seq <= seq:
+                self._read_seq, self._read_offset = self._segments[0], 0
+                self._pending = []
+                self._cache = None
+
+    # ---------------------------
+    # Draining
+    # ---------------------------
+    def _read_from(self, seq, offset):
+        # Keep the segment being drained in memory; re-read only when the writer has added to it
+        cached = self._cache
+        if cached is not None and cached[0] == seq and cached[1] <= offset and cached[1] + len(cached[2]) >= self._sizes[seq]:
+            return cached[1], cached[2]
+        if seq == self._write_seq:
+            self._writer.flush()
+        with open(self._path(seq), "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        self._cache = (seq, offset, data)
+        return offset, data
+
+    def read_batch(self, max_records=500):
+        """
+        Read up to `max_records` of the oldest undrained packets.
+
+        Returns:
+            List of (received_at, payload). They stay in the spool until commit().
+        """
+        with self._lock:
+            records, pending = [], []
+            seq, offset = self._read_seq, self._read_offset
+            while len(records) < max_records and seq in self._sizes:
+                start, data = self._read_from(seq, offset)
+                pos = offset - start
+                while len(records) < max_records and pos + HEADER.size <= len(data):
+                    length, crc, received_at = HEADER.unpack_from(data, pos)
+                    end = pos + HEADER.size + length
+                    payload = data[pos + HEADER.size:end]
+                    if end > len(data) or zlib.crc32(payload) != crc:
+                        break
+                    records.append((received_at, payload))
+                    pos = end
+                    pending.append((seq, start + pos))
+                if len(records) == max_records or seq == self._write_seq:
+                    break
+                if pos < len(data):
+                    # Torn or corrupt tail left by a crash: hand out what precedes it, then skip it
+                    if records:
+                        break
+                    self.corrupt += 1
+                later = [s for s in self._segments if s > seq]
+                if not later:
+                    if not records:
+                        self._read_seq, self._read_offset = seq, self._sizes[seq]
+                    break
+                seq, offset = later[0], 0
+            self._pending = pending
+            return records
+
+    def commit(self, count=None):
+        """Mark the first `count` records of the last read_batch (default: all) as delivered."""
+        with self._lock:
+            if count is None:
+                count = len(self._pending)
+            if count <= 0 or not self._pending:
+                return
+            seq, offset = self._pending[count - 1]
+            self._pending = []
+            self.drained += count
+            while self._segments and self._segments[0] < seq:
+                self._remove(self._segments[0])
+            self._read_seq, self._read_offset = seq, offset
+            self._save_cursor()
+
+    def pending_bytes(self):
+        """Bytes not drained yet (headers included)."""
+        with self._lock:
+            return sum(size for seq, size in self._sizes.items() if seq >= self._read_seq) - self._read_offset
+
+    def empty(self):
+        return self.pending_bytes() <= 0
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._sync()
+                self._writer.close()
+                self._writer = None
+
+    def stats(self):
+        return {
+            "segments": len(self._segments),
+            "pending_bytes": self.pending_bytes(),
+            "appended": self.appended,
+            "drained": self.drained,
+            "dropped_segments": self.dropped_segments,
+            "dropped_bytes": self.dropped_bytes,
+            "corrupt": self.corrupt,
+            "fsyncs": self.fsyncs
+        }
@@ -1,30 +1,277 @@
-import paho.mqtt.client as mqtt
-import time
-
-BROKER = "localhost"
-TOPIC_RAW = "water/raw"
-TOPIC_ANALYSIS = "water/analysis"
-
-def analyze(data):
-    if "NH3" in data:
-        return "POLLUTED"
-    return "SAFE"
-
-def on_message(client, userdata, msg):
-    raw = msg.payload.decode()
-    result = analyze(raw)
-
-    payload = {
-        "status": result,
-        "timestamp": time.time()
-    }
-
-    client.publish(TOPIC_ANALYSIS, str(payload))
-    print("Analysis:", payload)
-
-client = mqtt.Client()
-client.connect(BROKER, 1883)
-client.subscribe(TOPIC_RAW)
-client.on_message = on_message
-
-client.loop_forever()
+"""
+MQTT ingest service for the STM32 sensor frames.
+
+Subscribes to water/raw (and water/raw/<station>), parses the
+"PH=7.20,TUR=12.00,SAL=15.00,NH3=0.02,T=28.5" frames written by
+Sensors_FormatPayload, groups them into micro-batches (by count or time) and
+analyzes each batch with the expert rules. Results are published as JSON:
+
+    water/analysis        one message per frame, as the original script sent
+                          ("status" and "timestamp", plus the analysis fields)
+    water/analysis/batch  one columnar message per batch (see analyze_batch)
+
+Either topic can be turned off by setting MQTT_TOPIC_ANALYSIS or
+MQTT_TOPIC_ANALYSIS_BATCH to an empty string.
+
+Usage:
+    python mqtt_analysis.py          # rules only
+    python mqtt_analysis.py --ml     # rules + disease model from ../backend
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+sys.path.insert(0, BACKEND_DIR)
+from logic import ExpertRules
+from sensor_frames import CHANNELS, TOPIC_RAW, parse_batch
+
+BROKER = os.getenv("MQTT_BROKER", "localhost")
+PORT = int(os.getenv("MQTT_PORT", "1883"))
+TOPIC_ANALYSIS = os.getenv("MQTT_TOPIC_ANALYSIS", "water/analysis")
+TOPIC_ANALYSIS_BATCH = os.getenv("MQTT_TOPIC_ANALYSIS_BATCH", "water/analysis/batch")
+
+# Flush a batch when it reaches BATCH_SIZE frames or BATCH_INTERVAL seconds, whichever comes first.
+# Frames beyond MAX_PENDING (analysis falling behind) are dropped oldest first.
+BATCH_SIZE = int(os.getenv("MQTT_BATCH_SIZE", "1000"))
+BATCH_INTERVAL = float(os.getenv("MQTT_BATCH_INTERVAL", "0.05"))
+MAX_PENDING = int(os.getenv("MQTT_MAX_PENDING", "100000"))
+
+_ALERTS = {} # trigger mask -> alert labels
+
+def alert_labels(mask):
+    labels = _ALERTS.get(mask)
+    if labels is None:
+        labels = [rule[0] for bit, rule in enumerate(ExpertRules.TRIGGER_RULES) if mask >> bit & 1]
+        _ALERTS[mask] = labels
+    return labels
+
+class DiseaseClassifier:
+    """The backend's disease model (compiled forest + label encoder), applied to whole batches."""
+
+    def __init__(self, model_path=None, encoder_path=None):
+        import joblib
+        from forest_engine import CompiledForest
+
+        self.engine = CompiledForest.from_sklearn(joblib.load(model_path or os.path.join(BACKEND_DIR, "disease_model.pkl")))
+        self.le = joblib.load(encoder_path or os.path.join(BACKEND_DIR, "label_encoder.pkl"))
+        # Only what the model was trained on is required (e.g. not ammonia, which frames often lack)
+        self.features = tuple(self.engine.feature_names)
+
+    def predict(self, columns):
+        """
+        Returns:
+            (labels, confidences) lists; None for rows missing a model feature.
+        """
+        n = len(columns["ph"])
+        labels, confidences = [None] * n, [None] * n
+        complete = np.all([np.isfinite(columns[f]) for f in self.features], axis=0)
+        if complete.any():
+            rows = np.flatnonzero(complete)
+            pred_idx, probs = self.engine.predict(self.engine.matrix_from({f: columns[f][rows] for f in self.features}))
+            for i, label, confidence in zip(rows, self.le.inverse_transform(pred_idx), probs.max(axis=1) * 100):
+                labels[i], confidences[i] = str(label), round(float(confidence), 1)
+        return labels, confidences
+
+def analyze_batch(columns, stations, timestamp=None, classifier=None):
+    """
+    Expert rules (and optionally the disease model) over one parsed batch.
+
+    Returns:
+        Columnar result for the batch: count, timestamp, and one list entry per
+        frame under station, risk_level, health_score, alerts, readings
+        (channel -> values, None where the frame lacked the channel) and, with a
+        classifier, disease/confidence.
+    """
+    scores = ExpertRules.score_batch(
+        columns["temperature"], columns["ph"], columns["dissolved_oxygen"], columns["turbidity"], columns["ammonia"]
+    )
+    readings = {}
+    for name in CHANNELS:
+        values = columns[name]
+        missing = np.isnan(values)
+        if missing.all():
+            continue
+        values = values.tolist()
+        if missing.any():
+            values = [None if gap else v for v, gap in zip(values, missing.tolist())]
+        readings[name] = values
+
+    result = {
+        "count": len(stations),
+        "timestamp": timestamp or time.time(),
+        "station": stations,
+        "risk_level": [ExpertRules.RISK_LEVELS[level] for level in scores["risk_level"].tolist()],
+        "health_score": scores["health_score"].tolist(),
+        "alerts": [alert_labels(mask) for mask in scores["trigger_mask"].tolist()],
+        "readings": readings
+    }
+    if classifier is not None:
+        result["disease"], result["confidence"] = classifier.predict(columns)
+    return result
+
+def frame_messages(result):
+    """
+    Split a batch result (see analyze_batch) into the per-frame messages of water/analysis.
+
+    Each message keeps the original contract, "status" ("POLLUTED" when the
+    frame reports ammonia, else "SAFE") and "timestamp", and adds station,
+    risk_level, health_score, alerts, the frame's readings (channels it lacked
+    are left out) and, with a classifier, disease/confidence.
+    """
+    readings = result["readings"]
+    ammonia = readings.get("ammonia")
+    messages = []
+    for i, station in enumerate(result["station"]):
+        frame = {name: values[i] for name, values in readings.items() if values[i] is not None}
+        message = {
+            "status": "POLLUTED" if ammonia is not None and ammonia[i] is not None else "SAFE",
+            "timestamp": result["timestamp"],
+            "station": station,
+            "risk_level": result["risk_level"][i],
+            "health_score": result["health_score"][i],
+            "alerts": result["alerts"][i],
+            "readings": frame
+        }
+        if result.get("disease") is not None and result["disease"][i] is not None:
+            message["disease"], message["confidence"] = result["disease"][i], result["confidence"][i]
+        messages.append(message)
+    return messages
+
+class IngestService:
+    """
+    Micro-batching between the MQTT network thread and the analysis.
+
+    submit() only appends to a buffer, so the paho callback returns immediately.
+    A worker thread flushes the buffer every `batch_size` frames or
+    `batch_interval` seconds, analyzes the batch in one vectorized pass and
+    publishes one JSON message per frame to `topic` (see frame_messages) and
+    one columnar message per batch to `batch_topic` (see analyze_batch).
+    """
+
+    def __init__(self, publish, batch_size=BATCH_SIZE, batch_interval=BATCH_INTERVAL, max_pending=MAX_PENDING,
+                 classifier=None, topic=TOPIC_ANALYSIS, batch_topic=TOPIC_ANALYSIS_BATCH):
+        """
+        Args:
+            publish: Callable (topic, payload) used to send results, e.g. client.publish.
+            batch_size: Frames per batch before an early flush.
+            batch_interval: Maximum seconds a frame waits for its batch.
+            max_pending: Buffered frames kept when analysis falls behind; older ones are dropped.
+            classifier: Optional DiseaseClassifier.
+            topic: Topic of the per-frame results (None or "" to skip them).
+            batch_topic: Topic of the per-batch results (None or "" to skip them).
+        """
+        self.publish = publish
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_pending = max_pending
+        self.classifier = classifier
+        self.topic = topic
+        self.batch_topic = batch_topic
+        self._pending = deque(maxlen=max_pending)
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._worker = None
+        self.received = 0
+        self.dropped = 0
+        self.malformed = 0
+        self.failed = 0
+        self.analyzed = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+
+    def submit(self, topic, payload):
+        with self._cond:
+            if len(self._pending) == self.max_pending:
+                self.dropped += 1 # the deque discards the oldest frame
+            self._pending.append((topic, payload))
+            self.received += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def on_message(self, client, userdata, msg):
+        self.submit(msg.topic, msg.payload)
+
+    def start(self):
+        self._worker = threading.Thread(target=self._run, name="mqtt-ingest", daemon=True)
+        self._worker.start()
+        return self
+
+    def stop(self):
+        """Flush what is buffered and stop the worker."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._worker is not None:
+            self._worker.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._pending) < self.batch_size and not self._stopped:
+                    self._cond.wait(self.batch_interval)
+                pending = self._pending
+                self._pending = deque(maxlen=self.max_pending)
+                stopped = self._stopped
+            # After a stall more than batch_size frames may be waiting: analyze them in batch_size chunks
+            pending = list(pending)
+            for i in range(0, len(pending), self.batch_size):
+                batch = pending[i:i + self.batch_size]
+                try:
+                    self.process(batch)
+                except Exception as e:
+                    # One bad batch (or a failed publish) must not stop the worker
+                    self.failed += len(batch)
+                    print(f"Ingest of {len(batch)} frames failed: {e}")
+            if stopped:
+                return
+
+    def process(self, batch):
+        start = time.perf_counter()
+        columns, stations, malformed = parse_batch(batch)
+        self.malformed += malformed
+        if stations:
+            result = analyze_batch(columns, stations, classifier=self.classifier)
+            if self.batch_topic:
+                self.publish(self.batch_topic, json.dumps(result))
+            if self.topic:
+                for message in frame_messages(result):
+                    self.publish(self.topic, json.dumps(message))
+            self.analyzed += len(stations)
+        self.batches += 1
+        self.busy_seconds += time.perf_counter() - start
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "analyzed": self.analyzed,
+            "malformed": self.malformed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "avg_batch": round(self.analyzed / self.batches, 1) if self.batches else 0.0,
+            "busy_ms": round(self.busy_seconds * 1e3, 3)
+        }
+
+def main():
+    classifier = DiseaseClassifier() if "--ml" in sys.argv[1:] else None
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    service = IngestService(client.publish, classifier=classifier).start()
+    client.on_message = service.on_message
+    client.connect(BROKER, PORT)
+    client.subscribe([(TOPIC_RAW, 0), (TOPIC_RAW + "/#", 0)])
+    try:
+        client.loop_forever()
+    finally:
+        service.stop()
+        print("Ingest stats:", service.stats())
+
+if __name__ == "__main__":
+    main()
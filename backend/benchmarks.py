@@ -0,0 +1,1508 @@
+"""
+Micro-benchmarks for the AquaNova backend hot paths.
+
+Each benchmark also checks that the fast path returns the same results as the
+original implementation before reporting any timings.
+
+Usage:
+    python benchmarks.py            # run all benchmarks
+    python benchmarks.py rules      # run a single benchmark by name
+"""
+import json
+import sys
+import time
+from types import SimpleNamespace
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from forest_engine import CompiledForest
+from logic import ExpertRules, Forecaster
+from smoothing import HoltForecaster, HoltWintersForecaster
+from station_history import StationHistory
+
+
+def _timeit(fn, repeat=3):
+    """Return the best wall time (seconds) of `repeat` runs of fn()."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _random_readings(n, seed=42, healthy_fraction=0.0):
+    """
+    Readings spread across the optimal, warning and critical bands.
+    `healthy_fraction` of the rows are redrawn inside the optimal band, which is
+    what a well-run farm reports most of the time.
+    """
+    rng = np.random.default_rng(seed)
+    cols = {
+        "temperature": rng.uniform(14, 38, n),
+        "ph": rng.uniform(6.0, 9.0, n),
+        "dissolved_oxygen": rng.uniform(3.0, 9.0, n),
+        "turbidity": rng.uniform(0, 40, n),
+        "ammonia": rng.uniform(0, 0.08, n),
+    }
+    healthy = rng.random(n) < healthy_fraction
+    k = int(healthy.sum())
+    cols["temperature"][healthy] = rng.uniform(26, 30, k)
+    cols["ph"][healthy] = rng.uniform(7.0, 8.0, k)
+    cols["dissolved_oxygen"][healthy] = rng.uniform(6.5, 9.0, k)
+    cols["turbidity"][healthy] = rng.uniform(0, 15, k)
+    cols["ammonia"][healthy] = rng.uniform(0, 0.02, k)
+    return cols
+
+
+def bench_rules(sizes=(100, 1_000, 10_000)):
+    """ExpertRules.evaluate per-row loop vs ExpertRules.evaluate_batch."""
+    print("== ExpertRules: per-row evaluate vs evaluate_batch ==")
+    for n, healthy in ((n, h) for h in (0.0, 0.9) for n in sizes):
+        cols = _random_readings(n, healthy_fraction=healthy)
+        rows = [SimpleNamespace(**{k: float(v[i]) for k, v in cols.items()}) for i in range(n)]
+
+        expected = [ExpertRules.evaluate(row) for row in rows]
+        assert ExpertRules.evaluate_batch(**cols) == expected, "evaluate_batch diverged from evaluate"
+
+        loop_t = _timeit(lambda: [ExpertRules.evaluate(row) for row in rows])
+        batch_t = _timeit(lambda: ExpertRules.evaluate_batch(**cols))
+        score_t = _timeit(lambda: ExpertRules.score_batch(**cols))
+        print(f"n={n:>6} healthy={healthy:.0%}  loop {loop_t * 1e3:8.2f} ms  batch {batch_t * 1e3:8.2f} ms "
+              f"({loop_t / batch_t:4.1f}x)  scores only {score_t * 1e3:6.2f} ms ({loop_t / score_t:6.1f}x)")
+
+
+def bench_forest(sizes=(1, 64, 10_000)):
+    """sklearn predict + predict_proba vs one CompiledForest traversal."""
+    disease_model = joblib.load("disease_model.pkl")
+    production_model = joblib.load("production_model.pkl")
+    production_scaler = joblib.load("production_scaler.pkl")
+
+    cases = [
+        ("disease_model", CompiledForest.from_sklearn(disease_model),
+         lambda df: (disease_model.predict(df), disease_model.predict_proba(df))),
+        ("production_model+scaler", CompiledForest.from_sklearn(production_model, scaler=production_scaler),
+         lambda df: (production_model.predict(production_scaler.transform(df)),
+                     production_model.predict_proba(production_scaler.transform(df)))),
+    ]
+
+    for name, engine, reference in cases:
+        print(f"== {name}: sklearn vs CompiledForest ({engine.n_trees} trees, depth {engine.max_depth}) ==")
+        for n in sizes:
+            cols = _random_readings(n, seed=n)
+            df = pd.DataFrame({k: cols[k] for k in engine.feature_names})
+            X = engine.matrix_from(cols)
+
+            ref_labels, ref_proba = reference(df)
+            labels, proba = engine.predict(X)
+            agreement = np.mean(labels == ref_labels)
+            # Exact parity is covered by tests/test_forest_engine.py; this only guards the timed run
+            assert agreement == 1.0 and np.allclose(proba, ref_proba, rtol=0, atol=1e-9), f"{name} diverged from sklearn"
+
+            sk_t = _timeit(lambda: reference(df))
+            fast_t = _timeit(lambda: engine.predict(X))
+            print(f"n={n:>6}  sklearn {sk_t * 1e3:8.2f} ms  compiled {fast_t * 1e3:8.2f} ms "
+                  f"({sk_t / fast_t:5.1f}x)  label agreement {agreement:.2%}  "
+                  f"max |dp| {np.abs(proba - ref_proba).max():.1e}")
+
+
+def bench_batch_endpoint(total=2_000, batch_sizes=(1, 10, 100, 1_000)):
+    """Readings/sec through POST /predict (one per request) vs POST /predict/batch."""
+    from fastapi.testclient import TestClient
+    import main
+
+    client = TestClient(main.app)
+    cols = _random_readings(total, healthy_fraction=0.5)
+    readings = [{k: float(v[i]) for k, v in cols.items()} for i in range(total)]
+
+    print("== /predict vs /predict/batch throughput ==")
+    single = [client.post("/predict", json=r).json() for r in readings[:50]]
+    batched = client.post("/predict/batch", json={"readings": readings[:50]}).json()["results"]
+    assert [{k: v for k, v in r.items() if k != "index"} for r in batched] == single, "batch diverged from /predict"
+
+    n = min(total, 500)
+    t = _timeit(lambda: [client.post("/predict", json=r) for r in readings[:n]], repeat=1)
+    print(f"/predict          {n / t:10.0f} readings/s")
+    for size in batch_sizes:
+        chunks = [readings[i:i + size] for i in range(0, total, size)]
+        t = _timeit(lambda: [client.post("/predict/batch", json={"readings": c}) for c in chunks], repeat=1)
+        print(f"/predict/batch {size:>5} {total / t:8.0f} readings/s")
+
+
+def bench_predict_cache(requests=2_000):
+    """Slider-style /predict traffic: hit ratio and latency with the response cache."""
+    from fastapi.testclient import TestClient
+    import main
+
+    client = TestClient(main.app)
+    rng = np.random.default_rng(7)
+    # What-If sliders move one parameter at a time around a baseline, in UI-sized steps
+    base = {"temperature": 28.0, "ph": 7.5, "dissolved_oxygen": 7.0, "turbidity": 8.0, "ammonia": 0.01}
+    steps = {"temperature": 0.5, "ph": 0.1, "dissolved_oxygen": 0.1, "turbidity": 1.0, "ammonia": 0.005}
+    traffic = []
+    for _ in range(requests):
+        name = rng.choice(list(steps))
+        reading = dict(base)
+        reading[name] = round(base[name] + steps[name] * rng.integers(-10, 11), 3)
+        traffic.append(reading)
+
+    print("== /predict response cache under slider traffic ==")
+    rows = [main.WaterQualityInput(**r) for r in traffic[:200]]
+    pipeline = _timeit(lambda: [main.run_predictions([r]) for r in rows], repeat=1) / len(rows)
+
+    main.prediction_cache = main.TTLCache(maxsize=main.prediction_cache.maxsize, ttl=main.prediction_cache.ttl)
+    t = _timeit(lambda: [client.post("/predict", json=r) for r in traffic], repeat=1)
+    stats = main.prediction_cache.stats()
+    print(f"rules+ML pipeline {pipeline * 1e3:6.3f} ms/miss  end-to-end {t / requests * 1e3:6.3f} ms/req  "
+          f"hit ratio {stats['hit_ratio']:.1%}  entries {stats['size']}")
+
+
+def bench_event_loop(duration=3.0, port=8765):
+    """p50/p99 of /api/weather-impact while /predict/batch saturates the server, per executor kind."""
+    import asyncio
+    import threading
+
+    import httpx
+    import uvicorn
+
+    import main
+    from executor import ComputeExecutor
+
+    main.prediction_cache.maxsize = 0 # every request pays for inference
+    server = uvicorn.Server(uvicorn.Config(main.app, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    cols = _random_readings(2_000, healthy_fraction=0.5)
+    payload = {"readings": [{k: float(v[i]) for k, v in cols.items()} for i in range(2_000)]}
+    base = f"http://127.0.0.1:{port}"
+
+    async def saturate(client, stop_at):
+        while time.perf_counter() < stop_at:
+            await client.post(f"{base}/predict/batch", json=payload)
+
+    async def probe(client, stop_at, latencies):
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            await client.get(f"{base}/api/weather-impact")
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        latencies = []
+        async with httpx.AsyncClient(timeout=60) as client:
+            stop_at = time.perf_counter() + duration
+            await asyncio.gather(probe(client, stop_at, latencies), *(saturate(client, stop_at) for _ in range(4)))
+        return np.array(latencies) * 1e3
+
+    print("== /api/weather-impact latency while /predict/batch is saturated ==")
+    original_pool, original_cache_size = main.compute_pool, main.prediction_cache.maxsize
+    try:
+        for kind in ("inline", "thread"):
+            main.compute_pool = ComputeExecutor(kind=kind, max_pending=1_000)
+            lat = asyncio.run(run())
+            main.compute_pool.shutdown()
+            print(f"{kind:>7}: p50 {np.percentile(lat, 50):7.1f} ms  p99 {np.percentile(lat, 99):7.1f} ms  "
+                  f"({len(lat)} probes)")
+    finally:
+        server.should_exit = True
+        main.compute_pool, main.prediction_cache.maxsize = original_pool, original_cache_size
+
+
+def bench_station_trend(windows=(20, 720, 17_280), appends=2_000):
+    """Refit-from-history (np.polyfit x4) vs StationHistory running-sum fit, per new reading."""
+    print("== trend fit per new reading: client history + polyfit vs server-side running sums ==")
+    rng = np.random.default_rng(3)
+    for window in windows:
+        readings = [
+            {"ph": 7 + rng.normal(0, 0.1), "temperature": 27 + rng.normal(), "dissolved_oxygen": 6.5 + rng.normal(),
+             "turbidity": 8 + rng.normal(), "timestamp": str(i)}
+            for i in range(window + appends)
+        ]
+        station = StationHistory(capacity=window)
+        for r in readings[:window]:
+            station.append(r)
+        for r in readings[window:]:
+            station.append(r)
+        # Same lines as refitting the last `window` readings from scratch
+        x = np.arange(window)
+        for i, param in enumerate(Forecaster.PARAMS):
+            slope, intercept = np.polyfit(x, [r[param] for r in readings[-window:]], 1)
+            fit_slope, fit_intercept, _ = station.fit()[param]
+            assert np.isclose(slope, fit_slope, atol=1e-9) and np.isclose(intercept, fit_intercept, atol=1e-6)
+
+        tail = readings[-window:]
+        refit = _timeit(lambda: [np.polyfit(x, [r[p] for r in tail], 1) for p in Forecaster.PARAMS], repeat=5)
+        incremental = _timeit(lambda: (station.append(tail[-1]), station.fit()), repeat=5)
+        print(f"window {window:>6}: polyfit refit {refit * 1e3:8.3f} ms  append+fit {incremental * 1e3:6.3f} ms "
+              f"({refit / incremental:7.1f}x)")
+
+
+def bench_forecast_payload(points=60):
+    """Full per-step projection vs compact forecast: payload size and compute+serialize time."""
+    rng = np.random.default_rng(5)
+    history = [
+        {"ph": 7 + rng.normal(0, 0.05), "temperature": 27 + 0.02 * i, "dissolved_oxygen": 7 - 0.01 * i,
+         "turbidity": 8 + rng.normal(), "timestamp": str(i)}
+        for i in range(20)
+    ]
+    print("== /api/forecast payload: full projection vs compact ==")
+    for timeframe in Forecaster.STEPS_MAP:
+        def full():
+            start_time, projections, insights = Forecaster.predict_trends(history, timeframe)
+            return json.dumps({"start_time": start_time, "projections": projections, "insights": insights})
+
+        def compact():
+            return json.dumps(Forecaster.compact_trends(history, timeframe, points))
+
+        full_t, compact_t = _timeit(full, repeat=5), _timeit(compact, repeat=5)
+        full_len, compact_len = len(full()), len(compact())
+        print(f"{timeframe:>4}: full {full_len / 1024:8.1f} KiB {full_t * 1e3:7.2f} ms   "
+              f"compact {compact_len / 1024:5.1f} KiB {compact_t * 1e3:5.2f} ms   "
+              f"({full_len / compact_len:6.1f}x smaller, {full_t / compact_t:6.1f}x faster)")
+
+
+def bench_forecast_memo(updates=200, reposts=4, concurrency=8):
+    """Dashboard-style /api/forecast traffic: each history is re-posted several times, some concurrently."""
+    import asyncio
+
+    import httpx
+
+    import main
+
+    rng = np.random.default_rng(11)
+    history = []
+    for i in range(20):
+        history.append({"ph": 7 + rng.normal(0, 0.05), "temperature": 27 + rng.normal(), "dissolved_oxygen": 7.0,
+                        "turbidity": 8.0, "timestamp": str(i)})
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for i in range(updates):
+                history.append(dict(history[-1], temperature=27 + rng.normal(), timestamp=str(20 + i)))
+                body = {"history": history[-20:], "timeframe": "1h"}
+                # Open tabs post the new history at the same time, then currentData changes re-post it
+                await asyncio.gather(*(client.post("/api/forecast", json=body) for _ in range(concurrency)))
+                for _ in range(reposts):
+                    await client.post("/api/forecast", json=body)
+
+    main.forecast_memo = main.AsyncMemo(maxsize=1024, ttl=60, max_bytes=main.forecast_memo.cache.max_bytes)
+    start = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    stats = main.forecast_memo.stats()
+    total = updates * (reposts + concurrency)
+    print("== /api/forecast memoization under dashboard re-posts ==")
+    print(f"{total} requests in {elapsed:.2f} s  computed {stats['misses'] - stats['coalesced']}  "
+          f"hits {stats['hits']} ({stats['hit_ratio']:.1%})  coalesced {stats['coalesced']}  "
+          f"compute {stats['compute_ms']:.0f} ms  saved {stats['saved_ms']:.0f} ms")
+
+
+DATASET_CSV = "../dataset/Water Quality Monitoring Dataset_ Ireland.csv"
+
+
+def bench_forecast_methods(horizons=(1, 3), min_length=40):
+    """Walk-forward accuracy vs update+forecast cost of each forecasting method on the Ireland dataset."""
+    df = pd.read_csv(DATASET_CSV, usecols=["WaterbodyName", "pH", "Temperature", "Dissolved Oxygen"])
+    df = df.rename(columns={"pH": "ph", "Temperature": "temperature", "Dissolved Oxygen": "dissolved_oxygen"})
+    df = df.dropna()
+    df["turbidity"] = 10.0 # not in the dataset
+    series = [g[list(Forecaster.PARAMS)].to_numpy() for _, g in df.groupby("WaterbodyName", sort=False)
+              if len(g) >= min_length]
+
+    methods = {
+        "linear (window 20)": lambda: StationHistory(capacity=20),
+        "holt": lambda: HoltForecaster(alpha=0.5, beta=0.1),
+        "holt_winters (m=12)": lambda: HoltWintersForecaster(alpha=0.5, beta=0.1, gamma=0.2, season_length=12),
+    }
+    scored = [Forecaster.PARAMS.index(p) for p in ("ph", "temperature", "dissolved_oxygen")]
+
+    print(f"== forecast methods on the Ireland replay ({len(series)} waterbodies, {sum(map(len, series))} readings) ==")
+    for name, factory in methods.items():
+        errors = {h: [] for h in horizons}
+        elapsed = 0.0
+        updates = 0
+        for values in series:
+            model = factory()
+            for t in range(len(values) - max(horizons)):
+                start = time.perf_counter()
+                model.append(dict(zip(Forecaster.PARAMS, values[t])), timestamp=str(t))
+                fits = model.fit() if model.count >= 5 else None
+                seasonal = model.seasonal(max(horizons)) if fits else None
+                elapsed += time.perf_counter() - start
+                updates += 1
+                if fits is None:
+                    continue
+                for h in horizons:
+                    predicted = []
+                    for param in Forecaster.PARAMS:
+                        slope, intercept, _ = fits[param]
+                        y = slope * (model.count - 1 + h) + intercept
+                        if seasonal:
+                            y += float(seasonal[param](h))
+                        predicted.append(y)
+                    errors[h].append(np.abs(np.array(predicted) - values[t + h])[scored])
+        maes = "  ".join(
+            f"h={h} MAE pH {np.mean(errors[h], axis=0)[0]:.3f} T {np.mean(errors[h], axis=0)[1]:.2f} "
+            f"DO {np.mean(errors[h], axis=0)[2]:.2f}"
+            for h in horizons
+        )
+        print(f"{name:>20}: {elapsed / updates * 1e6:6.1f} us/update+fit  {maes}")
+
+
+_STARTUP_SCRIPT = """
+import sys, time
+import pandas as pd
+from data_loader import DatasetStreamer
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmRSS"))
+
+csv_path, cache_dir, mode = sys.argv[1:4]
+before = rss_kb()
+start = time.perf_counter()
+if mode == "full-csv":
+    df = pd.read_csv(csv_path) # the original loader: every column, float64 frame
+    data = pd.DataFrame({c: pd.to_numeric(df[c], errors="coerce") for c in DatasetStreamer.COLUMNS})
+    del df
+    rows = len(data)
+else:
+    streamer = DatasetStreamer(csv_path, cache_dir=cache_dir)
+    rows = len(streamer)
+    streamer.get_next()
+elapsed = time.perf_counter() - start
+print(elapsed, rss_kb() - before, rows)
+"""
+
+
+def bench_dataset_startup(scales=(1, 20)):
+    """DatasetStreamer start-up: full CSV parse vs binary cache build (cold) vs memory-mapped reuse (warm)."""
+    import os
+    import subprocess
+    import tempfile
+
+    print("== dataset start-up (fresh process each, RSS growth after imports) ==")
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            csv_path = DATASET_CSV
+            if scale > 1:
+                # Same data repeated, to see how each path scales with file size
+                csv_path = os.path.join(tmp, f"ireland_x{scale}.csv")
+                df = pd.read_csv(DATASET_CSV)
+                pd.concat([df] * scale, ignore_index=True).to_csv(csv_path, index=False)
+            cache_dir = os.path.join(tmp, f"cache_x{scale}")
+            size_mb = os.path.getsize(csv_path) / 1e6
+            for mode in ("full-csv", "cold", "warm"):
+                out = subprocess.run(
+                    [sys.executable, "-c", _STARTUP_SCRIPT, csv_path, cache_dir, mode],
+                    capture_output=True, text=True, check=True
+                ).stdout.split("\n")[-2].split()
+                elapsed, rss_kb, rows = float(out[0]), int(out[1]), int(out[2])
+                print(f"{size_mb:6.1f} MB CSV ({rows:>7} rows)  {mode:>8}: {elapsed * 1e3:7.1f} ms  "
+                      f"+{rss_kb / 1024:6.1f} MB RSS")
+
+
+def bench_dataset_replay(sizes=(100, 1_000, 10_000)):
+    """Replaying n readings: n get_next calls vs one get_window(n) block."""
+    from data_loader import DatasetStreamer
+
+    streamer = DatasetStreamer(DATASET_CSV)
+    print(f"== dataset replay ({len(streamer)} rows) ==")
+    for n in sizes:
+        streamer.index = 0
+        rows = [streamer.get_next() for _ in range(n)]
+        streamer.index = 0
+        block = streamer.get_window(n)
+        assert all(block[k][i] == rows[i][k] for i in range(n) for k in streamer.CHANNELS)
+
+        def loop():
+            streamer.index = 0
+            return [streamer.get_next() for _ in range(n)]
+
+        def window():
+            streamer.index = 0
+            return streamer.get_window(n)
+
+        t_loop = _timeit(loop)
+        t_window = _timeit(window)
+        print(f"n={n:>6}: get_next loop {t_loop * 1e3:8.2f} ms  get_window {t_window * 1e3:7.3f} ms  "
+              f"({t_loop / t_window:6.1f}x)")
+
+
+def bench_station_replay(cursors=500, threads=8, reads=100_000):
+    """Many independent per-station cursors read concurrently: throughput, and no duplicated or skipped readings."""
+    import threading
+    from data_loader import DatasetStreamer
+
+    streamer = DatasetStreamer(DATASET_CSV)
+    names = [streamer.stations[i % len(streamer.stations)] for i in range(cursors)]
+    pool = [streamer.cursor(f"pond-{i}", name) for i, name in enumerate(names)]
+    rng = np.random.default_rng(0)
+    picks = rng.integers(0, cursors, reads)
+    served = [[] for _ in range(cursors)]
+
+    def worker(part):
+        for k in part:
+            served[k].append(pool[k].get_next()["ph"])
+
+    parts = np.array_split(picks, threads)
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(part,)) for part in parts]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    # Each cursor must have served exactly the first len(values) readings of its station (threads may reorder them)
+    for k, values in enumerate(served):
+        expected = streamer.read_rows(np.resize(streamer.station_rows(names[k]), len(values)))["ph"]
+        assert sorted(values) == sorted(expected.tolist())
+    print(f"== station replay: {cursors} cursors over {len(set(names))} waterbodies, {threads} threads ==")
+    print(f"{reads} reads in {elapsed:.2f} s ({reads / elapsed:,.0f} readings/s), no duplicates or gaps")
+
+
+def bench_live_stream(subscribers=1_000, frames=10, interval=0.2, stalled=50, port=8766):
+    """1,000 SSE subscribers on /api/live-stream: one evaluation per tick, fan-out skew, and stalled-client drops."""
+    import asyncio
+    import os
+    import subprocess
+
+    import httpx
+
+    from live_stream import LiveBroadcaster
+
+    # Server in its own process so the 1,000 clients don't share its GIL
+    env = {**os.environ, "LIVE_STREAM_INTERVAL": str(interval)}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+         "--backlog", "4096"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base = f"http://127.0.0.1:{port}"
+
+    async def subscriber(client, received, ready):
+        async with client.stream("GET", f"{base}/api/live-stream") as response:
+            ready.release()
+            async for line in response.aiter_lines():
+                if line.startswith("id: "):
+                    received.append((time.perf_counter(), line))
+                    if len(received) == frames:
+                        return
+
+    async def run():
+        async with httpx.AsyncClient(timeout=60) as probe:
+            while True:
+                try:
+                    await probe.get(f"{base}/")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+
+        received = [[] for _ in range(subscribers)]
+        ready = asyncio.Semaphore(0)
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+            tasks = [asyncio.create_task(subscriber(client, received[i], ready)) for i in range(subscribers)]
+            for _ in range(subscribers):
+                await ready.acquire()
+            await asyncio.gather(*tasks)
+            stats = (await client.get(f"{base}/api/stream-stats")).json()["live"]
+        return received, stats
+
+    async def stalled_clients():
+        # Subscribers that never read: each mailbox must stay at `buffer` frames
+        broadcaster = LiveBroadcaster(lambda: asyncio.sleep(0, {"tick": True}), interval=0.01)
+        streams = [broadcaster.stream() for _ in range(stalled)]
+        for stream in streams:
+            await stream.__anext__()
+        await asyncio.sleep(frames * 0.01 * 5)
+        depth = max(sub.queue.qsize() for sub in broadcaster.subscribers)
+        for stream in streams:
+            await stream.aclose()
+        await broadcaster.close()
+        return broadcaster.stats(), depth
+
+    try:
+        received, stats = asyncio.run(run())
+    finally:
+        server.terminate()
+        server.wait()
+
+    # Frames are keyed by their SSE id (the tick number)
+    by_frame = {}
+    for r in received:
+        for at, line in r:
+            by_frame.setdefault(line, []).append(at)
+    skew = [max(ts) - min(ts) for ts in by_frame.values() if len(ts) == subscribers]
+
+    print(f"== /api/live-stream: {subscribers} SSE subscribers, {frames} frames each, tick {interval * 1e3:.0f} ms ==")
+    print(f"server ticks (reads + evaluations): {stats['ticks']}   polling equivalent: {subscribers * frames}")
+    print(f"frames sent {stats['frames_sent']}  fan-out {stats['fanout_ms_per_tick']:.2f} ms/tick  "
+          f"client-observed delivery skew p50 {np.median(skew) * 1e3:.1f} ms  max {max(skew) * 1e3:.1f} ms")
+    stalled_stats, depth = asyncio.run(stalled_clients())
+    print(f"{stalled} stalled subscribers over {stalled_stats['ticks']} ticks: "
+          f"{stalled_stats['frames_dropped']} stale frames dropped, max mailbox depth {depth}")
+
+
+class _LocalBroker:
+    """In-process stand-in for an MQTT broker: publish() delivers to prefix subscribers on the caller's thread."""
+
+    def __init__(self):
+        self.subscribers = [] # (topic prefix, callback(topic, payload))
+        self.published = 0
+
+    def subscribe(self, prefix, callback):
+        self.subscribers.append((prefix, callback))
+
+    def publish(self, topic, payload):
+        self.published += 1
+        for prefix, callback in self.subscribers:
+            if topic.startswith(prefix):
+                callback(topic, payload)
+
+
+def _sensor_frames(n, stations=1_000, seed=7):
+    """Frames in the Sensors_FormatPayload layout, with per-station topics."""
+    cols = _random_readings(n, seed=seed, healthy_fraction=0.7)
+    salinity = np.random.default_rng(seed).uniform(10, 20, n)
+    return [
+        (f"water/raw/pond-{i % stations}",
+         f"PH={cols['ph'][i]:.2f},TUR={cols['turbidity'][i]:.2f},SAL={salinity[i]:.2f},"
+         f"NH3={cols['ammonia'][i]:.2f},T={cols['temperature'][i]:.1f}".encode())
+        for i in range(n)
+    ]
+
+
+def bench_mqtt_ingest(messages=100_000, batch_sizes=(1, 100, 1_000)):
+    """MQTT ingest throughput through an in-process broker: per-message analysis vs micro-batches, rules and rules+ML."""
+    import os
+    import threading
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "MQTT"))
+    import mqtt_analysis
+    from sensor_frames import parse_frame
+
+    frames = _sensor_frames(messages)
+
+    # Parity: the batched rules agree with ExpertRules.evaluate on every frame
+    columns, stations, _ = mqtt_analysis.parse_batch(frames[:2_000])
+    batched = mqtt_analysis.analyze_batch(columns, stations)
+    for i, (topic, payload) in enumerate(frames[:2_000]):
+        readings, _ = parse_frame(payload)
+        assert all(batched["readings"][k][i] == v for k, v in readings.items())
+        reference = ExpertRules.evaluate(SimpleNamespace(dissolved_oxygen=float("nan"), **readings))
+        assert batched["risk_level"][i] == reference["risk_status"]
+        assert batched["health_score"][i] == reference["health_score"]
+        assert batched["station"][i] == topic.rsplit("/", 1)[1]
+
+    def legacy():
+        # One message at a time in the paho callback: parse, evaluate, publish the same fields as JSON
+        broker = _LocalBroker()
+
+        def on_message(topic, payload):
+            readings, _ = parse_frame(payload)
+            analysis = ExpertRules.evaluate(SimpleNamespace(dissolved_oxygen=float("nan"), **readings))
+            broker.publish("water/analysis", json.dumps({
+                "station": topic.rsplit("/", 1)[1], "readings": readings, "risk_level": analysis["risk_status"],
+                "health_score": analysis["health_score"], "alerts": analysis["triggers"], "timestamp": time.time()
+            }))
+
+        broker.subscribe("water/raw", on_message)
+        start = time.perf_counter()
+        for topic, payload in frames[:20_000]:
+            broker.publish(topic, payload)
+        return 20_000 / (time.perf_counter() - start)
+
+    def batched_run(batch_size, classifier, topic):
+        broker = _LocalBroker()
+        service = mqtt_analysis.IngestService(broker.publish, batch_size=batch_size, batch_interval=0.01,
+                                              max_pending=messages, classifier=classifier, topic=topic)
+        broker.subscribe("water/raw", service.submit)
+        start = time.perf_counter()
+        service.start()
+        producer = threading.Thread(target=lambda: [broker.publish(t, p) for t, p in frames])
+        producer.start()
+        producer.join()
+        service.stop()
+        elapsed = time.perf_counter() - start
+        stats = service.stats()
+        assert stats["analyzed"] == messages and stats["dropped"] == 0
+        return messages / elapsed, stats
+
+    print(f"== MQTT ingest, {messages} frames from 1,000 stations via in-process broker ==")
+    print(f"{'per-message (legacy shape)':>40}: {legacy():>9,.0f} msg/s")
+    classifier = mqtt_analysis.DiseaseClassifier()
+    # Per-frame messages on water/analysis plus the batch document, or the batch document only
+    for label, clf in (("rules", None), ("rules + ML", classifier)):
+        for topic in (mqtt_analysis.TOPIC_ANALYSIS, None):
+            for batch_size in batch_sizes:
+                rate, stats = batched_run(batch_size, clf, topic)
+                name = f"{label} batch {batch_size}" + ("" if topic else ", batch topic only")
+                print(f"{name:>40}: {rate:>9,.0f} msg/s  ({stats['batches']} batches, avg {stats['avg_batch']:.0f})")
+
+
+class _MiniBroker:
+    """
+    Just enough MQTT 3.1.1 (CONNECT, SUBSCRIBE, QoS 0/1 PUBLISH, PING, DISCONNECT) to
+    run real paho clients against, on its own thread and event loop.
+    """
+
+    def __init__(self, port):
+        import asyncio
+        import threading
+
+        self.port = port
+        self.subscriptions = {} # writer -> topic filters
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        threading.Thread(target=self._serve, daemon=True).start()
+        self.ready.wait()
+
+    def _serve(self):
+        import asyncio
+
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(asyncio.start_server(self._client, "127.0.0.1", self.port))
+        self.ready.set()
+        self.loop.run_forever()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    @staticmethod
+    def _packet(first, body):
+        length, encoded = len(body), bytearray()
+        while True:
+            byte, length = length % 128, length // 128
+            encoded.append(byte | (128 if length else 0))
+            if not length:
+                return bytes([first]) + bytes(encoded) + body
+
+    @staticmethod
+    def _matches(pattern, topic):
+        if pattern == "#" or pattern == topic:
+            return True
+        return pattern.endswith("/#") and (topic == pattern[:-2] or topic.startswith(pattern[:-1]))
+
+    async def _client(self, reader, writer):
+        import asyncio
+
+        try:
+            while True:
+                first = (await reader.readexactly(1))[0]
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 127) * multiplier
+                    multiplier *= 128
+                    if not byte & 128:
+                        break
+                body = await reader.readexactly(length)
+                kind = first >> 4
+                if kind == 1: # CONNECT
+                    writer.write(b"\x20\x02\x00\x00")
+                elif kind == 8: # SUBSCRIBE
+                    filters, i = self.subscriptions.setdefault(writer, []), 2
+                    while i < len(body):
+                        n = int.from_bytes(body[i:i + 2], "big")
+                        filters.append(body[i + 2:i + 2 + n].decode())
+                        i += 3 + n
+                    writer.write(self._packet(0x90, body[:2] + b"\x00" * len(filters)))
+                elif kind == 3: # PUBLISH
+                    n = int.from_bytes(body[:2], "big")
+                    topic = body[2:2 + n].decode()
+                    qos = (first >> 1) & 3
+                    payload = body[2 + n + (2 if qos else 0):]
+                    for subscriber, filters in self.subscriptions.items():
+                        if any(self._matches(f, topic) for f in filters):
+                            subscriber.write(self._packet(0x30, body[:2 + n] + payload))
+                    if qos == 1:
+                        writer.write(b"\x40\x02" + body[2 + n:4 + n])
+                elif kind == 12: # PINGREQ
+                    writer.write(b"\xd0\x00")
+                elif kind == 14: # DISCONNECT
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscriptions.pop(writer, None)
+            writer.close()
+
+
+def bench_mqtt_bridge(messages=30_000, stations=200, port=18830):
+    """In-process MQTT bridge against a real (mini) broker: throughput, queue depth, lag and overflow per policy."""
+    import asyncio
+
+    import paho.mqtt.client as mqtt
+
+    import main
+    from mqtt_bridge import MQTTBridge, ReadingQueue
+
+    broker = _MiniBroker(port)
+    frames = _sensor_frames(messages, stations=stations)
+
+    def publish_all():
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        client.connect("127.0.0.1", port)
+        client.loop_start()
+        for topic, payload in frames:
+            client.publish(topic, payload)
+        return client
+
+    async def run(policy, slow):
+        async def handle(batch):
+            await main.compute_pool.run(main.analyze_live_readings, batch, stateful=True)
+            if slow:
+                await asyncio.sleep(0.005) # analysis that falls behind (e.g. a slow model or I/O)
+
+        bridge = MQTTBridge(handle, "127.0.0.1", port, queue=ReadingQueue(500, policy), batch_size=64)
+        await bridge.start()
+        while not bridge.connected:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05) # SUBACK
+        start = time.perf_counter()
+        publisher = await asyncio.to_thread(publish_all)
+        while bridge.received < messages and time.perf_counter() - start < 30:
+            await asyncio.sleep(0.01)
+        received_in = time.perf_counter() - start
+        while len(bridge.queue) and time.perf_counter() - start < 60:
+            await asyncio.sleep(0.01)
+        publisher.loop_stop()
+        publisher.disconnect()
+        stats = bridge.stats()
+        await bridge.stop()
+        return received_in, stats
+
+    print(f"== MQTT bridge: {messages} frames from {stations} stations through a local broker ==")
+    try:
+        for slow in (False, True):
+            for policy in ReadingQueue.POLICIES:
+                main.live_readings.clear()
+                elapsed, stats = asyncio.run(run(policy, slow))
+                q = stats["queue"]
+                live = main.read_live_data("pond-7")
+                assert live["source"] == "mqtt" and live["station"] == "pond-7"
+                label = f"{policy}{' (slow analysis)' if slow else ''}"
+                print(f"{label:>28}: {stats['received'] / elapsed:8,.0f} msg/s  analyzed {q['dequeued']:>6}  "
+                      f"dropped {q['dropped']:>6}  coalesced {q['coalesced']:>6}  max depth {q['max_depth']:>4}  "
+                      f"lag p50 {q['lag_ms_p50']:7.2f} ms  p99 {q['lag_ms_p99']:7.2f} ms")
+    finally:
+        broker.close()
+
+
+def bench_lora_gateway(rate=20_000, duration=2.0, port=18831):
+    """LoRa gateway: idle CPU vs the old busy-wait, throughput to a broker, and radio-callback latency with a stalled broker."""
+    import os
+    import threading
+
+    import paho.mqtt.client as mqtt
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "LoRa Gateway"))
+    from gateway_lora_rx import LoRaGateway
+    from radio import SimulatedSX127x
+
+    def cpu_percent(fn, seconds):
+        start_cpu, start = time.process_time(), time.perf_counter()
+        fn(seconds)
+        return (time.process_time() - start_cpu) / (time.perf_counter() - start) * 100
+
+    def busy_wait(seconds):
+        # The old main loop: `while True: pass`
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            pass
+
+    def idle_gateway(seconds):
+        gateway = LoRaGateway(SimulatedSX127x(nodes=10, rate=1), lambda topic, payload: None).start()
+        threading.Event().wait(seconds)
+        gateway.stop()
+
+    print("== LoRa gateway ==")
+    print(f"idle CPU: busy-wait main loop {cpu_percent(busy_wait, duration):5.1f}%  "
+          f"event-driven gateway (1 pkt/s) {cpu_percent(idle_gateway, duration):5.1f}%")
+
+    # Throughput into a real (mini) broker
+    broker = _MiniBroker(port)
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.connect("127.0.0.1", port)
+    client.loop_start()
+    gateway = LoRaGateway(SimulatedSX127x(nodes=1_000, rate=rate, seed=1), client.publish).start()
+    time.sleep(duration)
+    gateway.stop()
+    stats = gateway.stats()
+    client.disconnect()
+    client.loop_stop()
+    time.sleep(0.1)
+    broker.close()
+    print(f"{rate:,} pkt/s offered for {duration:.0f} s: received {stats['received']:,}  "
+          f"published {stats['published']:,}  dropped {stats['dropped']}  errors {stats['publish_errors']}")
+
+    # Broker stalls: every publish blocks for 200 ms. The radio callback must stay fast.
+    latencies = []
+
+    class TimedGateway(LoRaGateway):
+        def on_receive(self, payload):
+            start = time.perf_counter()
+            super().on_receive(payload)
+            latencies.append(time.perf_counter() - start)
+
+    gateway = TimedGateway(SimulatedSX127x(nodes=1_000, rate=5_000, seed=2),
+                           lambda topic, payload: time.sleep(0.2), queue_size=2_000).start()
+    time.sleep(duration)
+    stats = gateway.stats()
+    gateway.radio.stop()
+    lat = np.array(latencies) * 1e6
+    print(f"stalled broker: {stats['received']:,} received  {stats['published']} published  "
+          f"{stats['dropped']:,} dropped (queue {gateway.queue_size})  "
+          f"on_receive p50 {np.percentile(lat, 50):.1f} us  p99 {np.percentile(lat, 99):.1f} us  max {lat.max():.0f} us")
+
+
+def bench_gateway_spool(sensors=1_000, report_interval=60, hours=24, drain_rates=(2_000, 10_000), port=18832):
+    """Gateway disk spool: write throughput and recovery time for a full outage (one reading per sensor per interval)."""
+    import os
+    import shutil
+    import tempfile
+
+    import paho.mqtt.client as mqtt
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "LoRa Gateway"))
+    from gateway_lora_rx import LoRaGateway
+    from radio import SimulatedSX127x
+    from spool import DiskSpool
+
+    records = sensors * hours * 3600 // report_interval
+    sim = SimulatedSX127x(nodes=sensors, seed=3, with_id=True)
+    frames = [sim.frame(node) for node in range(sensors)]
+    outage_start = time.time() - hours * 3600
+    print(f"== Gateway spool: {hours} h outage, {sensors:,} sensors every {report_interval} s = {records:,} readings ==")
+
+    directory = tempfile.mkdtemp(prefix="spool-bench-")
+    try:
+        # fsync per record vs batched (the per-record run is sampled and extrapolated)
+        sample = 2_000
+        spool = DiskSpool(os.path.join(directory, "unbatched"), fsync_every=1)
+        start = time.perf_counter()
+        for i in range(sample):
+            spool.append(frames[i % sensors])
+        per_record = (time.perf_counter() - start) / sample
+        spool.close()
+
+        spool = DiskSpool(os.path.join(directory, "spool"))
+        start = time.perf_counter()
+        for i in range(records):
+            spool.append(frames[i % sensors], outage_start + i * report_interval / sensors)
+        spool.close()
+        elapsed = time.perf_counter() - start
+        stats = spool.stats()
+        print(f"write fsync every record: {1 / per_record:>9,.0f} rec/s  ({records * per_record:,.0f} s for the outage)")
+        print(f"write fsync every {spool.fsync_every:<5}: {records / elapsed:>9,.0f} rec/s  ({elapsed:.1f} s, "
+              f"{stats['pending_bytes'] / 2**20:.0f} MB in {stats['segments']} segments, {stats['fsyncs']:,} fsyncs)")
+        print(f"outage load is {sensors / report_interval:.0f} rec/s, "
+              f"{records / elapsed / (sensors / report_interval):,.0f}x headroom")
+
+        # Recovery: reopen the spool (as after a restart) and drain it to a local broker, unthrottled
+        broker = _MiniBroker(port)
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        client.max_queued_messages_set(0)
+        client.connect("127.0.0.1", port)
+        client.loop_start()
+        spool = DiskSpool(os.path.join(directory, "spool"))
+        idle_radio = SimulatedSX127x(nodes=1, rate=1e-3)
+        gateway = LoRaGateway(idle_radio, client.publish, spool=spool, connected=client.is_connected,
+                              drain_rate=0, drain_batch=2_000, retry_interval=0.05)
+        start = time.perf_counter()
+        gateway.start()
+        while not spool.empty():
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        gateway.stop()
+        client.disconnect()
+        client.loop_stop()
+        time.sleep(0.1)
+        broker.close()
+        print(f"drain unthrottled to broker: {gateway.replayed:,} replayed in {elapsed:.1f} s "
+              f"({gateway.replayed / elapsed:,.0f} msg/s), corrupt {spool.corrupt}")
+        for rate in drain_rates:
+            print(f"drain at {rate:,} msg/s (GATEWAY_DRAIN_RATE): recovery {records / rate / 60:,.1f} min "
+                  f"alongside {sensors / report_interval:.0f} msg/s live")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_frame_codec(frames=100_000, sensors=1_000):
+    """Binary vs text sensor frames: encode/decode throughput and LoRa air time at SF7/125 kHz."""
+    import os
+
+    from sensor_frames import decode_batch, decode_frame, encode_frame, parse_batch, parse_frame
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "LoRa Gateway"))
+    from radio import time_on_air
+
+    rng = np.random.default_rng(5)
+    values = np.column_stack([
+        rng.uniform(6.5, 8.5, frames), rng.uniform(5, 30, frames), rng.uniform(10, 20, frames),
+        rng.uniform(0, 0.06, frames), rng.uniform(22, 32, frames)
+    ]).tolist()
+    names = ("ph", "turbidity", "salinity", "ammonia", "temperature")
+    readings = [dict(zip(names, row)) for row in values]
+
+    print(f"== Sensor frame codec ({frames:,} frames) ==")
+    encode_text = lambda: [("PH=%.2f,TUR=%.2f,SAL=%.2f,NH3=%.2f,T=%.1f" % tuple(row)).encode() for row in values]
+    encode_binary = lambda: [encode_frame(r, i % sensors, i // sensors) for i, r in enumerate(readings)]
+    text_encode, binary_encode = _timeit(encode_text), _timeit(encode_binary)
+    text, binary = encode_text(), encode_binary()
+    text_bytes, binary_bytes = np.mean([len(f) for f in text]), np.mean([len(f) for f in binary])
+    print(f"{'':22}{'text':>12}{'binary':>12}")
+    print(f"{'frame bytes':22}{text_bytes:>12.1f}{binary_bytes:>12.1f}")
+    print(f"{'encode (frames/s)':22}{frames / text_encode:>12,.0f}{frames / binary_encode:>12,.0f}")
+
+    text_one = _timeit(lambda: [parse_frame(f) for f in text])
+    binary_one = _timeit(lambda: [decode_frame(f) for f in binary])
+    print(f"{'decode one by one':22}{frames / text_one:>12,.0f}{frames / binary_one:>12,.0f}")
+    text_messages = [("water/raw", f) for f in text]
+    binary_messages = [("water/raw", f) for f in binary]
+    text_batch = _timeit(lambda: parse_batch(text_messages))
+    binary_batch = _timeit(lambda: parse_batch(binary_messages))
+    print(f"{'parse_batch':22}{frames / text_batch:>12,.0f}{frames / binary_batch:>12,.0f}")
+    buffer = b"".join(binary)
+    verified = _timeit(lambda: decode_batch(buffer))
+    unverified = _timeit(lambda: decode_batch(buffer, verify=False))
+    _, columns, valid = decode_batch(buffer)
+    print(f"{'decode_batch (CRC)':22}{'':>12}{frames / verified:>12,.0f}")
+    print(f"{'decode_batch (no CRC)':22}{'':>12}{frames / unverified:>12,.0f}")
+    assert valid.all() and np.allclose(columns["temperature"], [r["temperature"] for r in readings], atol=0.005)
+
+    # Air time for the typical frame of each format; EU868 sub-bands allow 1% duty cycle
+    print("LoRa time on air (CR 4/5, 8-symbol preamble, explicit header, CRC on):")
+    for sf in (7, 9, 12):
+        text_air, binary_air = time_on_air(round(text_bytes), sf=sf), time_on_air(round(binary_bytes), sf=sf)
+        print(f"  SF{sf:<2}/125 kHz: text {text_air * 1e3:7.1f} ms  binary {binary_air * 1e3:7.1f} ms  "
+              f"(-{(1 - binary_air / text_air) * 100:.0f}%)  max frames/hour at 1% duty: "
+              f"{36 / text_air:,.0f} -> {36 / binary_air:,.0f}")
+
+
+def bench_edge_aggregation(sensors=1_000, report_interval=5, window=60, windows=10, critical_fraction=0.01,
+                           live_rate=5_000, live_window=1.0, duration=3.0):
+    """Gateway edge aggregation: broker message reduction, aggregation throughput and critical-alert latency."""
+    import os
+    import threading
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "LoRa Gateway"))
+    from aggregator import EdgeAggregator
+    from gateway_lora_rx import LoRaGateway
+    from radio import SimulatedSX127x
+    from sensor_frames import TOPIC_ROLLUP, encode_frame
+
+    class PondSensors(SimulatedSX127x):
+        # Healthy readings with a small share of toxic-ammonia spikes; records when each spike was sent
+        sent_at = {}
+
+        def frame(self, node):
+            rng = self._rng
+            readings = {"ph": rng.uniform(7.0, 8.0), "turbidity": rng.uniform(5, 14), "salinity": rng.uniform(10, 20),
+                        "ammonia": rng.uniform(0, 0.02), "temperature": rng.uniform(24, 30)}
+            critical = rng.random() < critical_fraction
+            if critical:
+                readings["ammonia"] = 0.08
+            payload = encode_frame(readings, node, self.sent // self.nodes)
+            if critical:
+                self.sent_at[payload] = time.perf_counter()
+            return payload
+
+    print(f"== Edge aggregation: {sensors:,} sensors every {report_interval} s, {window} s windows, "
+          f"{critical_fraction:.0%} critical ==")
+    now = [0.0]
+    aggregator = EdgeAggregator(window, clock=lambda: now[0])
+    radio = PondSensors(nodes=sensors, seed=4)
+    per_window = sensors * window // report_interval
+    batches = []
+    for _ in range(windows):
+        frames = [radio.frame(i % sensors) for i in range(per_window)]
+        radio.sent += per_window
+        batches.append([frames[i:i + 500] for i in range(0, per_window, 500)])
+    forwarded = rollups = 0
+    start = time.perf_counter()
+    for w, window_batches in enumerate(batches):
+        for batch in window_batches:
+            forwarded += len(aggregator.add(batch))
+        now[0] = (w + 1) * window
+        rollups += len(aggregator.flush())
+    elapsed = time.perf_counter() - start
+    raw = windows * per_window
+    print(f"messages to broker: raw {raw:,}  aggregated {rollups + forwarded:,} "
+          f"({rollups:,} rollups + {forwarded:,} critical raw)  -> {raw / (rollups + forwarded):.1f}x fewer "
+          f"(window factor {window // report_interval})")
+    print(f"aggregation: {raw / elapsed:,.0f} frames/s on one core")
+
+    # Live: critical frames go out as soon as they are drained, not at the end of the window
+    published = []
+    radio = PondSensors(nodes=sensors, rate=live_rate, seed=5)
+    PondSensors.sent_at = {}
+    gateway = LoRaGateway(radio, lambda topic, payload: published.append((time.perf_counter(), topic, payload)),
+                          aggregator=EdgeAggregator(live_window)).start()
+    threading.Event().wait(duration)
+    gateway.stop()
+    latencies = np.array([
+        t - PondSensors.sent_at[payload] for t, topic, payload in published if payload in PondSensors.sent_at
+    ]) * 1e3
+    rollup_count = sum(topic == TOPIC_ROLLUP for _, topic, _ in published)
+    stats = gateway.stats()
+    print(f"live {live_rate:,} pkt/s, {live_window:.0f} s windows: received {stats['received']:,}  "
+          f"published {stats['published']:,} ({rollup_count:,} rollups)")
+    print(f"critical alert latency: p50 {np.percentile(latencies, 50):.2f} ms  p99 {np.percentile(latencies, 99):.2f} ms  "
+          f"max {latencies.max():.2f} ms over {len(latencies)} alerts (window {live_window * 1e3:.0f} ms)")
+
+
+def bench_timeseries_store(rows=100_000_000, batch=1_000_000, queries=2_000, window=3_600):
+    """Time-series store: bulk and per-reading ingest, range queries and retention for one station of `rows` 1 Hz readings."""
+    import os
+    import shutil
+    import tempfile
+
+    from timeseries_store import TimeSeriesStore
+
+    root = tempfile.mkdtemp(prefix="tsstore-bench-")
+    try:
+        store = TimeSeriesStore(root)
+        rng = np.random.default_rng(11)
+        values = {name: rng.uniform(0, 40, batch).astype(np.float32) for name in store.channels}
+        offsets = np.arange(batch, dtype=np.float64)
+        t0 = 1.7e9
+        print(f"== Time-series store: {rows:,} rows x {len(store.channels)} channels, one station ==")
+        start = time.perf_counter()
+        for i in range(0, rows, batch):
+            store.append("pond-1", t0 + i + offsets, values)
+        elapsed = time.perf_counter() - start
+        stats = store.stats()
+        disk = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+        print(f"bulk ingest ({batch:,}-row batches): {rows / elapsed:,.0f} rows/s  ({elapsed:.1f} s, "
+              f"{stats['segments']} segments, {disk / 2**30:.2f} GiB)")
+
+        small = TimeSeriesStore(os.path.join(root, "small"))
+        n = 100_000
+        reading = {name: 1.0 for name in small.channels}
+        start = time.perf_counter()
+        for i in range(n):
+            small.append_one("node-1", t0 + i, reading)
+        print(f"per-reading ingest (append_one):  {n / (time.perf_counter() - start):,.0f} rows/s")
+
+        start = time.perf_counter()
+        reopened = TimeSeriesStore(root)
+        print(f"reopen: {(time.perf_counter() - start) * 1e3:.1f} ms for {reopened.count('pond-1'):,} rows")
+
+        starts = t0 + rng.uniform(0, rows - window, queries)
+        latencies = []
+        for s in starts.tolist():
+            begin = time.perf_counter()
+            result = reopened.query("pond-1", s, s + window, ("temperature", "ph"))
+            float(result["temperature"].mean())
+            latencies.append(time.perf_counter() - begin)
+        lat = np.array(latencies) * 1e6
+        print(f"range query ({window:,} rows, 2 channels, mean computed): p50 {np.percentile(lat, 50):.0f} us  "
+              f"p99 {np.percentile(lat, 99):.0f} us")
+        begin = time.perf_counter()
+        views = reopened.query_segments("pond-1", t0, t0 + 10_000_000)
+        total = sum(len(part["temperature"]) for part in views)
+        print(f"query_segments over {total:,} rows ({len(views)} zero-copy parts): {(time.perf_counter() - begin) * 1e3:.2f} ms")
+        begin = time.perf_counter()
+        latest = reopened.latest("pond-1", 720)
+        print(f"latest 720 rows (forecast seed): {(time.perf_counter() - begin) * 1e6:.0f} us, "
+              f"copied: {not np.shares_memory(latest['ph'], reopened.query('pond-1', latest['timestamp'][0])['ph'])}")
+
+        begin = time.perf_counter()
+        deleted = reopened.enforce_retention(max_age=rows / 2, now=t0 + rows)
+        print(f"retention (keep newest half): {deleted} segments deleted in {(time.perf_counter() - begin) * 1e3:.1f} ms, "
+              f"{reopened.count('pond-1'):,} rows left")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_weather_cache(dashboards=300, rounds=5, interval=1.0, latency=0.15, port=18840):
+    """/api/weather-impact from many dashboards against a local fake OpenWeather: upstream calls and latency."""
+    import asyncio
+
+    import httpx
+
+    import main
+    from cache import StaleWhileRevalidate
+    from tests.fakes import FakeOpenWeather
+
+    upstream = FakeOpenWeather(latency, port).start()
+    calls = upstream.calls
+    service = main.weather_service
+    service.api_key = "bench"
+    service.base_url = upstream.base_url
+    # Dashboards were opened at different times: each polls once per interval at its own offset
+    offsets = np.random.default_rng(5).uniform(0, interval, dashboards)
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        latencies = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            async def dashboard(offset):
+                started = time.perf_counter()
+                for i in range(rounds):
+                    await asyncio.sleep(max(0.0, started + offset + i * interval - time.perf_counter()))
+                    start = time.perf_counter()
+                    await client.get("/api/weather-impact")
+                    latencies.append(time.perf_counter() - start)
+
+            # Cache warmed by the first dashboard ever opened
+            await client.get("/api/weather-impact")
+            await asyncio.gather(*(dashboard(offset) for offset in offsets))
+        return np.array(latencies) * 1e3
+
+    print(f"== /api/weather-impact: {dashboards} dashboards x {rounds} polls, upstream latency {latency * 1e3:.0f} ms ==")
+    # TTLs shorter than the run, so both expiry paths are exercised
+    cases = {
+        "ttl 1 s, no stale window": (1.0, 0.0),
+        "ttl 1 s, stale-while-revalidate 60 s": (1.0, 60.0),
+    }
+    ttls = dict(service.TTLS)
+    for name, (ttl, stale_ttl) in cases.items():
+        service.TTLS = {endpoint: ttl for endpoint in ttls}
+        service.cache = StaleWhileRevalidate(stale_ttl=stale_ttl)
+        calls.clear()
+        lat = asyncio.run(run())
+        stats = service.cache.stats()
+        print(f"{name:>38}: upstream calls {calls['weather'] + calls['forecast']:>4} (uncached: {2 * dashboards * rounds})  "
+              f"p50 {np.percentile(lat, 50):6.1f} ms  p99 {np.percentile(lat, 99):6.1f} ms  max {lat.max():6.1f} ms  "
+              f"coalesced {stats['coalesced']}  stale hits {stats['stale_hits']}  misses {stats['misses']}")
+    service.TTLS = ttls
+    upstream.close()
+
+
+def bench_weather_sites(sites=100, latency=0.15, concurrency=(5, 10, 50), port=18841):
+    """Refreshing many farm sites: one client per call, sequential vs the pooled client with bounded concurrency."""
+    import asyncio
+
+    import httpx
+
+    from cache import StaleWhileRevalidate
+    from tests.fakes import FakeOpenWeather
+    from weather_service import WeatherService
+
+    upstream = FakeOpenWeather(latency, port).start()
+    calls = upstream.calls
+    base_url = upstream.base_url
+    locations = [{"site": f"farm-{i}", "lat": 51.5 + i * 0.01, "lon": -9.5 - i * 0.01} for i in range(sites)]
+
+    async def legacy():
+        # Previous behaviour: new client (new connection) per call, current then forecast, site after site
+        results = []
+        for site in locations:
+            data = []
+            for endpoint in ("weather", "forecast"):
+                async with httpx.AsyncClient() as client:
+                    params = {"lat": site["lat"], "lon": site["lon"], "appid": "bench", "units": "metric"}
+                    response = await client.get(f"{base_url}/{endpoint}", params=params)
+                    response.raise_for_status()
+                    data.append(response.json())
+            results.append(service.analyze_impact(*data))
+        return results
+
+    async def pooled(limit):
+        try:
+            return [result["impact_analysis"] for result in await service.analyze_sites(locations, limit)]
+        finally:
+            await service.aclose()
+
+    service = WeatherService(base_url=base_url)
+    service.api_key = "bench"
+    print(f"== {sites} sites x (current + forecast), upstream latency {latency * 1e3:.0f} ms ==")
+    calls.clear()
+    start = time.perf_counter()
+    expected = asyncio.run(legacy())
+    print(f"{'sequential, client per call':>32}: {time.perf_counter() - start:6.2f} s  "
+          f"requests {calls['weather'] + calls['forecast']}  connections {calls['connections']}")
+    for limit in concurrency:
+        # Cold cache each time: every site is fetched upstream
+        service.cache = StaleWhileRevalidate(stale_ttl=service.STALE_TTL)
+        calls.clear()
+        start = time.perf_counter()
+        results = asyncio.run(pooled(limit))
+        elapsed = time.perf_counter() - start
+        assert results == expected
+        print(f"{f'pooled, concurrency {limit}':>32}: {elapsed:6.2f} s  "
+              f"requests {calls['weather'] + calls['forecast']}  connections {calls['connections']}")
+    upstream.close()
+
+
+def bench_diagnosis_cache(images=500, uploads=5_000, workers=2, memory_entries=128, latency=0.02):
+    """/api/diagnose cache: per-process dict vs memory LRU + shared SQLite, across workers and a restart."""
+    import asyncio
+    import contextlib
+    import io
+    import os
+    import tempfile
+
+    from diagnosis_cache import DiagnosisCache
+    from tests.fakes import FakeVisionModel, fake_cv_service
+
+    rng = np.random.default_rng(23)
+    photos = [rng.bytes(100_000) for _ in range(images)]
+    # Popular fish are photographed far more often than others
+    picks = np.minimum(rng.zipf(1.3, uploads) - 1, images - 1)
+
+    def make_workers(cache_factory):
+        # Random bytes are not images: upload them as they are and match exact keys only
+        return [fake_cv_service(FakeVisionModel(latency), cache_factory(), preprocess=False, duplicate_distance=-1)
+                for _ in range(workers)]
+
+    async def replay(services):
+        # Requests are spread round-robin over the workers, as uvicorn --workers would
+        for i, pick in enumerate(picks.tolist()):
+            await services[i % workers].diagnose_image(photos[pick])
+        return sum(service.model.calls for service in services)
+
+    print(f"== diagnosis cache: {uploads} uploads of {images} photos (zipf), {workers} workers, then a restart ==")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "diagnosis_cache.sqlite3")
+        cases = {
+            "in-process dict (old)": lambda: DiagnosisCache(None, ttl=None, maxsize=10**9, max_bytes=1 << 40),
+            f"LRU {memory_entries} + SQLite": lambda: DiagnosisCache(path, maxsize=memory_entries),
+        }
+        for name, factory in cases.items():
+            calls = []
+            for run in ("first run", "after restart"):
+                services = make_workers(factory)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    calls.append(asyncio.run(replay(services)))
+                stats = [service.cache.stats() for service in services]
+            hits = sum(s["memory_hits"] + s["disk_hits"] for s in stats)
+            print(f"{name:>24}: model calls {calls[0]:>4} first run, {calls[1]:>4} after restart "
+                  f"(distinct photos {len(set(picks.tolist()))})  hit ratio after restart {hits / uploads:.1%}")
+        memory = sum(s["memory_hits"] for s in stats)
+        disk = sum(s["disk_hits"] for s in stats)
+        print(f"{'':>24}  after restart: memory hits {memory}  disk hits {disk}  "
+              f"lookup p50 {stats[0]['lookup_p50_us']:.0f} us  p99 {stats[0]['lookup_p99_us']:.0f} us")
+
+
+def bench_image_prep(photos=12, uplink_mbps=8.0, base_latency=0.6, tile_latency=0.05, port=18842):
+    """/api/diagnose upload path: raw phone photos vs downscaled/re-encoded, against a local fake model endpoint."""
+    import asyncio
+    import contextlib
+    import io
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import httpx
+    from PIL import Image
+
+    from executor import ComputeExecutor
+    from image_prep import prepare_image
+    from tests.fakes import fake_cv_service, phone_photo
+
+    received = []
+
+    class FakeModelEndpoint(BaseHTTPRequestHandler):
+        # Upload time at the uplink rate, then a fixed cost plus one per 768x768 tile the model processes
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            with Image.open(io.BytesIO(body)) as image:
+                width, height = image.size
+                exif = bool(image.getexif())
+            received.append((len(body), self.headers["Content-Type"], exif))
+            tiles = -(-width // 768) * -(-height // 768)
+            time.sleep(len(body) * 8 / (uplink_mbps * 1e6) + base_latency + tile_latency * tiles)
+            reply = json.dumps({"disease_name": "Healthy", "confidence": "High",
+                                "reasoning": f"{width}x{height}", "status": "Healthy"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+        def log_message(self, *args):
+            pass
+
+    class HttpModel:
+        def __init__(self):
+            self.client = None
+
+        async def generate_content_async(self, parts):
+            if self.client is None:
+                self.client = httpx.AsyncClient(timeout=120)
+            part = parts[1]
+            response = await self.client.post(f"http://127.0.0.1:{port}/generate", content=part["data"],
+                                              headers={"Content-Type": part["mime_type"]})
+            return SimpleNamespace(text=response.text)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeModelEndpoint)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    rng = np.random.default_rng(29)
+    uploads = [phone_photo(rng) for _ in range(photos)]
+    prep = _timeit(lambda: prepare_image(uploads[0]), repeat=5)
+    print(f"== /api/diagnose uploads: {photos} phone photos (4032x3024 JPEG + EXIF), uplink {uplink_mbps:g} Mbit/s ==")
+    print(f"prepare_image: {prep * 1e3:.0f} ms per photo on one core")
+
+    async def replay(service):
+        latencies = []
+        for data in uploads:
+            start = time.perf_counter()
+            await service.diagnose_image(data)
+            latencies.append(time.perf_counter() - start)
+        await service.model.client.aclose()
+        return np.array(latencies)
+
+    for name, preprocess in (("raw upload (old)", False), ("preprocessed", True)):
+        executor = ComputeExecutor("thread")
+        service = fake_cv_service(HttpModel(), executor=executor, preprocess=preprocess, duplicate_distance=-1)
+        received.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            lat = asyncio.run(replay(service))
+        executor.shutdown()
+        stats = service.stats()
+        sizes, mimes, exif = zip(*received)
+        print(f"{name:>18}: sent {stats['bytes_out'] / photos / 1e6:5.2f} MB/photo "
+              f"(saved {stats['bytes_saved'] / max(stats['bytes_in'], 1):.0%})  "
+              f"end-to-end mean {lat.mean() * 1e3:6.0f} ms  p50 {np.percentile(lat, 50) * 1e3:6.0f} ms  "
+              f"prep {stats['prep_ms'] / photos:4.0f} ms  types {sorted(set(mimes))}  exif sent {any(exif)}")
+    server.shutdown()
+    server.server_close()
+
+
+def bench_near_duplicates(stored=1_000_000, queries=20_000, radius=6, photos=60, retakes=4):
+    """Perceptual-hash near-duplicate lookup: HammingIndex at `stored` images vs a full scan, and re-photographed fish end to end."""
+    import asyncio
+    import contextlib
+    import io
+
+    from PIL import Image, ImageEnhance
+
+    from image_hash import HammingIndex, hash_image, popcount
+    from tests.fakes import fake_cv_service
+
+    rng = np.random.default_rng(31)
+    hashes = rng.integers(0, 1 << 63, stored, dtype=np.int64).astype(np.uint64) << np.uint64(1)
+    hashes |= rng.integers(0, 2, stored).astype(np.uint64)
+    # Half the queries are near-duplicates of stored images (0..radius+2 bits flipped), half are new images
+    probes = []
+    for i in range(queries):
+        if i % 2:
+            probes.append(int(rng.integers(0, 1 << 63)) << 1)
+            continue
+        value = int(hashes[rng.integers(stored)])
+        for bit in rng.choice(64, rng.integers(0, radius + 3), replace=False).tolist():
+            value ^= 1 << bit
+        probes.append(value)
+
+    print(f"== near-duplicate index: {stored:,} stored 64-bit hashes, radius {radius} ==")
+    index = HammingIndex(radius=radius)
+    start = time.perf_counter()
+    index.add_many(hashes, list(range(stored)))
+    print(f"build: {time.perf_counter() - start:.2f} s")
+    start = time.perf_counter()
+    merges = index.merges
+    for value in rng.integers(0, 1 << 62, 100_000).tolist():
+        index.add(value)
+    print(f"incremental add: {(time.perf_counter() - start) / 100_000 * 1e6:.1f} us/hash "
+          f"(amortised over 100,000 adds, {index.merges - merges} merges)")
+
+    lat = np.empty(queries)
+    results = []
+    for i, value in enumerate(probes):
+        start = time.perf_counter()
+        results.append(index.nearest(value))
+        lat[i] = time.perf_counter() - start
+    lat *= 1e6
+    found = sum(1 for key, _ in results if key is not None)
+    print(f"HammingIndex: p50 {np.percentile(lat, 50):6.1f} us  p99 {np.percentile(lat, 99):6.1f} us  "
+          f"{queries / lat.sum() * 1e6:,.0f} lookups/s  matches {found}/{queries}")
+
+    # Full scan, the obvious alternative; also checks the index finds exactly the same distances
+    all_hashes = index._hashes[:len(index)]
+    sample = range(0, queries, max(1, queries // 500))
+    start = time.perf_counter()
+    for i in sample:
+        distances = popcount(all_hashes ^ np.uint64(probes[i]))
+        best = int(distances.min())
+        assert (best if best <= radius else None) == results[i][1]
+    scan = (time.perf_counter() - start) / len(sample) * 1e6
+    print(f"   full scan: {scan:8.1f} us/lookup  ({scan / np.percentile(lat, 50):.0f}x slower than the index p50)")
+
+    def photo(seed):
+        # Smooth random scene (distinct per seed) with sensor noise
+        scene = np.random.default_rng(seed)
+        low = Image.fromarray(scene.integers(0, 256, (6, 8, 3), dtype=np.uint8))
+        pixels = np.asarray(low.resize((1600, 1200), Image.Resampling.BICUBIC), dtype=np.float32)
+        return Image.fromarray(np.clip(pixels + scene.normal(0, 4, pixels.shape), 0, 255).astype(np.uint8))
+
+    def encode(image, quality=90):
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=quality)
+        return out.getvalue()
+
+    def retake(image, k):
+        # Nearly the same angle: slight crop, exposure and compression changes
+        width, height = image.size
+        dx, dy = int(width * 0.01 * (k + 1)), int(height * 0.01 * (k + 1))
+        moved = image.crop((dx, dy, width - dx // 2, height - dy // 2)).resize((1500, 1125))
+        return encode(ImageEnhance.Brightness(moved).enhance(1 + 0.03 * (k - 1)), quality=75 + 5 * k)
+
+    scenes = [photo(seed) for seed in range(photos)]
+    originals = [encode(image) for image in scenes]
+    retaken = [[retake(image, k) for k in range(retakes)] for image in scenes]
+    base = [hash_image(data) for data in originals]
+    same = [(base[i] ^ hash_image(data)).bit_count() for i in range(photos) for data in retaken[i]]
+    other = [(base[i] ^ base[j]).bit_count() for i in range(photos) for j in range(i + 1, photos)]
+    print(f"pHash distance, retake of the same fish: median {np.median(same):.0f}  max {max(same)}  "
+          f"within {radius}: {np.mean(np.array(same) <= radius):.0%}")
+    print(f"pHash distance, different fish:          median {np.median(other):.0f}  min {min(other)}  "
+          f"within {radius}: {np.mean(np.array(other) <= radius):.2%}")
+
+    async def replay(service):
+        for data in originals + [data for shots in retaken for data in shots]:
+            await service.diagnose_image(data)
+        return service.model.calls
+
+    for name, distance in (("exact cache only (old)", -1), (f"pHash within {radius} bits", radius)):
+        service = fake_cv_service(duplicate_distance=distance)
+        with contextlib.redirect_stdout(io.StringIO()):
+            calls = asyncio.run(replay(service))
+        print(f"{name:>24}: model calls {calls} for {photos} fish x {retakes + 1} photos  "
+              f"near-duplicate hits {service.near_duplicate_hits}")
+
+
+BENCHMARKS = {
+    "rules": bench_rules,
+    "forest": bench_forest,
+    "batch": bench_batch_endpoint,
+    "predict_cache": bench_predict_cache,
+    "event_loop": bench_event_loop,
+    "station_trend": bench_station_trend,
+    "forecast_payload": bench_forecast_payload,
+    "forecast_methods": bench_forecast_methods,
+    "forecast_memo": bench_forecast_memo,
+    "dataset_startup": bench_dataset_startup,
+    "dataset_replay": bench_dataset_replay,
+    "station_replay": bench_station_replay,
+    "live_stream": bench_live_stream,
+    "mqtt_ingest": bench_mqtt_ingest,
+    "mqtt_bridge": bench_mqtt_bridge,
+    "lora_gateway": bench_lora_gateway,
+    "gateway_spool": bench_gateway_spool,
+    "frame_codec": bench_frame_codec,
+    "edge_aggregation": bench_edge_aggregation,
+    "timeseries_store": bench_timeseries_store,
+    "weather_cache": bench_weather_cache,
+    "weather_sites": bench_weather_sites,
+    "diagnosis_cache": bench_diagnosis_cache,
+    "image_prep": bench_image_prep,
+    "near_duplicates": bench_near_duplicates,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+        print()
@@ -0,0 +1,275 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+def approx_size(value):
+    """
+    Approximate memory footprint in bytes of a JSON-like value (dicts, lists,
+    strings, numbers), by a recursive sys.getsizeof. A list whose first item is
+    a number is taken to be all numbers, so long projection lists cost O(1).
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)) and value:
+        if isinstance(value[0], (int, float)):
+            size += len(value) * sys.getsizeof(value[0])
+        else:
+            size += sum(approx_size(v) for v in value)
+    return size
+
+class TTLCache:
+    """
+    Bounded LRU cache with an optional per-entry time-to-live.
+
+    Safe to share between the event loop and worker threads. Hit, miss,
+    eviction and expiry counters are kept for the metrics endpoints.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, max_bytes=None):
+        """
+        Args:
+            maxsize: Maximum number of entries; the least recently used entry is evicted first.
+            ttl: Seconds an entry stays valid, or None to keep entries until evicted.
+                0 (like maxsize 0) disables the cache.
+            max_bytes: Optional bound on the sum of the sizes passed to set().
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data = OrderedDict() # key -> (expires_at, value, size)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value, _ = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=0):
+        """Store a value; `size` (e.g. from approx_size) counts against max_bytes."""
+        if self.maxsize <= 0 or (self.ttl is not None and self.ttl <= 0):
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = (expires_at, value, size)
+            self.bytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _pop(self, key):
+        self.bytes -= self._data.pop(key)[2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls that share a key into one execution.
+    Callers arriving while the first call is running await its result.
+
+    The call runs as its own task, so a caller that is cancelled (e.g. the
+    client that started it disconnects) does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._inflight = {} # key -> asyncio.Task
+        self.coalesced = 0
+
+    def __contains__(self, key):
+        return key in self._inflight
+
+    async def do(self, key, fn):
+        """Await fn() once per key at a time; concurrent callers share its result or exception."""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even when every caller was cancelled
+        task.cancelled() or task.exception()
+
+class AsyncMemo:
+    """
+    TTLCache in front of an async computation, with single-flight coalescing of
+    concurrent misses. Tracks compute time spent and compute time saved by hits
+    and coalesced callers. With `max_bytes`, results are also bounded by their
+    approx_size (a full 24h forecast is over 1 MB).
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, max_bytes=None):
+        self.cache = TTLCache(maxsize, ttl, max_bytes)
+        self.flight = SingleFlight()
+        self.compute_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    async def get_or_compute(self, key, fn):
+        entry = self.cache.get(key)
+        if entry is not None:
+            value, cost = entry
+            self.saved_seconds += cost
+            return value
+
+        leader = key not in self.flight
+        value, cost = await self.flight.do(key, lambda: self._compute(key, fn))
+        if not leader:
+            self.saved_seconds += cost
+        return value
+
+    async def _compute(self, key, fn):
+        start = time.perf_counter()
+        value = await fn()
+        cost = time.perf_counter() - start
+        self.compute_seconds += cost
+        self.cache.set(key, (value, cost), approx_size(value) if self.cache.max_bytes is not None else 0)
+        return value, cost
+
+    def stats(self):
+        return {
+            **self.cache.stats(),
+            "coalesced": self.flight.coalesced,
+            "compute_ms": round(self.compute_seconds * 1e3, 3),
+            "saved_ms": round(self.saved_seconds * 1e3, 3)
+        }
+
+class StaleWhileRevalidate:
+    """
+    Async cache for slow-changing upstream data (e.g. weather), keyed per resource.
+
+    An entry is fresh for `ttl` seconds and served from memory. For a further
+    `stale_ttl` seconds it is still served immediately while one background task
+    fetches a replacement; if that refresh fails the stale value stays. Older
+    entries make the caller wait for a fetch. Concurrent fetches of a key are
+    coalesced with SingleFlight, so upstream calls depend on the TTLs, not on
+    the number of callers. Not thread-safe: use it from the event loop.
+    """
+
+    def __init__(self, ttl=60.0, stale_ttl=0.0, maxsize=256):
+        """
+        Args:
+            ttl: Default seconds an entry is fresh.
+            stale_ttl: Default seconds after that an entry may be served while it is refreshed.
+            maxsize: Maximum number of entries; the least recently used entry is evicted first.
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict() # key -> (fetched_at, value)
+        self._refreshing = {} # key -> background refresh task
+        self.flight = SingleFlight()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.refresh_errors = 0
+
+    async def get(self, key, fetch, ttl=None, stale_ttl=None):
+        """
+        Args:
+            key: Resource key, e.g. ("weather", lat, lon).
+            fetch: Async zero-argument callable returning a fresh value (raises on failure).
+            ttl, stale_ttl: Per-call overrides of the defaults.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+        entry = self._data.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < ttl:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return entry[1]
+            if age < ttl + stale_ttl:
+                self.stale_hits += 1
+                if key not in self._refreshing and key not in self.flight:
+                    # Referenced until done so the task is not garbage collected mid-flight
+                    task = self._refreshing[key] = asyncio.create_task(self._refresh(key, fetch))
+                    task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+                return entry[1]
+        self.misses += 1
+        return await self.flight.do(key, lambda: self._fetch(key, fetch))
+
+    async def _fetch(self, key, fetch):
+        value = await fetch()
+        self.fetches += 1
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        return value
+
+    async def _refresh(self, key, fetch):
+        try:
+            await self.flight.do(key, lambda: self._fetch(key, fetch))
+        except Exception as e:
+            self.refresh_errors += 1
+            print(f"Background refresh of {key} failed: {e}")
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._data),
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "fetches": self.fetches,
+            "coalesced": self.flight.coalesced,
+            "refresh_errors": self.refresh_errors,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0
+        }
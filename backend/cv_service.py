@@ -4,15 +4,53 @@ import google.generativeai as genai
 from dotenv import load_dotenv
 import json
 import base64
+import asyncio
+import time
 
-import hashlib
+from diagnosis_cache import DiagnosisCache
+from image_hash import HammingIndex, hash_image
+from image_prep import JPEG_QUALITY, MAX_EDGE, detect_format, prepare_image
 
 load_dotenv(override=True)
 
 class CVService:
-    def __init__(self):
+    MODEL_NAME = 'gemini-flash-latest'
+    SIMILAR_TRIES = 8 # near-duplicate candidates looked up in the cache per upload, closest first
+
+    def __init__(self, executor=None, preprocess=None, max_edge=MAX_EDGE, quality=JPEG_QUALITY, duplicate_distance=None):
+        """
+        Args:
+            executor: ComputeExecutor that runs image preprocessing (default: a thread via asyncio.to_thread).
+            preprocess: Downscale and re-encode uploads before sending them (default: CV_PREPROCESS, on).
+            max_edge, quality: Preprocessing target (see image_prep).
+            duplicate_distance: Uploads whose perceptual hash is within this many bits of
+                a diagnosed image reuse its diagnosis (default: CV_DUPLICATE_DISTANCE, 6; negative disables).
+        """
         api_key = os.getenv("GEMINI_API_KEY")
-        self.cache = {} # In-memory cache: hash -> result
+        # Memory LRU + SQLite, shared by workers and kept across restarts; keys include the model
+        self.cache = DiagnosisCache.from_env(namespace=self.MODEL_NAME)
+        self.executor = executor
+        self.preprocess = os.getenv("CV_PREPROCESS", "1") == "1" if preprocess is None else preprocess
+        self.max_edge = max_edge
+        self.quality = quality
+        self.uploads = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.prep_failures = 0
+        self.prep_seconds = 0.0
+        self.model_seconds = 0.0
+        if duplicate_distance is None:
+            duplicate_distance = int(os.getenv("CV_DUPLICATE_DISTANCE", "6"))
+        # Perceptual hash -> cache key of every diagnosed image, including other workers' (via the cache's disk tier)
+        self.similar = HammingIndex(radius=duplicate_distance) if duplicate_distance >= 0 else None
+        self.index_sync_interval = float(os.getenv("CV_INDEX_SYNC_INTERVAL", "5"))
+        # Full reload from disk, which drops rows pruned by any worker
+        self.index_rebuild_interval = float(os.getenv("CV_INDEX_REBUILD_INTERVAL", "3600"))
+        self._index_rowid = 0
+        self._index_synced = float("-inf")
+        self._index_rebuilt = float("-inf")
+        self.near_duplicate_hits = 0
+        self.similar_seconds = 0.0
         
         if not api_key:
             print("WARNING: GEMINI_API_KEY not found in CVService")
@@ -20,14 +58,15 @@ class CVService:
         else:
             print(f"CVService utilizing API Key ending in: ...{api_key[-4:]}")
             genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-flash-latest')
+            self.model = genai.GenerativeModel(self.MODEL_NAME)
 
     async def diagnose_image(self, image_bytes):
         # 1. Check Cache
-        image_hash = hashlib.md5(image_bytes).hexdigest()
-        if image_hash in self.cache:
+        image_hash = self.cache.key(image_bytes)
+        cached = await self._disk(self.cache.get, image_hash)
+        if cached is not None:
             print(f"Cache HIT for image: {image_hash}")
-            return self.cache[image_hash]
+            return cached
 
         if not self.model:
             return {
@@ -62,13 +101,23 @@ class CVService:
             """
             
             # Create image part
+            image_data, mime_type, image_phash = await self._prepare(image_bytes)
+
+            # Same fish photographed again: reuse the diagnosis of a near-identical image
+            similar = await self._find_similar(image_phash)
+            if similar is not None:
+                # Stored without its hash, so matches never chain from one near-duplicate to the next
+                await self._disk(self.cache.set, image_hash, similar)
+                return similar
             image_part = {
-                "mime_type": "image/jpeg", # Assuming JPEG for simplicity, Gemini handles most
-                "data": image_bytes
+                "mime_type": mime_type,
+                "data": image_data
             }
 
             print("Sending request to Gemini Vision...")
+            started = time.perf_counter()
             response = await self.model.generate_content_async([prompt, image_part])
+            self.model_seconds += time.perf_counter() - started
             print("Received response from Gemini Vision.")
             
             # Parse JSON
@@ -83,7 +132,8 @@ class CVService:
                 result = json.loads(text)
                 
                 # Cache the successful result
-                self.cache[image_hash] = result
+                await self._disk(self.cache.set, image_hash, result, image_phash)
+                self._index(image_hash, image_phash)
                 print(f"Cache STORED for image: {image_hash}")
                 
                 return result
@@ -113,3 +163,100 @@ class CVService:
                 "reasoning": f"Diagnosis failed: {error_msg}",
                 "status": "error"
             }
+
+    async def _run(self, fn, *args):
+        if self.executor is not None:
+            return await self.executor.run(fn, *args)
+        return await asyncio.to_thread(fn, *args)
+
+    async def _disk(self, fn, *args):
+        # Cache calls may wait on SQLite (up to its 5 s busy timeout) and the cache lock:
+        # keep them off the event loop. Not on the executor, whose queue may be full.
+        return await asyncio.to_thread(fn, *args)
+
+    async def _prepare(self, image_bytes):
+        """
+        Bytes and MIME type to upload, downscaled and stripped of metadata off the
+        event loop, and the perceptual hash (None if unavailable or not needed).
+        """
+        self.uploads += 1
+        self.bytes_in += len(image_bytes)
+        with_hash = self.similar is not None
+        image_phash = None
+        data, mime_type = image_bytes, detect_format(image_bytes) or "image/jpeg"
+        started = time.perf_counter()
+        try:
+            if self.preprocess:
+                data, mime_type, info = await self._run(prepare_image, image_bytes, self.max_edge, self.quality, with_hash)
+                image_phash = info.get("phash")
+                if "error" in info:
+                    self.prep_failures += 1
+                    print(info["error"])
+            elif with_hash:
+                image_phash = await self._run(hash_image, image_bytes)
+        except Exception as e:
+            # e.g. the compute queue is full: send the upload as it is
+            self.prep_failures += 1
+            print(f"Preprocessing failed: {str(e)}")
+        self.prep_seconds += time.perf_counter() - started
+        self.bytes_out += len(data)
+        return data, mime_type, image_phash
+
+    def _index(self, key, image_phash):
+        if self.similar is not None and image_phash is not None and key not in self.similar:
+            self.similar.add(image_phash, key)
+
+    async def _sync_index(self):
+        # Pick up images diagnosed by other workers (and, on the first call, by earlier runs)
+        now = time.monotonic()
+        if now - self._index_synced < self.index_sync_interval:
+            return
+        self._index_synced = now
+        if self.cache.path and now - self._index_rebuilt >= self.index_rebuild_interval:
+            self._index_rebuilt = now
+            rows, self._index_rowid = await self._disk(self.cache.hashes, 0)
+            index = HammingIndex(self.similar.radius, self.similar.chunks)
+            index.add_many([value for _, value in rows], [key for key, _ in rows])
+            self.similar = index
+            return
+        rows, self._index_rowid = await self._disk(self.cache.hashes, self._index_rowid)
+        rows = [(key, value) for key, value in rows if key not in self.similar]
+        if rows:
+            self.similar.add_many([value for _, value in rows], [key for key, _ in rows])
+
+    async def _find_similar(self, image_phash):
+        """Cached diagnosis of the closest previously diagnosed image within the distance, if any."""
+        if self.similar is None or image_phash is None:
+            return None
+        started = time.perf_counter()
+        await self._sync_index()
+        result = None
+        for key, distance in self.similar.within(image_phash, limit=self.SIMILAR_TRIES):
+            result = await self._disk(self.cache.get, key)
+            if result is not None:
+                break
+            # Expired or pruned from the cache: stop matching it
+            self.similar.discard(key)
+        self.similar_seconds += time.perf_counter() - started
+        if result is not None:
+            self.near_duplicate_hits += 1
+            print(f"Near-duplicate HIT ({distance} bits) for image: {key}")
+        return result
+
+    def stats(self):
+        return {
+            "preprocess": self.preprocess,
+            "max_edge": self.max_edge,
+            "quality": self.quality,
+            "uploads": self.uploads,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "prep_failures": self.prep_failures,
+            "prep_ms": round(self.prep_seconds * 1e3, 3),
+            "model_ms": round(self.model_seconds * 1e3, 3),
+            "near_duplicate_hits": self.near_duplicate_hits,
+            "similar_lookup_ms": round(self.similar_seconds * 1e3, 3),
+            "similar_index": self.similar.stats() if self.similar is not None else None,
+            "cache": self.cache.stats()
+        }
@@ -1,66 +1,409 @@
 import pandas as pd
-import math
+import numpy as np
+import contextlib
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+def round_float32(values):
+    """
+    float32 values as float64, rounded to the ~7 significant digits float32 keeps,
+    so 25.4 comes back as 25.4, not 25.399999618530273 (the array form of
+    get_next's f"{value:.7g}"). NaN stays NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    magnitude = np.floor(np.log10(np.abs(np.where(values == 0, 1.0, values))))
+    scale = 10.0 ** (6 - magnitude)
+    return np.round(values * scale) / scale
+
+class ReplayCursor:
+    """
+    Independent read position over one replay stream: the whole dataset in file
+    order, or one waterbody's readings in date order.
+
+    Advancing is lock-free: reads claim their rows from an itertools.count, whose
+    next() is atomic under the GIL, so concurrent readers of the same cursor never
+    get the same reading twice or skip one.
+    """
+
+    def __init__(self, streamer, rows=None, station=None, start=0):
+        """
+        Args:
+            streamer: DatasetStreamer holding the data.
+            rows: Dataset row numbers in replay order, or None for every row in file order.
+            station: WaterbodyName the rows belong to, if any.
+            start: Initial position.
+        """
+        self.streamer = streamer
+        self.rows = rows
+        self.station = station
+        self.length = len(streamer) if rows is None else len(rows)
+        self.seek(start)
+
+    def __len__(self):
+        return self.length
+
+    def seek(self, position):
+        self._ticks = itertools.count(position)
+        self.position = position # informational; the counter is the source of truth
+
+    def _row(self, tick):
+        i = tick % self.length
+        return i if self.rows is None else int(self.rows[i])
+
+    def get_next(self):
+        if self.length == 0:
+            return None
+        tick = next(self._ticks)
+        self.position = tick + 1
+        return self.streamer.read_row(self._row(tick))
+
+    def get_range(self, start, n):
+        """Block of `n` readings from stream position `start` (wrapping); does not move the cursor."""
+        if self.rows is None:
+            return self.streamer.get_range(start, n)
+        if self.length == 0 or n <= 0:
+            return self.streamer.get_range(0, 0)
+        return self.streamer.read_rows(self.rows[(start + np.arange(n)) % self.length])
+
+    def get_window(self, n):
+        """Next `n` readings as one block; advances the cursor like n get_next calls."""
+        if self.length == 0 or n <= 0:
+            return self.streamer.get_range(0, 0)
+        # islice over a count runs in C, so the claim is one contiguous run unless
+        # another thread interleaves; either way every claimed tick is unique.
+        ticks = list(itertools.islice(self._ticks, n))
+        self.position = ticks[-1] + 1
+        if ticks[-1] - ticks[0] == n - 1:
+            return self.get_range(ticks[0], n)
+        return self.streamer.read_rows(np.array([self._row(t) for t in ticks]))
 
 class DatasetStreamer:
-    def __init__(self, csv_path):
+    # Mappings: 'pH' -> ph, 'Temperature' -> temperature, 'Ammonia-Total (as N)' -> ammonia, 'Dissolved Oxygen' -> dissolved_oxygen
+    COLUMNS = {
+        'pH': 'ph',
+        'Temperature': 'temperature',
+        'Ammonia-Total (as N)': 'ammonia',
+        'Dissolved Oxygen': 'dissolved_oxygen',
+    }
+    # Safe defaults for missing values
+    DEFAULTS = {'ph': 7.0, 'temperature': 20.0, 'ammonia': 0.01, 'dissolved_oxygen': 7.0}
+    # Calibrated channels served by get_next/get_range, in output order
+    CHANNELS = ('ph', 'temperature', 'ammonia', 'dissolved_oxygen', 'turbidity', 'salinity')
+    # Columns used to build the per-station replay index
+    INDEX_COLUMNS = ('WaterbodyName', 'Years', 'SampleDate')
+    MONTHS = {m: i for i, m in enumerate(('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'))}
+    # Bump when the cached layout or the cleaning/calibration steps change
+    CACHE_VERSION = 3
+
+    def __init__(self, csv_path, cache_dir=None, mmap=True, max_sessions=None, session_ttl=None):
+        """
+        Args:
+            csv_path: Ireland water quality CSV.
+            cache_dir: Where the float32 .npy column cache lives. Defaults to
+                DATASET_CACHE_DIR, else "<csv_path>.npcache" next to the CSV.
+            mmap: Memory-map the cached columns (read-only), so several uvicorn
+                workers share the same pages instead of each holding a copy.
+            max_sessions: Session cursors kept; the least recently used is released
+                first. Defaults to DATASET_MAX_SESSIONS (1000).
+            session_ttl: Seconds an unused session cursor is kept. Defaults to
+                DATASET_SESSION_TTL (1800).
+        """
         self.csv_path = csv_path
-        self.data = None
-        self.index = 0
+        self.cache_dir = cache_dir or os.getenv("DATASET_CACHE_DIR") or f"{csv_path}.npcache"
+        self.mmap = mmap
+        self.max_sessions = max_sessions or int(os.getenv("DATASET_MAX_SESSIONS", "1000"))
+        self.session_ttl = session_ttl or float(os.getenv("DATASET_SESSION_TTL", "1800"))
+        # Called with (key, station) when a session cursor is released, so state kept
+        # per session elsewhere (e.g. its forecasting history) can go with it
+        self.on_release = None
+        self.data = None # channel -> 1-D float32 array of calibrated values
+        # Per-station index: rows of station k are order[offsets[k]:offsets[k + 1]], in date order
+        self.stations = [] # WaterbodyName of station k
+        self.order = None
+        self.offsets = None
         self.load_data()
+        self._station_ids = {name: k for k, name in enumerate(self.stations)}
+        self._cursor = ReplayCursor(self) # the shared cursor behind get_next/get_window
+        self._cursors = {} # (None, station) -> shared ReplayCursor of the station
+        self._sessions = OrderedDict() # (session key, station) -> (last used, ReplayCursor), oldest first
+        self._sessions_lock = threading.Lock()
+
+    def __len__(self):
+        return 0 if self.data is None else len(self.data['ph'])
+
+    @property
+    def index(self):
+        return self._cursor.position % max(len(self), 1)
+
+    @index.setter
+    def index(self, position):
+        self._cursor.seek(position)
 
     def load_data(self):
         try:
-            # Load specific columns
-            # Mappings: 'pH' -> ph, 'Temperature' -> temperature, 'Ammonia-Total (as N)' -> ammonia, 'Dissolved Oxygen' -> dissolved_oxygen
-            df = pd.read_csv(self.csv_path)
-            
-            # Clean and Select
-            self.data = pd.DataFrame()
-            self.data['ph'] = pd.to_numeric(df['pH'], errors='coerce')
-            self.data['temperature'] = pd.to_numeric(df['Temperature'], errors='coerce')
-            self.data['ammonia'] = pd.to_numeric(df['Ammonia-Total (as N)'], errors='coerce')
-            
-            # DO in dataset seems to be % saturation (values 50-100+). We need mg/L.
-            # Approx conversion: 100% ~ 9-10 mg/L at 20C. Simple factor / 10 is decent approximation for visual demo.
-            # Or treat as mg/L if values are small? Scanning file showed 52.5, 61.85... definitely % sat.
-            self.data['dissolved_oxygen'] = pd.to_numeric(df['Dissolved Oxygen'], errors='coerce') / 10.0
-            
-            # Fill NaNs with safe defaults
-            self.data['ph'] = self.data['ph'].fillna(7.0)
-            self.data['temperature'] = self.data['temperature'].fillna(20.0)
-            self.data['ammonia'] = self.data['ammonia'].fillna(0.01)
-            self.data['dissolved_oxygen'] = self.data['dissolved_oxygen'].fillna(7.0)
-
-            print(f"Loaded {len(self.data)} rows from dataset.")
+            cached = self._read_cache()
+            if cached is None:
+                raw, station_index = self._parse_csv()
+                data = self._calibrate(raw)
+                self._write_cache(data, station_index)
+                cached = self._read_cache() or (data, station_index)
+            self.data, (self.stations, self.order, self.offsets) = cached
+            print(f"Loaded {len(self)} rows from dataset ({len(self.stations)} stations).")
         except Exception as e:
             print(f"Error loading dataset: {e}")
             # Fallback mock data
-            self.data = pd.DataFrame({
-                'ph': [7.2], 'temperature': [25.0], 'ammonia': [0.01], 'dissolved_oxygen': [6.5]
+            self.data = self._calibrate({
+                'ph': np.array([7.2]), 'temperature': np.array([25.0]),
+                'ammonia': np.array([0.01]), 'dissolved_oxygen': np.array([6.5])
             })
+            self.stations, self.order, self.offsets = ["mock"], np.zeros(1, dtype=np.int32), np.array([0, 1])
 
-    def get_next(self):
-        if self.data is None or len(self.data) == 0:
-            return None
-        
-        row = self.data.iloc[self.index]
-        self.index = (self.index + 1) % len(self.data)
-        
+    def _parse_csv(self):
+        # Only parse the columns we use
+        df = pd.read_csv(self.csv_path, usecols=list(self.COLUMNS) + list(self.INDEX_COLUMNS))
+
+        data = {}
+        for column, name in self.COLUMNS.items():
+            values = pd.to_numeric(df[column], errors='coerce')
+            if name == 'dissolved_oxygen':
+                # DO in dataset seems to be % saturation (values 50-100+). We need mg/L.
+                # Approx conversion: 100% ~ 9-10 mg/L at 20C. Simple factor / 10 is decent approximation for visual demo.
+                # Or treat as mg/L if values are small? Scanning file showed 52.5, 61.85... definitely % sat.
+                values = values / 10.0
+            data[name] = values.fillna(self.DEFAULTS[name]).to_numpy(dtype=np.float64)
+        return data, self._build_station_index(df)
+
+    def _build_station_index(self, df):
+        """
+        Group row numbers by WaterbodyName, each group in (Years, SampleDate) order.
+
+        Returns:
+            (stations, order, offsets): station names, int32 row numbers grouped by
+            station, and int64 group boundaries (len(stations) + 1 entries).
+        """
+        names = df['WaterbodyName'].fillna('Unknown').astype(str)
+        codes, stations = pd.factorize(names, sort=True)
+        years = pd.to_numeric(df['Years'], errors='coerce').fillna(0).to_numpy()
+        months = df['SampleDate'].map(self.MONTHS).fillna(0).to_numpy()
+        # lexsort's last key is primary; row number last keeps file order within a month
+        order = np.lexsort((np.arange(len(df)), months, years, codes)).astype(np.int32)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(stations)))))
+        return list(stations), order, offsets
+
+    @staticmethod
+    def _calibrate(raw):
+        """
+        Apply the replay calibration to whole columns at once.
+
+        Args:
+            raw: Cleaned dataset columns (ph, temperature, ammonia, dissolved_oxygen).
+
+        Returns:
+            Dict of CHANNELS -> float32 arrays, row i being what get_next serves for row i.
+        """
         # Calibrate Ireland (Cold/Dirty) data to Tropical Tilapia standards
         # Shift Temp ~10C -> ~25C (Optimal 20-34)
         # Scale Ammonia ~0.03 -> ~0.015 (Optimal <0.02)
         # Shift DO (sat/10) + 1.5 -> Lift 5.5 to 7.0 (Optimal >6.0)
-        
-        calibrated_temp = float(row['temperature']) + 15.0
-        calibrated_ammonia = float(row['ammonia']) * 0.5
-        calibrated_do = (float(row['dissolved_oxygen']) / 10.0) + 1.5
-        
-        return {
-            "ph": float(row['ph']),
-            "temperature": calibrated_temp,
-            "ammonia": calibrated_ammonia,
-            "dissolved_oxygen": calibrated_do,
+        n = len(raw['ph'])
+        # Synthesized params oscillate with the cursor position after the read
+        position = (np.arange(n) + 1) % n
+        channels = {
+            "ph": raw['ph'],
+            "temperature": raw['temperature'] + 15.0,
+            "ammonia": raw['ammonia'] * 0.5,
+            "dissolved_oxygen": (raw['dissolved_oxygen'] / 10.0) + 1.5,
             # Synthesize missing params to keep dashboard happy
-            "turbidity": float(10.0 + (math.sin(self.index/10) * 2)), # Oscillate slightly
-            "salinity": float(15.0 + (math.cos(self.index/10) * 1))
+            "turbidity": 10.0 + (np.sin(position / 10) * 2), # Oscillate slightly
+            "salinity": 15.0 + (np.cos(position / 10) * 1)
         }
+        return {name: np.ascontiguousarray(values, dtype=np.float32) for name, values in channels.items()}
+
+    # ---------------------------
+    # Binary column cache
+    # ---------------------------
+    def _csv_signature(self, with_hash=False):
+        st = os.stat(self.csv_path)
+        signature = {"version": self.CACHE_VERSION, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        if with_hash:
+            with open(self.csv_path, 'rb') as f:
+                signature["sha256"] = hashlib.sha256(f.read()).hexdigest()
+        return signature
+
+    def _read_cache(self):
+        """_load_cache(), with a cache that cannot be read or does not match treated as missing."""
+        try:
+            return self._load_cache()
+        except Exception as e:
+            # e.g. a .npy missing or truncated by a crashed writer, or meta.json without "stations"
+            print(f"Dataset cache unusable, rebuilding from CSV: {e}")
+            return None
+
+    def _load_cache(self):
+        meta_path = os.path.join(self.cache_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        signature = self._csv_signature()
+        if meta.get("version") != self.CACHE_VERSION or meta.get("size") != signature["size"]:
+            return None
+        if meta.get("mtime_ns") != signature["mtime_ns"]:
+            # Touched (e.g. by a checkout) but possibly unchanged: compare contents before rebuilding
+            signature = self._csv_signature(with_hash=True)
+            if meta.get("sha256") != signature["sha256"]:
+                return None
+            self._write_meta(signature)
+
+        mode = 'r' if self.mmap else None
+        load = lambda name: np.load(os.path.join(self.cache_dir, f"{name}.npy"), mmap_mode=mode)
+        data = {name: load(name) for name in self.CHANNELS}
+        stations, order, offsets = meta["stations"], load("order"), load("offsets")
+        n = len(data["ph"])
+        if (any(len(values) != n for values in data.values()) or len(order) != n
+                or len(offsets) != len(stations) + 1 or (len(offsets) and offsets[-1] != n)):
+            raise ValueError("cached columns do not match each other or meta.json")
+        return data, (stations, order, offsets)
+
+    def _write_cache(self, data, station_index):
+        stations, order, offsets = station_index
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name, values in {**data, "order": order, "offsets": offsets}.items():
+                with self._atomic_file(f"{name}.npy", 'wb') as f:
+                    np.save(f, values)
+            # meta.json goes last: it is what marks the cache as valid
+            self._write_meta({**self._csv_signature(with_hash=True), "stations": stations})
+        except OSError as e:
+            print(f"Could not write dataset cache: {e}")
+
+    def _write_meta(self, signature):
+        meta_path = os.path.join(self.cache_dir, "meta.json")
+        if "stations" not in signature and os.path.exists(meta_path):
+            # Signature refresh only: keep the station list
+            with open(meta_path) as f:
+                signature = {**json.load(f), **signature}
+        with self._atomic_file("meta.json", 'w') as f:
+            json.dump(signature, f)
+
+    @contextlib.contextmanager
+    def _atomic_file(self, name, mode):
+        # Unique temp file in the cache dir, renamed over `name` once complete, so
+        # workers rebuilding the cache at the same time never write the same file
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, mode) as f:
+                yield f
+            os.replace(tmp_path, os.path.join(self.cache_dir, name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    # ---------------------------
+    # Reads
+    # ---------------------------
+    def read_row(self, i):
+        """Calibrated reading at dataset row `i`."""
+        return {name: float(f"{self.data[name][i]:.7g}") for name in self.CHANNELS}
+
+    def read_rows(self, rows):
+        """Calibrated readings at an array of dataset rows, as CHANNELS -> float64 arrays."""
+        return {name: round_float32(self.data[name][rows]) for name in self.CHANNELS}
+
+    def get_next(self):
+        if self.data is None or len(self) == 0:
+            return None
+        return self._cursor.get_next()
+
+    def get_range(self, start, n):
+        """
+        Block of `n` readings starting at row `start`, wrapping around the end of the dataset.
+
+        Does not move the replay cursor.
+
+        Returns:
+            Dict of CHANNELS -> float64 arrays of length n (the same values n get_next calls would return).
+        """
+        if self.data is None or len(self) == 0 or n <= 0:
+            return {name: np.empty(0) for name in self.CHANNELS}
+
+        start %= len(self)
+        if start + n <= len(self):
+            return {name: round_float32(self.data[name][start:start + n]) for name in self.CHANNELS}
+        return self.read_rows((start + np.arange(n)) % len(self))
+
+    def get_window(self, n):
+        """Next `n` readings from the replay cursor as one block; advances the cursor like n get_next calls."""
+        return self._cursor.get_window(n)
+
+    # ---------------------------
+    # Per-station streams
+    # ---------------------------
+    def station_rows(self, station):
+        """Dataset rows of one WaterbodyName in (Years, SampleDate) order. Raises KeyError for unknown stations."""
+        k = self._station_ids[station]
+        return self.order[self.offsets[k]:self.offsets[k + 1]]
+
+    def cursor(self, key=None, station=None):
+        """
+        Get or create the independent cursor registered under (key, station).
+
+        Args:
+            key: Session/client id owning the cursor. Callers without one share
+                the station's default cursor. Session cursors are released after
+                session_ttl seconds without use, or when more than max_sessions exist.
+            station: WaterbodyName to replay, or None for the whole dataset in file order.
+
+        Returns:
+            ReplayCursor. Raises KeyError for an unknown station.
+        """
+        if key is None:
+            cursor = self._cursors.get((key, station))
+            if cursor is None:
+                rows = None if station is None else self.station_rows(station)
+                # setdefault is atomic, so racing creators end up sharing one cursor
+                cursor = self._cursors.setdefault((key, station), ReplayCursor(self, rows, station))
+            return cursor
+
+        now = time.monotonic()
+        with self._sessions_lock:
+            entry = self._sessions.pop((key, station), None)
+            if entry is not None:
+                cursor = entry[1]
+            else:
+                cursor = ReplayCursor(self, None if station is None else self.station_rows(station), station)
+            self._sessions[(key, station)] = (now, cursor)
+            released = []
+            while self._sessions:
+                oldest, (last_used, _) = next(iter(self._sessions.items()))
+                if len(self._sessions) <= self.max_sessions and now - last_used < self.session_ttl:
+                    break
+                del self._sessions[oldest]
+                released.append(oldest)
+        for session in released:
+            self._released(*session)
+        return cursor
+
+    def release_cursor(self, key=None, station=None):
+        if key is None:
+            self._cursors.pop((key, station), None)
+            return
+        with self._sessions_lock:
+            entry = self._sessions.pop((key, station), None)
+        if entry is not None:
+            self._released(key, station)
+
+    def _released(self, key, station):
+        if self.on_release is not None:
+            self.on_release(key, station)
+
+    @property
+    def sessions(self):
+        return len(self._sessions)
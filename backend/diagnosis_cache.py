@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+class DiagnosisCache:
+    """
+    Two-tier cache of image diagnoses, keyed by the SHA-256 of the image bytes.
+
+    The memory tier is an LRU bounded by entry count and by the encoded size
+    of the results. Behind it, every result is written to a SQLite database
+    (WAL mode), so warm results survive restarts and are shared by all uvicorn
+    workers pointing at the same file. Entries older than `ttl` are ignored
+    and pruned. Entries may carry the image's perceptual hash, which
+    hashes() hands to the near-duplicate index of every worker. Safe to use
+    from the event loop and worker threads.
+    """
+
+    def __init__(self, path, ttl=30 * 86400, maxsize=1024, max_bytes=16 << 20, max_disk_entries=100_000, namespace=""):
+        """
+        Args:
+            path: SQLite database file (created if missing), or None for memory only.
+            ttl: Seconds a diagnosis stays valid, or None to keep it until evicted.
+            maxsize: Entries kept in memory; the least recently used is evicted first.
+            max_bytes: Encoded result bytes kept in memory.
+            max_disk_entries: Rows kept on disk; the oldest are deleted beyond it.
+            namespace: Prefix of every key (e.g. model and prompt version), so a
+                new model does not serve diagnoses made by the old one.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.max_disk_entries = max_disk_entries
+        self.namespace = namespace
+        self._data = OrderedDict() # key -> (created, result, encoded size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS diagnoses "
+                "(key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL, phash INTEGER)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(diagnoses)")]
+            if "phash" not in columns:
+                # Database written before perceptual hashes were stored
+                self._db.execute("ALTER TABLE diagnoses ADD COLUMN phash INTEGER")
+            self._db.execute("CREATE INDEX IF NOT EXISTS diagnoses_created ON diagnoses (created)")
+        self._latencies = deque(maxlen=4096) # recent lookup times (seconds)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.pruned = 0
+
+    @classmethod
+    def from_env(cls, namespace=""):
+        path = os.getenv("DIAGNOSIS_CACHE_PATH", "diagnosis_cache.sqlite3")
+        ttl = float(os.getenv("DIAGNOSIS_CACHE_TTL_DAYS", "30")) * 86400
+        return cls(
+            path if path != "none" else None,
+            ttl=ttl or None,
+            maxsize=int(os.getenv("DIAGNOSIS_CACHE_SIZE", "1024")),
+            max_bytes=int(os.getenv("DIAGNOSIS_CACHE_MB", "16")) << 20,
+            max_disk_entries=int(os.getenv("DIAGNOSIS_CACHE_DISK_ENTRIES", "100000")),
+            namespace=namespace
+        )
+
+    def key(self, image_bytes):
+        return f"{self.namespace}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+    def _expired(self, created, now):
+        return self.ttl is not None and created + self.ttl <= now
+
+    def get(self, key, default=None):
+        start = time.perf_counter()
+        now = time.time()
+        try:
+            with self._lock:
+                entry = self._data.get(key)
+                if entry is not None:
+                    if not self._expired(entry[0], now):
+                        self._data.move_to_end(key)
+                        self.memory_hits += 1
+                        return entry[1]
+                    self._pop(key)
+                    self.expirations += 1
+                if self._db is None:
+                    self.misses += 1
+                    return default
+                # Another worker (or a previous run) may have stored it
+                row = self._db.execute("SELECT result, created FROM diagnoses WHERE key = ?", (key,)).fetchone()
+                if row is None or self._expired(row[1], now):
+                    self.misses += 1
+                    return default
+                self.disk_hits += 1
+                result = json.loads(row[0])
+                self._put(key, row[1], result, len(row[0]))
+                return result
+        finally:
+            self._latencies.append(time.perf_counter() - start)
+
+    def set(self, key, result, phash=None):
+        """Store a diagnosis; `phash` (64-bit int) makes it findable by near-duplicate uploads."""
+        encoded = json.dumps(result)
+        created = time.time()
+        if phash is not None and phash >= 1 << 63:
+            phash -= 1 << 64 # SQLite integers are signed
+        with self._lock:
+            self._put(key, created, result, len(encoded))
+            self.stores += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO diagnoses (key, result, created, phash) VALUES (?, ?, ?, ?)",
+                    (key, encoded, created, phash)
+                )
+                if self.stores % 256 == 0:
+                    self._prune(created)
+
+    def _put(self, key, created, result, size):
+        if key in self._data:
+            self._pop(key)
+        if size > self.max_bytes or self.maxsize <= 0:
+            return
+        self._data[key] = (created, result, size)
+        self._bytes += size
+        while len(self._data) > self.maxsize or self._bytes > self.max_bytes:
+            self._pop(next(iter(self._data)))
+            self.evictions += 1
+
+    def _pop(self, key):
+        self._bytes -= self._data.pop(key)[2]
+
+    def _prune(self, now):
+        # Expired rows, then the oldest beyond max_disk_entries
+        deleted = 0
+        if self.ttl is not None:
+            deleted += self._db.execute("DELETE FROM diagnoses WHERE created <= ?", (now - self.ttl,)).rowcount
+        deleted += self._db.execute(
+            "DELETE FROM diagnoses WHERE key IN (SELECT key FROM diagnoses ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        ).rowcount
+        self.pruned += deleted
+
+    def hashes(self, after=0):
+        """
+        Perceptual hashes stored on disk, by any worker, since a previous call.
+
+        Args:
+            after: Row id returned by the previous call (0 = everything).
+
+        Returns:
+            ([(key, phash), ...], last row id). Empty without a disk tier.
+        """
+        if self._db is None:
+            return [], after
+        cutoff = time.time() - self.ttl if self.ttl is not None else -1.0
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT rowid, key, phash FROM diagnoses WHERE rowid > ? AND phash IS NOT NULL AND created > ? ORDER BY rowid",
+                (after, cutoff)
+            ).fetchall()
+        if not rows:
+            return [], after
+        return [(key, phash % (1 << 64)) for _, key, phash in rows], rows[-1][0]
+
+    def prune(self):
+        """Delete expired and surplus rows from the disk tier now."""
+        with self._lock:
+            if self._db is not None:
+                self._prune(time.time())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM diagnoses")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        latencies = np.array(self._latencies) * 1e6
+        with self._lock:
+            disk_entries = self._db.execute("SELECT COUNT(*) FROM diagnoses").fetchone()[0] if self._db is not None else 0
+        return {
+            "size": len(self._data),
+            "bytes": self._bytes,
+            "maxsize": self.maxsize,
+            "max_bytes": self.max_bytes,
+            "disk_entries": disk_entries,
+            "ttl": self.ttl,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "pruned": self.pruned,
+            "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "lookup_p50_us": round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+            "lookup_p99_us": round(float(np.percentile(latencies, 99)), 1) if len(latencies) else None
+        }
@@ -0,0 +1,98 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+class ExecutorBusy(Exception):
+    """Raised when the compute queue is full and new work is refused."""
+
+class ComputeExecutor:
+    """
+    Runs CPU-bound work (rules, ML inference, forecasting) off the asyncio event loop.
+
+    kind:
+        "thread"  - ThreadPoolExecutor (NumPy releases the GIL for most array work)
+        "process" - ProcessPoolExecutor; functions and arguments must be picklable
+        "inline"  - run on the event loop, the pre-executor behaviour (for comparison)
+
+    At most `max_pending` jobs may be queued or running; beyond that run() raises
+    ExecutorBusy instead of letting the backlog grow without bound.
+    """
+
+    def __init__(self, kind="thread", max_workers=None, max_pending=64):
+        if kind not in ("thread", "process", "inline"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.recycles = 0
+        # Stateful work (e.g. the dataset cursor) must stay in this process, so a thread pool always exists
+        self._threads = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="compute")
+        self._processes = ProcessPoolExecutor(max_workers=self.max_workers) if kind == "process" else None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            kind=os.getenv("COMPUTE_EXECUTOR", "thread"),
+            max_workers=int(os.getenv("COMPUTE_WORKERS", "0")) or None,
+            max_pending=int(os.getenv("COMPUTE_MAX_PENDING", "64"))
+        )
+
+    async def run(self, fn, *args, stateful=False):
+        """
+        Await fn(*args) on the configured pool.
+
+        Args:
+            stateful: fn mutates in-process objects, so it runs on the thread pool
+                even when the executor is process-based.
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ExecutorBusy(f"Compute queue full ({self.max_pending} jobs pending)")
+
+        self.pending += 1
+        try:
+            if self.kind == "inline":
+                result = fn(*args)
+            else:
+                pool = self._threads if stateful or self._processes is None else self._processes
+                result = await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    def recycle(self):
+        """
+        Replace the worker processes, e.g. after the ML model was reloaded: they
+        hold their own copy of module globals. Jobs already submitted finish on
+        the old workers. No-op for thread and inline executors.
+        """
+        if self._processes is None:
+            return
+        old, self._processes = self._processes, ProcessPoolExecutor(max_workers=self.max_workers)
+        old.shutdown(wait=False)
+        self.recycles += 1
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "recycles": self.recycles
+        }
@@ -0,0 +1,164 @@
+import numpy as np
+
+class CompiledForest:
+    """
+    A fitted sklearn RandomForestClassifier flattened into contiguous NumPy node arrays.
+
+    All trees share one set of pre-order node arrays (feature, threshold, right
+    child, leaf probabilities). A single vectorized traversal walks every tree for every
+    row at once and returns both the predicted class and the class
+    probabilities, so the forest is only walked once per request.
+    """
+
+    BLOCK_ROWS = 256
+
+    def __init__(self, feature, threshold, right, value, roots, max_depth, classes, feature_names,
+                 mean=None, scale=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.classes_ = classes
+        self.feature_names = feature_names
+        self.mean = mean
+        self.scale = scale
+
+    @classmethod
+    def from_sklearn(cls, model, scaler=None, feature_names=None):
+        """
+        Compile a fitted RandomForestClassifier.
+
+        Args:
+            model: Fitted sklearn RandomForestClassifier (single output).
+            scaler: Optional fitted StandardScaler the model was trained behind.
+                It is applied by prepare(), so inputs are passed in raw sensor
+                units. (Folding it into the thresholds instead would not round
+                like sklearn does and flips rows that sit on a split.)
+            feature_names: Input column order. Defaults to the names seen at fit
+                time by the scaler or the model.
+        """
+        if getattr(model, "n_outputs_", 1) != 1:
+            raise ValueError("Only single-output forests can be compiled.")
+
+        if feature_names is None:
+            source = scaler if scaler is not None else model
+            if not hasattr(source, "feature_names_in_"):
+                raise ValueError("feature_names is required when the model was fitted without column names.")
+            feature_names = list(source.feature_names_in_)
+
+        features, thresholds, rights, values, roots = [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            order = _preorder(tree.children_left, tree.children_right)
+            n = len(order)
+            # position of every original node id in the pre-order layout
+            position = np.empty(n, dtype=np.intp)
+            position[order] = np.arange(n)
+
+            children_right = tree.children_right[order]
+            is_leaf = children_right == -1
+            feature = np.where(is_leaf, 0, tree.feature[order])
+            threshold = tree.threshold[order].astype(np.float64)
+            # In pre-order the left child is always the next node, so only the right
+            # child is stored. Leaves compare against NaN (never true) and take their
+            # "right" edge back to themselves, which makes extra traversal steps no-ops.
+            threshold = np.where(is_leaf, np.nan, threshold)
+            right = np.where(is_leaf, np.arange(n), position[children_right]) + offset
+
+            value = tree.value[order, 0, :].astype(np.float64)
+            totals = value.sum(axis=1, keepdims=True)
+            totals[totals == 0.0] = 1.0
+            value = value / totals
+
+            features.append(feature)
+            thresholds.append(threshold)
+            rights.append(right)
+            values.append(value)
+            roots.append(offset)
+            offset += n
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(features), dtype=np.int32),
+            threshold=np.ascontiguousarray(np.concatenate(thresholds)),
+            right=np.ascontiguousarray(np.concatenate(rights), dtype=np.int32),
+            value=np.ascontiguousarray(np.concatenate(values)),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max_depth,
+            classes=np.asarray(model.classes_),
+            feature_names=feature_names,
+            mean=scaler.mean_ if scaler is not None and scaler.with_mean else None,
+            scale=scaler.scale_ if scaler is not None and scaler.with_std else None,
+        )
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def matrix_from(self, columns):
+        """Stack a dict of equal-length columns into an input matrix in feature order."""
+        return np.column_stack([np.asarray(columns[name], dtype=np.float64) for name in self.feature_names])
+
+    def prepare(self, X):
+        """
+        The values the split thresholds are compared against: inputs scaled like
+        StandardScaler.transform (if compiled with a scaler), then rounded to
+        float32 as sklearn's trees do. X has shape (n_rows, n_features).
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if self.mean is not None:
+            X = X - self.mean
+        if self.scale is not None:
+            X = X / self.scale
+        return X.astype(np.float32).astype(np.float64)
+
+    def predict_proba(self, X):
+        """Average leaf probabilities over all trees. X has shape (n_rows, n_features)."""
+        X = self.prepare(X)
+
+        # Walk in row blocks so the (rows x trees) node matrix stays cache-resident
+        proba = np.empty((X.shape[0], self.value.shape[1]))
+        for start in range(0, X.shape[0], self.BLOCK_ROWS):
+            stop = start + self.BLOCK_ROWS
+            proba[start:stop] = self._walk(X[start:stop])
+        return proba
+
+    def _walk(self, X):
+        n_rows, n_features = X.shape
+        # Row offsets into the flattened input, so each step is a 1-D gather
+        flat_X = X.ravel()
+        row_base = (np.arange(n_rows, dtype=np.int32) * n_features)[:, None]
+        node = np.repeat(self.roots[None, :], n_rows, axis=0)
+        for _ in range(self.max_depth):
+            go_left = np.take(flat_X, row_base + np.take(self.feature, node)) <= np.take(self.threshold, node)
+            node = np.where(go_left, node + 1, np.take(self.right, node))
+
+        return np.take(self.value, node, axis=0).sum(axis=1) / self.n_trees
+
+    def predict(self, X):
+        """
+        Returns:
+            labels: Predicted class label per row (same as model.predict).
+            proba: Class probabilities per row (same as model.predict_proba).
+        """
+        proba = self.predict_proba(X)
+        return self.classes_[np.argmax(proba, axis=1)], proba
+
+
+def _preorder(children_left, children_right):
+    """Node ids of one tree in depth-first pre-order (node, left subtree, right subtree)."""
+    order = []
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        if children_left[node] != -1:
+            stack.append(children_right[node])
+            stack.append(children_left[node])
+    return np.asarray(order, dtype=np.intp)
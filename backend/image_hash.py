@@ -0,0 +1,251 @@
+"""
+Perceptual hashes and a Hamming-distance index for near-duplicate uploads.
+
+Staff often photograph the same fish again from almost the same angle. The
+bytes differ, so the exact (SHA-256) diagnosis cache misses, but the 64-bit
+perceptual hashes of the two photos are only a few bits apart.
+HammingIndex finds a stored hash within a given distance without scanning
+every stored image.
+"""
+import io
+
+import numpy as np
+from PIL import Image, ImageOps
+
+HASH_BITS = 64
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+_DCT32 = _dct_matrix(32)
+_BIT_WEIGHTS = (1 << np.arange(HASH_BITS - 1, -1, -1, dtype=np.uint64)).astype(np.uint64)
+
+def _pack(bits):
+    return int(np.bitwise_or.reduce(_BIT_WEIGHTS[bits.ravel()]))
+
+def _gray(image, size):
+    return np.asarray(image.convert("L").resize(size, Image.Resampling.LANCZOS), dtype=np.float64)
+
+def phash(image):
+    """
+    DCT hash: sign of the 8x8 lowest frequencies (DC excluded from the median) of a 32x32 grayscale image.
+
+    Robust to re-encoding, rescaling and small brightness/contrast changes.
+    """
+    coefficients = (_DCT32 @ _gray(image, (32, 32)) @ _DCT32.T)[:8, :8]
+    return _pack(coefficients > np.median(coefficients.ravel()[1:]))
+
+def dhash(image):
+    """Difference hash: whether each pixel of a 9x8 grayscale image is brighter than its right neighbour."""
+    pixels = _gray(image, (9, 8))
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+def hash_image(data, method=phash):
+    """Perceptual hash (int) of encoded image bytes, after applying the EXIF orientation."""
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("RGB", (256, 256))
+        return method(ImageOps.exif_transpose(image))
+
+def popcount(values):
+    """Set bits of each element of a uint64 array."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+class HammingIndex:
+    """
+    Multi-index hashing (Norouzi et al.) over 64-bit hashes.
+
+    Each hash is split into `chunks` substrings. If two hashes are within
+    `radius` bits, then by the pigeonhole principle some substring differs in
+    at most radius // chunks bits. Per substring position the index keeps
+    its hashes grouped by substring value (all positions in one array, tagged
+    with the position in the high bits, plus an offset table per substring
+    value). A query reads the group of every substring value within that
+    distance and checks the candidates' full distance in one vectorised
+    popcount. New hashes go to a small unsorted tail that is scanned
+    directly and merged into the groups (one linear pass) once it grows.
+    Discarded payloads are skipped by lookups and dropped for good when the
+    index is compacted.
+    """
+
+    def __init__(self, radius=6, chunks=4):
+        """
+        Args:
+            radius: Largest Hamming distance reported as a match.
+            chunks: Substrings per hash: 4, 8 or 16. More chunks mean fewer
+                probes per substring but larger groups to check.
+        """
+        if chunks not in (4, 8, 16):
+            raise ValueError(f"chunks must be 4, 8 or 16, got {chunks}")
+        self.radius = radius
+        self.chunks = chunks
+        self.chunk_bits = HASH_BITS // chunks
+        self._mask = np.uint64((1 << self.chunk_bits) - 1)
+        self._shifts = np.arange(chunks, dtype=np.uint64) * np.uint64(self.chunk_bits)
+        # Position tag (high bits) | substring XOR mask, for every position and mask
+        masks = np.array(self._probe_masks(radius // chunks), dtype=np.uint64)
+        self._tags = np.repeat(np.arange(chunks, dtype=np.uint64) << np.uint64(self.chunk_bits), len(masks))
+        self._probes = np.tile(masks, chunks)
+        self._probe_shifts = np.repeat(self._shifts, len(masks))
+        self.merges = 0
+        self._reset()
+
+    def _reset(self):
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._removed = np.zeros(1024, dtype=bool)
+        self._indexed = 0 # hashes [0, _indexed) are in the sorted table, the rest in the tail
+        # Indexed hashes ordered by (position tag | substring), their ids, and where each key's group starts
+        self._grouped = np.zeros(0, dtype=np.uint64)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros((self.chunks << self.chunk_bits) + 1, dtype=np.int64)
+        self.values = []
+        self._where = {} # payload -> id, for discard()
+        self.removed = 0
+
+    def _probe_masks(self, distance):
+        # Every XOR mask of chunk_bits bits with at most `distance` bits set
+        masks = {0}
+        for _ in range(distance):
+            masks |= {m | (1 << b) for m in masks for b in range(self.chunk_bits)}
+        return sorted(masks)
+
+    def __len__(self):
+        return len(self.values) - self.removed
+
+    def __contains__(self, payload):
+        return payload in self._where
+
+    def _reserve(self, count):
+        n = len(self.values)
+        if n + count > len(self._hashes):
+            size = max(n + count, 2 * len(self._hashes))
+            grown = np.zeros(size, dtype=np.uint64)
+            grown[:n] = self._hashes[:n]
+            self._hashes = grown
+            removed = np.zeros(size, dtype=bool)
+            removed[:n] = self._removed[:n]
+            self._removed = removed
+
+    def add(self, value, payload=None):
+        """Store a hash with the payload returned by lookups (e.g. a cache key). Returns its id."""
+        return self.add_many([value], [payload])
+
+    def add_many(self, hashes, payloads=None):
+        """Store many hashes at once (e.g. when rebuilding from disk). Returns the id of the last one."""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        payloads = list(payloads) if payloads is not None else [None] * len(hashes)
+        for payload in payloads:
+            self.discard(payload) # a re-added payload keeps only its latest hash
+        n, count = len(self.values), len(hashes)
+        self._reserve(count)
+        self._hashes[n:n + count] = hashes
+        self.values.extend(payloads)
+        self._where.update((payload, n + i) for i, payload in enumerate(payloads) if payload is not None)
+        # Keep the scanned tail short relative to the index
+        if len(self.values) - self._indexed > max(1024, self._indexed // 256):
+            self._merge()
+        return len(self.values) - 1
+
+    def discard(self, payload):
+        """
+        Stop returning `payload` (e.g. its cache entry expired). Returns whether it was indexed.
+
+        Its slot is reclaimed once more than half of the index is discarded.
+        """
+        i = self._where.pop(payload, None) if payload is not None else None
+        if i is None:
+            return False
+        self._removed[i] = True
+        self.values[i] = None
+        self.removed += 1
+        if self.removed > max(1024, len(self.values) // 2):
+            self._compact()
+        return True
+
+    def _compact(self):
+        n = len(self.values)
+        live = ~self._removed[:n]
+        hashes = self._hashes[:n][live].copy()
+        payloads = [payload for payload, alive in zip(self.values, live.tolist()) if alive]
+        self._reset()
+        self.add_many(hashes, payloads)
+
+    def _merge(self):
+        n = len(self.values)
+        tail = self._hashes[self._indexed:n]
+        keys = (tail[None, :] >> self._shifts[:, None]) & self._mask
+        keys |= np.arange(self.chunks, dtype=np.uint64)[:, None] << np.uint64(self.chunk_bits)
+        keys = keys.ravel().astype(np.int64)
+        order = np.argsort(keys)
+        keys = keys[order]
+        ids = np.tile(np.arange(self._indexed, n), self.chunks)[order]
+        # Append each new hash at the end of its groups; candidates of one probe stay contiguous
+        if self._indexed:
+            positions = self._offsets[keys + 1]
+            self._grouped = np.insert(self._grouped, positions, tail[ids - self._indexed])
+            self._ids = np.insert(self._ids, positions, ids)
+        else:
+            self._grouped, self._ids = tail[ids], ids
+        self._offsets[1:] += np.cumsum(np.bincount(keys, minlength=len(self._offsets) - 1))
+        self._indexed = n
+        self.merges += 1
+
+    def _candidates(self, value):
+        # Positions in _grouped of every hash sharing a substring within radius // chunks bits (may repeat)
+        keys = (self._tags | (((value >> self._probe_shifts) & self._mask) ^ self._probes)).astype(np.int64)
+        starts = self._offsets[keys]
+        lengths = self._offsets[keys + 1] - starts
+        # Concatenate the ranges [start, start + length) without a Python loop
+        ends = np.cumsum(lengths)
+        return np.arange(ends[-1]) + np.repeat(starts - (ends - lengths), lengths)
+
+    def within(self, value, radius=None, limit=None):
+        """
+        Stored hashes within `radius` (default: the index radius, which is also the maximum).
+
+        Returns:
+            [(payload, distance), ...], closest first, at most `limit` of them.
+        """
+        radius = self.radius if radius is None else min(radius, self.radius)
+        value = np.uint64(value)
+        positions = self._candidates(value)
+        # Candidates from the grouped table, then the unindexed tail
+        ids = np.concatenate([self._ids[positions], np.arange(self._indexed, len(self.values))])
+        if not len(ids):
+            return []
+        hashes = np.concatenate([self._grouped[positions], self._hashes[self._indexed:len(self.values)]])
+        distances = popcount(hashes ^ value)
+        keep = (distances <= radius) & ~self._removed[ids]
+        # A hash sharing several substrings with the query is a candidate more than once
+        ids, first = np.unique(ids[keep], return_index=True)
+        distances = distances[keep][first]
+        order = np.argsort(distances, kind="stable")[:limit]
+        return [(self.values[i], int(d)) for i, d in zip(ids[order].tolist(), distances[order].tolist())]
+
+    def nearest(self, value, radius=None):
+        """
+        Closest stored hash within `radius` (see within()).
+
+        Returns:
+            (payload, distance), or (None, None) if nothing is that close.
+        """
+        matches = self.within(value, radius, limit=1)
+        return matches[0] if matches else (None, None)
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "radius": self.radius,
+            "chunks": self.chunks,
+            "probes_per_query": len(self._probes),
+            "unindexed": len(self.values) - self._indexed,
+            "removed": self.removed,
+            "merges": self.merges
+        }
@@ -0,0 +1,85 @@
+"""
+Upload normalization for /api/diagnose.
+
+Phone photos arrive as multi-megabyte JPEG/HEIC/PNG files with EXIF (GPS,
+camera data). The model only needs a few hundred pixels across the fish, so
+uploads are decoded, rotated upright, downscaled to a maximum edge and
+re-encoded as JPEG without metadata before they are sent.
+"""
+import io
+import os
+
+from PIL import Image, ImageOps
+
+from image_hash import phash
+
+# Longest edge sent to the model, and the JPEG quality it is re-encoded at
+MAX_EDGE = int(os.getenv("CV_MAX_EDGE", "1024"))
+JPEG_QUALITY = int(os.getenv("CV_JPEG_QUALITY", "85"))
+
+# Magic bytes -> MIME type of the formats the model accepts
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+def detect_format(data):
+    """
+    MIME type of an image from its first bytes.
+
+    Returns:
+        e.g. "image/jpeg", "image/webp", "image/heic"; None if not recognised.
+    """
+    for magic, mime in SIGNATURES:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp" and data[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "image/heic"
+    return None
+
+def prepare_image(data, max_edge=MAX_EDGE, quality=JPEG_QUALITY, perceptual_hash=False):
+    """
+    Decode, orient, downscale and re-encode one upload.
+
+    Runs on a worker (CPU-bound); arguments and result are plain bytes/dicts
+    so it also works on a process pool.
+
+    Args:
+        data: Uploaded file bytes.
+        max_edge: Longest edge in pixels after resizing (smaller images keep their size).
+        quality: JPEG quality of the re-encoded image.
+        perceptual_hash: Also set info["phash"] (image_hash.phash of the
+            upright image), so the upload is decoded only once.
+
+    Returns:
+        (image bytes, MIME type, info). If the image cannot be decoded (e.g. a
+        format Pillow lacks a plugin for) the original bytes are returned with
+        their detected type and info["error"] set.
+    """
+    info = {"original_bytes": len(data), "original_format": detect_format(data)}
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            info["original_size"] = list(image.size)
+            # JPEGs are decoded at 1/2..1/8 scale when that still covers max_edge; thumbnail() does the rest
+            image.draft("RGB", (max_edge, max_edge))
+            # Apply the EXIF orientation before the EXIF block is dropped
+            image = ImageOps.exif_transpose(image)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            if perceptual_hash:
+                info["phash"] = phash(image)
+            out = io.BytesIO()
+            # No exif/icc_profile passed: the output carries no metadata
+            image.save(out, format="JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        info.update(bytes=len(data), error=f"Preprocessing failed: {str(e)}")
+        return data, info["original_format"] or "image/jpeg", info
+
+    prepared = out.getvalue()
+    info.update(bytes=len(prepared), size=list(image.size), format="image/jpeg")
+    return prepared, "image/jpeg", info
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import time
+
+class Subscription:
+    """
+    One client's mailbox of encoded frames.
+
+    Holds at most `maxsize` frames. When a slow client falls behind, the oldest
+    frame is dropped to make room, so the client skips to the freshest data
+    instead of the server buffering a backlog for it.
+    """
+
+    def __init__(self, maxsize=1):
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def offer(self, payload):
+        """Enqueue without waiting; returns True if an older frame had to be dropped."""
+        dropped = False
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            dropped = True
+        self.queue.put_nowait(payload)
+        return dropped
+
+    async def get(self):
+        return await self.queue.get()
+
+class LiveBroadcaster:
+    """
+    Single server-side tick fanned out to every subscriber.
+
+    Each tick calls `produce` once and encodes the frame once; subscribers only
+    receive the bytes. The tick task runs while at least one client is subscribed.
+    """
+
+    def __init__(self, produce, interval=5.0, buffer=1):
+        """
+        Args:
+            produce: Async zero-argument callable returning the next frame (a JSON-serializable dict).
+            interval: Seconds between ticks.
+            buffer: Frames kept per subscriber before the oldest is dropped.
+        """
+        self.produce = produce
+        self.interval = interval
+        self.buffer = buffer
+        self.subscribers = set()
+        self.latest = None # last encoded frame, sent to clients as soon as they join
+        self._task = None
+        self.ticks = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.fanout_seconds = 0.0
+
+    @staticmethod
+    def encode(frame, tick):
+        # Server-Sent Events framing; the id lets clients tell ticks apart
+        return f"id: {tick}\ndata: {json.dumps(frame)}\n\n".encode()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self.subscribers:
+            started = loop.time()
+            try:
+                frame = await self.produce()
+            except Exception as e:
+                frame = {"error": f"Live stream failed: {str(e)}"}
+            self.publish(self.encode(frame, self.ticks + 1))
+            await asyncio.sleep(max(0.0, self.interval - (loop.time() - started)))
+        self._task = None
+
+    def publish(self, payload):
+        """Fan one encoded frame out to every current subscriber."""
+        start = time.perf_counter()
+        self.latest = payload
+        self.ticks += 1
+        for subscription in self.subscribers:
+            self.frames_dropped += subscription.offer(payload)
+        self.frames_sent += len(self.subscribers)
+        self.fanout_seconds += time.perf_counter() - start
+
+    async def stream(self):
+        """Async generator of encoded frames for one client; unsubscribes when the client goes away."""
+        subscription = Subscription(self.buffer)
+        if self._task is not None and self.latest is not None:
+            subscription.offer(self.latest)
+        self.subscribers.add(subscription)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        try:
+            while True:
+                yield await subscription.get()
+        finally:
+            self.subscribers.discard(subscription)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "interval": self.interval,
+            "ticks": self.ticks,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "fanout_ms_per_tick": round(self.fanout_seconds * 1e3 / self.ticks, 3) if self.ticks else 0.0
+        }
@@ -1,4 +1,50 @@
+import numpy as np
+
 class ExpertRules:
+    # Batch rule table, in the order evaluate() appends triggers:
+    # (trigger label, health penalty, is_critical). Bit i of a trigger mask is row i.
+    TRIGGER_RULES = (
+        ("Hypoxia (Critical Low Oxygen)", 40, True),
+        ("Low Oxygen (Warning)", 20, False),
+        ("Toxic Ammonia (Critical)", 40, True),
+        ("Elevated Ammonia (Warning)", 20, False),
+        ("Acidic Water (Critical)", 30, True),
+        ("Low pH (Warning)", 10, False),
+        ("Alkaline Water (Critical)", 30, True),
+        ("High pH (Warning)", 10, False),
+        ("High Turbidity (risk)", 20, True),
+        ("Turbidity Warning", 10, False),
+        ("Temperature Stress (Critical)", 30, True),
+        ("Temperature Warning", 10, False),
+    )
+    RISK_LEVELS = ("Optimal", "Warning", "Risk")
+    # Suggestion table, in the order generate_suggestions() appends them:
+    # (parameter, message template for the amount). Bit i of a suggestion mask is row i.
+    SUGGESTION_RULES = (
+        ("dissolved_oxygen", "Increase Dissolved Oxygen by {:.1f} mg/L by increasing aeration or checking air stones."),
+        ("ph", "Raise pH by {:.1f} to reach 7.0 by adding crushed coral, lime, or baking soda."),
+        ("ph", "Lower pH by {:.1f} to reach 8.0 by adding peat moss, driftwood, or CO2 injection."),
+        ("turbidity", "Reduce Turbidity by {:.1f} NTU by cleaning filters, reducing feeding, or performing a partial water change."),
+        ("temperature", "Increase Temperature by {:.1f}°C by checking heater settings or insulating the tank."),
+        ("temperature", "Decrease Temperature by {:.1f}°C by using a chiller, fan, or adding cool water."),
+    )
+    OPTIMAL_SUGGESTION = "Conditions are optimal. Continue regular monitoring."
+    # Per TRIGGER_RULES row: its mask bit and health penalty; and the bits of the critical rules
+    _TRIGGER_BITS = np.int64(1) << np.arange(len(TRIGGER_RULES), dtype=np.int64)
+    _TRIGGER_POINTS = np.array([rule[1] for rule in TRIGGER_RULES], dtype=np.int64)
+    _CRITICAL_BITS = int(_TRIGGER_BITS[[rule[2] for rule in TRIGGER_RULES]].sum())
+    _SUGGESTION_BITS = np.int64(1) << np.arange(len(SUGGESTION_RULES), dtype=np.int64)
+    _MASK_TEXT = {} # trigger_mask -> (triggers, recommendation); at most 2**len(TRIGGER_RULES) entries
+    # Values evaluate() compares each input against. Readings that fall between the
+    # same boundaries get the same risk status, triggers and health score.
+    BOUNDARIES = {
+        "dissolved_oxygen": (5.0, 6.0),
+        "ammonia": (0.02, 0.05),
+        "ph": (6.5, 6.8, 8.2, 8.5),
+        "turbidity": (15.0, 25.0),
+        "temperature": (20.0, 22.0, 32.0, 34.0),
+    }
+
     @staticmethod
     def evaluate(data):
         """
@@ -86,6 +132,120 @@ class ExpertRules:
             "suggestions_map": suggestions_map
         }
 
+    @staticmethod
+    def score_batch(temperature, ph, dissolved_oxygen, turbidity, ammonia=None):
+        """
+        Apply the expert rules to columnar readings using array masks.
+
+        Args:
+            temperature, ph, dissolved_oxygen, turbidity: 1-D array-likes of equal length.
+            ammonia: Optional array-like. When None the ammonia rules are skipped,
+                like evaluate() does for inputs without an ammonia attribute.
+
+        Returns:
+            Dict of arrays: "risk_level" (0=Optimal, 1=Warning, 2=Risk),
+            "health_score", "trigger_mask" (bits follow TRIGGER_RULES),
+            "suggestion_mask" (bits follow SUGGESTION_RULES) and
+            "suggestion_amount" (n x len(SUGGESTION_RULES), the amount each
+            suggestion asks for; only meaningful where its bit is set).
+        """
+        temp = np.asarray(temperature, dtype=np.float64)
+        ph = np.asarray(ph, dtype=np.float64)
+        do = np.asarray(dissolved_oxygen, dtype=np.float64)
+        turb = np.asarray(turbidity, dtype=np.float64)
+
+        # "elif" branches are expressed as ~critical & warning so NaN behaves like the scalar path
+        do_crit = do < 5.0
+        if ammonia is None:
+            nh3_crit = nh3_warn = np.zeros(do.shape, dtype=bool)
+        else:
+            nh3 = np.asarray(ammonia, dtype=np.float64)
+            nh3_crit = nh3 > 0.05
+            nh3_warn = ~nh3_crit & (nh3 > 0.02)
+        acid_crit = ph < 6.5
+        alk_crit = ph > 8.5
+        turb_crit = turb > 25
+        temp_crit = (temp < 20) | (temp > 34)
+
+        conditions = np.array([
+            do_crit, ~do_crit & (do < 6.0),
+            nh3_crit, nh3_warn,
+            acid_crit, ~acid_crit & (ph < 6.8),
+            alk_crit, ~alk_crit & (ph > 8.2),
+            turb_crit, ~turb_crit & (turb > 15),
+            temp_crit, ~temp_crit & ((temp < 22) | (temp > 32)),
+        ])
+        # One product per output instead of a pass per rule: fewer NumPy calls for small batches
+        trigger_mask = ExpertRules._TRIGGER_BITS @ conditions
+        penalty = ExpertRules._TRIGGER_POINTS @ conditions
+
+        ph_low = ph < 7.0
+        temp_low = temp < 26
+        suggestions = np.array([
+            do < 6.0,
+            ph_low, ~ph_low & (ph > 8.0),
+            turb > 15,
+            temp_low, ~temp_low & (temp > 30),
+        ])
+
+        return {
+            "risk_level": np.where(trigger_mask & ExpertRules._CRITICAL_BITS, 2, trigger_mask != 0),
+            "health_score": np.maximum(0, 100 - penalty),
+            "trigger_mask": trigger_mask,
+            "suggestion_mask": ExpertRules._SUGGESTION_BITS @ suggestions,
+            "suggestion_amount": np.array([6.0 - do, 7.0 - ph, ph - 8.0, turb - 10, 26 - temp, temp - 30]).T,
+        }
+
+    @staticmethod
+    def evaluate_batch(temperature, ph, dissolved_oxygen, turbidity, ammonia=None):
+        """
+        Vectorized equivalent of evaluate() for many readings at once.
+
+        Scores are computed with score_batch(). Trigger labels and recommendation
+        text depend only on the trigger mask and are cached per mask; suggestion text is
+        formatted one SUGGESTION_RULES column at a time, only for the readings
+        whose suggestion mask has that bit.
+
+        Returns:
+            List of dicts identical to what evaluate() returns for each row.
+        """
+        scores = ExpertRules.score_batch(temperature, ph, dissolved_oxygen, turbidity, ammonia)
+        levels = scores["risk_level"].tolist()
+        health = scores["health_score"].tolist()
+        masks = scores["trigger_mask"].tolist()
+        suggestion_mask = scores["suggestion_mask"]
+        amounts = scores["suggestion_amount"]
+
+        # Per reading, in generate_suggestions() order (bits are in that order)
+        suggestions = [[] for _ in levels]
+        suggestion_maps = [{} for _ in levels]
+        for bit, (param, template) in enumerate(ExpertRules.SUGGESTION_RULES):
+            rows = np.flatnonzero(suggestion_mask >> bit & 1)
+            for i, msg in zip(rows.tolist(), map(template.format, amounts[rows, bit].tolist())):
+                suggestions[i].append(msg)
+                suggestion_maps[i][param] = msg
+
+        by_mask = ExpertRules._MASK_TEXT
+        results = []
+        for i, level in enumerate(levels):
+            mask = masks[i]
+            text = by_mask.get(mask)
+            if text is None:
+                # The risk level follows from the mask, so it needs no part in the key
+                labels = [rule[0] for bit, rule in enumerate(ExpertRules.TRIGGER_RULES) if mask >> bit & 1]
+                text = by_mask[mask] = (tuple(labels), ExpertRules.get_recommendation(ExpertRules.RISK_LEVELS[level], labels))
+            triggers, recommendation = text
+
+            results.append({
+                "risk_status": ExpertRules.RISK_LEVELS[level],
+                "triggers": list(triggers),
+                "health_score": health[i],
+                "recommendation": recommendation,
+                "suggestions": suggestions[i] or [ExpertRules.OPTIMAL_SUGGESTION],
+                "suggestions_map": suggestion_maps[i]
+            })
+        return results
+
     @staticmethod
     def get_recommendation(status, triggers):
         if status == "Optimal":
@@ -119,45 +279,36 @@ class ExpertRules:
         suggestions_list = []
         suggestions_map = {}
         
+        rules = ExpertRules.SUGGESTION_RULES
+
+        def suggest(rule, amount):
+            param, template = rules[rule]
+            msg = template.format(amount)
+            suggestions_list.append(msg)
+            suggestions_map[param] = msg
+
         # Dissolved Oxygen (Target 6.0+)
         if data.dissolved_oxygen < 6.0:
-            diff = 6.0 - data.dissolved_oxygen
-            msg = f"Increase Dissolved Oxygen by {diff:.1f} mg/L by increasing aeration or checking air stones."
-            suggestions_list.append(msg)
-            suggestions_map["dissolved_oxygen"] = msg
+            suggest(0, 6.0 - data.dissolved_oxygen)
 
         # pH (Target 7.0 - 8.0)
         if data.ph < 7.0:
-            diff = 7.0 - data.ph
-            msg = f"Raise pH by {diff:.1f} to reach 7.0 by adding crushed coral, lime, or baking soda."
-            suggestions_list.append(msg)
-            suggestions_map["ph"] = msg
+            suggest(1, 7.0 - data.ph)
         elif data.ph > 8.0:
-            diff = data.ph - 8.0
-            msg = f"Lower pH by {diff:.1f} to reach 8.0 by adding peat moss, driftwood, or CO2 injection."
-            suggestions_list.append(msg)
-            suggestions_map["ph"] = msg
+            suggest(2, data.ph - 8.0)
             
         # Turbidity (Turn down to < 10)
         if data.turbidity > 15:
-             msg = f"Reduce Turbidity by {data.turbidity - 10:.1f} NTU by cleaning filters, reducing feeding, or performing a partial water change."
-             suggestions_list.append(msg)
-             suggestions_map["turbidity"] = msg
+            suggest(3, data.turbidity - 10)
 
         # Temperature (Target 26-30 for optimal growth, 20-34 is safe)
         if data.temperature < 26:
-            diff = 26 - data.temperature
-            msg = f"Increase Temperature by {diff:.1f}°C by checking heater settings or insulating the tank."
-            suggestions_list.append(msg)
-            suggestions_map["temperature"] = msg
+            suggest(4, 26 - data.temperature)
         elif data.temperature > 30:
-            diff = data.temperature - 30
-            msg = f"Decrease Temperature by {diff:.1f}°C by using a chiller, fan, or adding cool water."
-            suggestions_list.append(msg)
-            suggestions_map["temperature"] = msg
+            suggest(5, data.temperature - 30)
             
         if not suggestions_list:
-            suggestions_list = ["Conditions are optimal. Continue regular monitoring."]
+            suggestions_list = [ExpertRules.OPTIMAL_SUGGESTION]
             
         return suggestions_list, suggestions_map
 
@@ -253,10 +404,29 @@ class ExpertRules:
 
         return solutions
 
-import numpy as np
 from datetime import datetime, timedelta
 
 class Forecaster:
+    # Forecast horizon in steps (assuming 5s data interval)
+    # 5m = 60 steps
+    # 1h = 720 steps
+    # 24h = 17280 steps
+    STEPS_MAP = {
+        '5m': 60,
+        '1h': 720,
+        '24h': 17280
+    }
+
+    # Expert Thresholds for Insights
+    THRESHOLDS = {
+        "ph": {"min": 6.5, "max": 8.5, "unit": ""},
+        "dissolved_oxygen": {"min": 5.0, "max": 100.0, "unit": "mg/L"}, # Max is placeholder
+        "turbidity": {"min": -1.0, "max": 25.0, "unit": "NTU"}, # Min is placeholder
+        "temperature": {"min": 20.0, "max": 34.0, "unit": "°C"}
+    }
+
+    PARAMS = ("ph", "temperature", "dissolved_oxygen", "turbidity")
+
     @staticmethod
     def predict_trends(history: list, timeframe: str = '5m'):
         """
@@ -266,73 +436,162 @@ class Forecaster:
             history: List of dicts containing historical sensor data.
             timeframe: Prediction horizon ('5m', '1h', '24h').
         """
-        # Determine steps based on timeframe (assuming 5s data interval)
-        # 5m = 60 steps
-        # 1h = 720 steps
-        # 24h = 17280 steps
-        steps_map = {
-            '5m': 60,
-            '1h': 720,
-            '24h': 17280
-        }
-        forecast_steps = steps_map.get(timeframe, 60)
+        forecast_steps = Forecaster.STEPS_MAP.get(timeframe, 60)
         if len(history) < 5:
             return None, {}, [] # Not enough data
-            
-        projections = {
-            "ph": [],
-            "temperature": [],
-            "dissolved_oxygen": [],
-            "turbidity": []
-        }
-        
-        insights = []
-        
-        # Expert Thresholds for Insights
-        THRESHOLDS = {
-            "ph": {"min": 6.5, "max": 8.5, "unit": ""},
-            "dissolved_oxygen": {"min": 5.0, "max": 100.0, "unit": "mg/L"}, # Max is placeholder
-            "turbidity": {"min": -1.0, "max": 25.0, "unit": "NTU"}, # Min is placeholder
-            "temperature": {"min": 20.0, "max": 34.0, "unit": "°C"}
-        }
-        
+
+        projections, insights = Forecaster.project(Forecaster.fit_history(history), len(history), forecast_steps)
+        return history[-1].get("timestamp", datetime.now().isoformat()), projections, insights
+
+    @staticmethod
+    def compact_trends(history: list, timeframe: str = '5m', points: int = 60):
+        """
+        Like predict_trends, but returns the fitted lines plus `points` evenly spaced
+        projection samples instead of one value per 5s step (see Forecaster.compact).
+        """
+        if len(history) < 5:
+            return Forecaster.compact(None, 0, None) # Not enough data
+        start_time = history[-1].get("timestamp", datetime.now().isoformat())
+        return Forecaster.compact(Forecaster.fit_history(history), len(history), start_time, timeframe, points)
+
+    @staticmethod
+    def fit_history(history: list):
+        """Least-squares line per parameter; returns param -> (slope, intercept, current_value)."""
         # Prepare X axis (time steps)
         x = np.arange(len(history))
-        future_x = np.arange(len(history), len(history) + forecast_steps)
-        
-        for param in projections.keys():
+
+        fits = {}
+        for param in Forecaster.PARAMS:
             y = np.array([float(d[param]) for d in history])
             
             # Linear Regression (Degree 1)
             slope, intercept = np.polyfit(x, y, 1)
-            
+            fits[param] = (slope, intercept, y[-1])
+        return fits
+
+    @staticmethod
+    def compact(fits, n, start_time, timeframe='5m', points=60, seasonal=None):
+        """
+        Compact forecast response: fitted coefficients, a downsampled projection,
+        threshold-crossing times and insights. `fits` of None means not enough data.
+        `seasonal` is passed through to Forecaster.project.
+        """
+        if fits is None:
+            return {"start_time": None, "projection_steps": [], "projections": {}, "coefficients": {},
+                    "threshold_crossings": {}, "insights": []}
+
+        forecast_steps = Forecaster.STEPS_MAP.get(timeframe, 60)
+        projections, insights = Forecaster.project(fits, n, forecast_steps, points, seasonal)
+        return {
+            "start_time": start_time,
+            "projection_steps": Forecaster.sample_steps(forecast_steps, points).tolist(),
+            "projections": projections,
+            # x is the step index over the fitted history: 0 = oldest reading, n - 1 = start_time
+            "coefficients": {
+                param: {"slope": float(slope), "intercept": float(intercept), "n": n}
+                for param, (slope, intercept, _) in fits.items()
+            },
+            "threshold_crossings": Forecaster.threshold_crossings(fits, n, forecast_steps, seasonal),
+            "insights": insights
+        }
+
+    @staticmethod
+    def sample_steps(forecast_steps: int, points: int):
+        """Up to `points` evenly spaced step offsets in 1..forecast_steps, always including both ends."""
+        points = max(2, min(points, forecast_steps))
+        return np.unique(np.linspace(1, forecast_steps, points).round().astype(int))
+
+    @staticmethod
+    def threshold_crossings(fits: dict, n: int, forecast_steps: int, seasonal=None):
+        """
+        When each trend line crosses its expert threshold within the horizon.
+        Returns param -> {"threshold", "direction", "steps", "minutes"} or None.
+        """
+        crossings = {}
+        for param, (slope, intercept, current_val) in fits.items():
+            crossings[param] = None
+            if slope < 0 and current_val > Forecaster.THRESHOLDS[param]["min"]:
+                threshold, direction = Forecaster.THRESHOLDS[param]["min"], "below"
+            elif slope > 0 and current_val < Forecaster.THRESHOLDS[param]["max"]:
+                threshold, direction = Forecaster.THRESHOLDS[param]["max"], "above"
+            else:
+                continue
+            steps_remaining = Forecaster.steps_to_threshold(
+                slope, intercept, n, threshold, forecast_steps, (seasonal or {}).get(param)
+            )
+            if steps_remaining is not None and 0 < steps_remaining <= forecast_steps:
+                crossings[param] = {
+                    "threshold": threshold,
+                    "direction": direction,
+                    "steps": float(steps_remaining),
+                    "minutes": float(steps_remaining * 5 / 60) # 5s per step
+                }
+        return crossings
+
+    @staticmethod
+    def steps_to_threshold(slope, intercept, n, threshold, horizon, offset=None):
+        """
+        Steps past the fitted history until the projection reaches `threshold`.
+        Without a seasonal `offset` this is the straight-line solution; with one,
+        the first step within `horizon` where the seasonal path crosses, or None.
+        """
+        if offset is None:
+            return (threshold - intercept) / slope - n
+        h = np.arange(1, horizon + 1)
+        path = slope * (n - 1 + h) + intercept + offset(h)
+        hit = np.flatnonzero(path <= threshold if slope < 0 else path >= threshold)
+        return float(h[hit[0]]) if len(hit) else None
+
+    @staticmethod
+    def project(fits: dict, n: int, forecast_steps: int, points: int = None, seasonal: dict = None):
+        """
+        Extend fitted lines past the last observation and derive threshold insights.
+
+        Args:
+            fits: param -> (slope, intercept, current_value), with x = 0..n-1 over the history.
+            n: Number of observations the lines were fitted on.
+            forecast_steps: Number of future 5s steps to project.
+            points: If given, only project at Forecaster.sample_steps(forecast_steps, points)
+                instead of at every step.
+            seasonal: Optional param -> f(step_offsets) adding a seasonal component on top
+                of the line (step offsets count from the last observation, starting at 1).
+        """
+        projections = {}
+        insights = []
+        if points is None:
+            future_x = np.arange(n, n + forecast_steps)
+        else:
+            future_x = n - 1 + Forecaster.sample_steps(forecast_steps, points)
+
+        for param, (slope, intercept, current_val) in fits.items():
+            offset = (seasonal or {}).get(param)
+
             # Predict
             future_y = slope * future_x + intercept
+            if offset is not None:
+                future_y = future_y + offset(future_x - (n - 1))
             projections[param] = future_y.tolist()
             
             # Generate Insights
             # Rate of change per minute (since 1 step = 5s, 12 steps = 1 min)
             rate_per_min = slope * 12
             
-            current_val = y[-1]
-            t_min = THRESHOLDS[param]["min"]
-            t_max = THRESHOLDS[param]["max"]
-            unit = THRESHOLDS[param]["unit"]
+            t_min = Forecaster.THRESHOLDS[param]["min"]
+            t_max = Forecaster.THRESHOLDS[param]["max"]
+            unit = Forecaster.THRESHOLDS[param]["unit"]
             
             # Check for declining trend towards minimum
             if slope < 0 and current_val > t_min:
-                time_to_risk = (t_min - intercept) / slope
-                steps_remaining = time_to_risk - len(history)
-                if 0 < steps_remaining < 60: # Within next 5 mins (at 5s/step)
+                steps_remaining = Forecaster.steps_to_threshold(slope, intercept, n, t_min, 60, offset)
+                if steps_remaining is not None and 0 < steps_remaining < 60: # Within next 5 mins (at 5s/step)
                     minutes = steps_remaining * 5 / 60
                     insights.append(f"{param.replace('_', ' ').title()} is dropping at {abs(rate_per_min):.2f} {unit}/min. Risk of falling below {t_min} {unit} in {minutes:.1f} minutes.")
             
             # Check for rising trend towards maximum
             elif slope > 0 and current_val < t_max:
-                time_to_risk = (t_max - intercept) / slope
-                steps_remaining = time_to_risk - len(history)
-                if 0 < steps_remaining < 60:
+                steps_remaining = Forecaster.steps_to_threshold(slope, intercept, n, t_max, 60, offset)
+                if steps_remaining is not None and 0 < steps_remaining < 60:
                      minutes = steps_remaining * 5 / 60
                      insights.append(f"{param.replace('_', ' ').title()} is rising at {rate_per_min:.2f} {unit}/min. Risk of exceeding {t_max} {unit} in {minutes:.1f} minutes.")
 
-        return history[-1].get("timestamp", datetime.now().isoformat()), projections, insights
+        return projections, insights
@@ -1,24 +1,194 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, UploadFile, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
-from logic import ExpertRules
-from data_loader import DatasetStreamer
+import re
+from logic import ExpertRules, Forecaster
+from data_loader import DatasetStreamer, round_float32
 from weather_service import WeatherService
 from cv_service import CVService
+from forest_engine import CompiledForest
+from cache import AsyncMemo, TTLCache
+from executor import ComputeExecutor, ExecutorBusy
+from station_history import StationHistory, StationRegistry
+from smoothing import HoltForecaster, HoltWintersForecaster
+from live_stream import LiveBroadcaster
+from timeseries_store import TimeSeriesStore
+from contextlib import asynccontextmanager
+from datetime import datetime
+import asyncio
 import joblib
-import pandas as pd
+import json
+import hashlib
+import math
+import threading
+import time
+import numpy as np
 
 # ... (other imports)
 
-app = FastAPI(title="AquaNova Water Quality Predictor", version="1.0")
+# CPU-bound work (rules, ML, forecasting) is dispatched here so it never blocks the event loop.
+# COMPUTE_EXECUTOR=thread|process|inline, COMPUTE_WORKERS, COMPUTE_MAX_PENDING
+compute_pool = ComputeExecutor.from_env()
+# Seconds clients are asked to wait when the compute queue is full (LIVE_DATA_RETRY_AFTER is the old name)
+BUSY_RETRY_AFTER = os.getenv("BUSY_RETRY_AFTER", os.getenv("LIVE_DATA_RETRY_AFTER", "1"))
+
+def busy_response(response, what, e):
+    """503 + Retry-After for an ExecutorBusy: the server is saturated, callers should back off and retry."""
+    response.status_code = 503
+    response.headers["Retry-After"] = BUSY_RETRY_AFTER
+    return {"error": f"{what} failed: {str(e)}"}
+
+@asynccontextmanager
+async def lifespan(app):
+    global mqtt_bridge
+    retention = None
+    if timeseries is not None and TIMESERIES_RETENTION_DAYS > 0:
+        retention = asyncio.create_task(enforce_timeseries_retention(TIMESERIES_RETENTION_DAYS * 86400))
+    if os.getenv("MQTT_BROKER"):
+        # paho-mqtt is only needed when the bridge is enabled
+        from mqtt_bridge import MQTTBridge, ReadingQueue
+
+        queue = ReadingQueue(int(os.getenv("MQTT_QUEUE_SIZE", "1000")), os.getenv("MQTT_OVERFLOW", "coalesce"))
+        mqtt_bridge = await MQTTBridge(
+            lambda batch: compute_pool.run(analyze_live_readings, batch, stateful=True),
+            host=os.getenv("MQTT_BROKER"), port=int(os.getenv("MQTT_PORT", "1883")), queue=queue
+        ).start()
+    yield
+    if retention is not None:
+        retention.cancel()
+    if mqtt_bridge is not None:
+        await mqtt_bridge.stop()
+    for broadcaster in live_streams.values():
+        await broadcaster.close()
+    await weather_service.aclose()
+    compute_pool.shutdown()
+    if timeseries is not None:
+        # Readings are in the mapped segments; write them out before the process exits
+        timeseries.flush()
+
+app = FastAPI(title="AquaNova Water Quality Predictor", version="1.0", lifespan=lifespan)
 
 # Initialize Data Streamer
 # Use absolute path for reliability in this environment
 CSV_PATH = "/Users/abhi/Documents/Projects/AquaNova/dataset/Water Quality Monitoring Dataset_ Ireland.csv"
 streamer = DatasetStreamer(CSV_PATH)
 weather_service = WeatherService()
-cv_service = CVService()
+# Uploads are downscaled/re-encoded on the compute pool before they go to Gemini
+cv_service = CVService(executor=compute_pool)
+
+# Server-side forecasting state per station, so forecasts can be requested by id.
+# Every reading updates one model per method; requests pick the method.
+# The dataset replay behind /api/live-data is recorded as LIVE_STATION_ID.
+# STATIONS_MAX stations are kept in memory (least recently used are released);
+# posted readings need a station id of STATION_ID_PATTERN.
+LIVE_STATION_ID = "live"
+STATIONS_MAX = int(os.getenv("STATIONS_MAX", "10000"))
+STATION_ID_PATTERN = re.compile(r"[A-Za-z0-9_.:-]{1,64}")
+FORECAST_METHODS = {
+    "linear": lambda: StationHistory(capacity=int(os.getenv("FORECAST_WINDOW", "20"))),
+    "holt": lambda: HoltForecaster(),
+    "holt_winters": lambda: HoltWintersForecaster(season_length=int(os.getenv("HW_SEASON_LENGTH", "17280"))),
+}
+stations = StationRegistry(FORECAST_METHODS, eager=("linear",), history=lambda station_id: recent_readings(station_id),
+                           max_stations=STATIONS_MAX)
+# A replay session's forecasting state goes with its cursor (DATASET_MAX_SESSIONS, DATASET_SESSION_TTL)
+streamer.on_release = lambda session, station: stations.release(replay_station_id(station, session))
+
+# Every reading the API receives (MQTT and posted station readings) can be kept in an
+# append-only time-series store. TIMESERIES_DIR enables it (unset or "": disabled);
+# TIMESERIES_MAX_STATIONS stations at most, TIMESERIES_RETENTION_DAYS (0 keeps everything);
+# FORECAST_SEED_ROWS stored rows rebuild a station's forecasting state when it is first
+# requested after a restart (or after it was released from memory).
+TIMESERIES_DIR = os.getenv("TIMESERIES_DIR", "")
+TIMESERIES_MAX_STATIONS = int(os.getenv("TIMESERIES_MAX_STATIONS", "1000"))
+TIMESERIES_RETENTION_DAYS = float(os.getenv("TIMESERIES_RETENTION_DAYS", "0"))
+FORECAST_SEED_ROWS = int(os.getenv("FORECAST_SEED_ROWS", "2000"))
+timeseries = TimeSeriesStore(TIMESERIES_DIR, max_stations=TIMESERIES_MAX_STATIONS) if TIMESERIES_DIR else None
+
+async def enforce_timeseries_retention(max_age, interval=3600):
+    while True:
+        try:
+            deleted = await compute_pool.run(timeseries.enforce_retention, max_age, stateful=True)
+            if deleted:
+                print(f"Time-series retention: deleted {deleted} segments")
+        except ExecutorBusy as e:
+            print(f"Time-series retention skipped: {e}")
+        await asyncio.sleep(interval)
+
+def store_readings(batch, timestamp=None):
+    """
+    Append (station, readings) pairs to the time-series store, grouped per station.
+
+    Returns:
+        Stations the store refused (its station limit is reached); their readings are not stored.
+    """
+    now = timestamp or time.time()
+    by_station = {}
+    for station, readings in batch:
+        by_station.setdefault(station, []).append(readings)
+    refused = []
+    for station, rows in by_station.items():
+        try:
+            timeseries.append(station, [now] * len(rows), {
+                name: [readings.get(name, math.nan) for readings in rows] for name in timeseries.channels
+            })
+        except ValueError as e:
+            refused.append(station)
+            print(f"Time-series store: {str(e)}")
+    return refused
+
+def stored_readings(station_id):
+    """Latest FORECAST_SEED_ROWS complete stored readings of a station, as [(reading, timestamp), ...]."""
+    if timeseries is None:
+        return []
+    rows = timeseries.latest(station_id, FORECAST_SEED_ROWS, Forecaster.PARAMS)
+    values = np.column_stack([round_float32(rows[param]) for param in Forecaster.PARAMS])
+    complete = ~np.isnan(values).any(axis=1)
+    return [
+        (dict(zip(Forecaster.PARAMS, row)), datetime.fromtimestamp(timestamp).isoformat())
+        for timestamp, row in zip(rows["timestamp"][complete].tolist(), values[complete].tolist())
+    ]
+
+seed_locks = {} # station_id -> lock held while seed_station replays it
+
+def seed_station(station_id):
+    """
+    Rebuild a station's forecasting state from its latest stored readings.
+
+    Returns:
+        True if the store had complete readings for the station.
+    """
+    # setdefault is atomic: concurrent first requests for a station seed it once
+    with seed_locks.setdefault(station_id, threading.Lock()):
+        try:
+            if station_id in stations:
+                return True
+            readings = stored_readings(station_id)
+            for reading, timestamp in readings:
+                stations.append(station_id, reading, timestamp)
+            return bool(readings)
+        finally:
+            seed_locks.pop(station_id, None)
+
+def recent_readings(station_id):
+    """
+    Warm-up readings for a forecasting method built on first query: the stored
+    readings, or else the linear window (replay sessions are not stored).
+    """
+    readings = stored_readings(station_id)
+    if readings:
+        return readings
+    window = stations.model(station_id, "linear")
+    return [(dict(zip(window.PARAMS, row)), window.last_timestamp) for row in window.window().tolist()]
+
+# Memoized /api/forecast results keyed by a fingerprint of the posted history
+forecast_memo = AsyncMemo(
+    maxsize=int(os.getenv("FORECAST_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("FORECAST_CACHE_TTL", "60")),
+    max_bytes=int(os.getenv("FORECAST_CACHE_MB", "64")) << 20
+)
 
 # Configure CORS
 app.add_middleware(
@@ -50,24 +220,136 @@ class WaterQualityInput(BaseModel):
 # Load models if available
 model = None
 le = None
+engine = None # Flat-array compilation of `model`, walked once per request
+model_version = None # (mtime_ns, size) of the artifacts `model`/`le` were loaded from
 MODEL_PATH = "disease_model.pkl"
 ENCODER_PATH = "label_encoder.pkl"
 
-if os.path.exists(MODEL_PATH) and os.path.exists(ENCODER_PATH):
+# /predict response cache. The rules and the forest only compare each input against
+# fixed thresholds, so every reading between the same thresholds of every input gets
+# the same verdict: the cache key is that set of intervals, never a rounded value.
+prediction_cache = TTLCache(
+    maxsize=int(os.getenv("PREDICT_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("PREDICT_CACHE_TTL", "300"))
+)
+predict_boundaries = {} # input -> (sorted rule thresholds, sorted forest splits, forest column or None), see load_model()
+
+def _predict_boundaries(forest):
+    bounds = {}
+    for name in WaterQualityInput.model_fields:
+        splits, column = np.zeros(0), None
+        if forest is not None and name in forest.feature_names:
+            column = forest.feature_names.index(name)
+            thresholds = forest.threshold[forest.feature == column]
+            splits = np.unique(thresholds[~np.isnan(thresholds)])
+        rules = np.array(sorted(ExpertRules.BOUNDARIES.get(name, ())), dtype=np.float64)
+        bounds[name] = (rules, splits, column)
+    return bounds
+
+def predict_cache_key(data):
+    """
+    Cache key of a /predict reading: per input, where it falls among the rule
+    thresholds and the forest's split thresholds (on a threshold or between two).
+
+    Returns:
+        Tuple key, or None if an input is NaN or infinite.
+    """
+    values = {name: getattr(data, name) for name in predict_boundaries}
+    if not all(math.isfinite(value) for value in values.values()):
+        return None
+    # What the forest compares against its splits (scaled and rounded to float32, like sklearn)
+    forest_inputs = engine.prepare([getattr(data, name) for name in engine.feature_names])[0].tolist() if engine is not None else None
+    key = []
+    for name, (rules, splits, column) in predict_boundaries.items():
+        value = values[name]
+        split_value = forest_inputs[column] if column is not None else value
+        key.append((
+            int(np.searchsorted(rules, value, "left")), int(np.searchsorted(rules, value, "right")),
+            int(np.searchsorted(splits, split_value, "left")), int(np.searchsorted(splits, split_value, "right"))
+        ))
+    return tuple(key)
+
+def _artifact_version():
     try:
-        model = joblib.load(MODEL_PATH)
-        le = joblib.load(ENCODER_PATH)
-        print("ML Model loaded successfully.")
-    except Exception as e:
-        print(f"Error loading ML model: {e}")
+        return tuple((st.st_mtime_ns, st.st_size) for st in (os.stat(MODEL_PATH), os.stat(ENCODER_PATH)))
+    except OSError:
+        return None
 
+def load_model():
+    """(Re)load the ML artifacts and drop predictions cached with the previous ones."""
+    global model, le, engine, model_version
+    model_version = _artifact_version()
+    if model_version is not None:
+        try:
+            new_model = joblib.load(MODEL_PATH)
+            new_le = joblib.load(ENCODER_PATH)
+            engine = CompiledForest.from_sklearn(new_model)
+            model, le = new_model, new_le
+            print("ML Model loaded successfully.")
+        except Exception as e:
+            print(f"Error loading ML model: {e}")
+    predict_boundaries.clear()
+    predict_boundaries.update(_predict_boundaries(engine))
+    prediction_cache.clear()
 
-@app.get("/api/live-data")
-async def get_live_data():
+def refresh_model_if_changed():
+    if _artifact_version() != model_version:
+        load_model()
+        # Process workers predict with the model they loaded at start-up
+        compute_pool.recycle()
+
+load_model()
+
+
+# Live sensor readings arriving over MQTT (water/raw[/<station>]) replace the dataset
+# replay while they are fresh. MQTT_BROKER enables the bridge; MQTT_PORT, MQTT_QUEUE_SIZE,
+# MQTT_OVERFLOW=coalesce|drop_oldest; LIVE_READING_MAX_AGE seconds a reading stays live.
+LIVE_READING_MAX_AGE = float(os.getenv("LIVE_READING_MAX_AGE", "30"))
+live_readings = {} # station (None = most recent of any) -> (received_at, live-data response)
+mqtt_bridge = None
+
+def analyze_live_readings(batch):
     """
-    Get the next real data point from the Ireland dataset.
+    Rules over a batch of (station, readings) pairs from the MQTT bridge, keeping
+    the latest result per station for /api/live-data and /api/live-stream.
     """
-    data = streamer.get_next()
+    fields = ("temperature", "ph", "dissolved_oxygen", "turbidity", "ammonia")
+    # Channels a frame lacks are NaN, which the rules skip
+    columns = {name: [readings.get(name, math.nan) for _, readings in batch] for name in fields}
+    analyses = ExpertRules.evaluate_batch(**columns)
+    received_at = time.monotonic()
+    for (station, readings), analysis in zip(batch, analyses):
+        # Forecasting needs every parameter; STM32 frames without DO= are analyzed but not forecast
+        if all(param in readings for param in Forecaster.PARAMS):
+            stations.append(station, readings)
+        entry = (received_at, {
+            "sensor_data": {name: readings.get(name) for name in DatasetStreamer.CHANNELS},
+            "analysis": analysis,
+            "source": "mqtt",
+            "station": station
+        })
+        live_readings[station] = entry
+        live_readings[None] = entry
+    if timeseries is not None:
+        store_readings(batch)
+
+def known_station(station):
+    return station is None or station in live_readings or station in streamer.stations
+
+def read_live_data(station=None, session=None):
+    live = live_readings.get(station)
+    if live is not None:
+        age = time.monotonic() - live[0]
+        if age <= LIVE_READING_MAX_AGE:
+            return live[1]
+        if station is not None and station not in streamer.stations:
+            # MQTT-only station with no dataset to fall back to: its last reading, marked as stale
+            return {**live[1], "stale": True, "age_seconds": round(age, 1)}
+
+    if station is None and session is None:
+        data = streamer.get_next()
+    else:
+        data = streamer.cursor(session, station).get_next()
     
     # Run analysis on this real data
     input_data = WaterQualityInput(
@@ -80,50 +362,124 @@ async def get_live_data():
     
     # Get predictions/logic
     analysis = ExpertRules.evaluate(input_data)
+    stations.append(replay_station_id(station, session), data)
     
     # Merge raw data with analysis
     return {
         "sensor_data": data,
-        "analysis": analysis
+        "analysis": analysis,
+        "source": "replay"
     }
 
-@app.post("/predict")
-async def predict_disease_risk(data: WaterQualityInput):
+def replay_station_id(station=None, session=None):
+    """Forecasting-state id for a replay stream, so sessions never share a history."""
+    station_id = station or LIVE_STATION_ID
+    return f"{station_id}@{session}" if session else station_id
+
+@app.get("/api/live-data")
+async def get_live_data(response: Response, station: str | None = None, session: str | None = None):
     """
-    Predict disease occurrence based on water quality parameters using Hybrid approach (Rules + ML).
+    Get the latest live sensor reading (MQTT), or else the next real data point
+    from the Ireland dataset.
+
+    With `station` (an MQTT station id or a WaterbodyName), reads that station; a
+    waterbody without live data replays its readings in date order.
+    With `session`, the caller gets its own replay cursor instead of the shared one.
     """
+    if not known_station(station):
+        return {"error": f"Unknown station: {station}"}
     try:
-        # 1. Expert Rules Analysis (Deterministic Baseline)
-        analysis = ExpertRules.evaluate(data)
-        
-        # 2. ML Disease Prediction (Specific Diagnosis)
-        disease_pred = "Analysis Pending"
-        confidence = 100.0 # Default for rules
-        
-        if model and le:
-            # Prepare input for ML
-            # Feature order must match training
-            input_df = pd.DataFrame([{
-               'ph': data.ph,
-               'dissolved_oxygen': data.dissolved_oxygen,
-               'temperature': data.temperature,
-               'turbidity': data.turbidity
-            }])
-            
-            # Predict
-            pred_idx = model.predict(input_df)[0]
-            disease_pred = le.inverse_transform([pred_idx])[0]
-            
-            # Get probability/confidence
-            probs = model.predict_proba(input_df)
-            confidence = float(max(probs[0]) * 100)
+        # Cursors live in this process, so it must not go to a process pool
+        return await compute_pool.run(read_live_data, station, session, stateful=True)
+    except ExecutorBusy as e:
+        # Dashboards poll this endpoint; tell them to back off rather than report a fault
+        return busy_response(response, "Live data", e)
+
+# One broadcaster per replayed station (None = the shared dataset replay).
+# LIVE_STREAM_INTERVAL seconds between ticks, LIVE_STREAM_BUFFER frames kept per slow client.
+live_streams = {}
+
+def live_broadcaster(station=None):
+    broadcaster = live_streams.get(station)
+    if broadcaster is None:
+        broadcaster = LiveBroadcaster(
+            lambda: compute_pool.run(read_live_data, station, None, stateful=True),
+            interval=float(os.getenv("LIVE_STREAM_INTERVAL", "5")),
+            buffer=int(os.getenv("LIVE_STREAM_BUFFER", "1"))
+        )
+        live_streams[station] = broadcaster
+    return broadcaster
+
+@app.get("/api/live-stream")
+async def live_stream(station: str | None = None):
+    """
+    Server-Sent Events push of the live data.
+
+    One server-side tick reads and analyzes each data point once and pushes the same
+    `{sensor_data, analysis}` frame to every subscriber. Clients that fall behind
+    skip stale frames rather than queueing them.
+    """
+    if not known_station(station):
+        return {"error": f"Unknown station: {station}"}
+    return StreamingResponse(
+        live_broadcaster(station).stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/stream-stats")
+async def get_stream_stats():
+    """
+    Subscriber, tick and dropped-frame counters per live stream.
+    """
+    return {station or LIVE_STATION_ID: broadcaster.stats() for station, broadcaster in live_streams.items()}
+
+@app.get("/api/replay/stations")
+async def get_replay_stations():
+    """
+    Waterbodies available for per-station replay, with their number of readings.
+    """
+    return {
+        "stations": [
+            {"name": name, "readings": int(streamer.offsets[k + 1] - streamer.offsets[k])}
+            for k, name in enumerate(streamer.stations)
+        ]
+    }
+
+def run_predictions(rows):
+    """
+    Hybrid (Rules + ML) pipeline over a list of WaterQualityInput rows.
+    The rules and the ML model each run once for the whole list; results keep input order.
+    """
+    columns = {
+        "temperature": [r.temperature for r in rows],
+        "ph": [r.ph for r in rows],
+        "dissolved_oxygen": [r.dissolved_oxygen for r in rows],
+        "turbidity": [r.turbidity for r in rows],
+        "ammonia": [r.ammonia for r in rows],
+    }
+
+    # 1. Expert Rules Analysis (Deterministic Baseline)
+    analyses = ExpertRules.evaluate_batch(**columns)
+
+    # 2. ML Disease Prediction (Specific Diagnosis)
+    disease_preds = ["Analysis Pending"] * len(rows)
+    confidences = [100.0] * len(rows) # Default for rules
+
+    if engine and le:
+        # Predict class and probability/confidence in one pass (engine orders columns as in training)
+        pred_idx, probs = engine.predict(engine.matrix_from(columns))
+        disease_preds = le.inverse_transform(pred_idx).tolist()
+        confidences = (probs.max(axis=1) * 100).tolist()
 
+    results = []
+    for data, analysis, disease_pred, confidence in zip(rows, analyses, disease_preds, confidences):
         # 3. Combine Results
         # If rules say "Optimal", override ML noise unless confidence is very high
         if analysis["risk_status"] == "Optimal" and disease_pred != "Healthy" and confidence < 80:
              disease_pred = "Healthy"
-        
-        return {
+
+        results.append({
             "disease_name": disease_pred, 
             "disease_level": 2 if analysis["risk_status"] == "Risk" else (1 if analysis["risk_status"] == "Warning" else 0),
             "risk_status": analysis["risk_status"].upper(),
@@ -140,33 +496,252 @@ async def predict_disease_risk(data: WaterQualityInput):
                 "dissolved_oxygen": data.dissolved_oxygen,
                 "turbidity": data.turbidity
             }
+        })
+    return results
+
+@app.post("/predict")
+async def predict_disease_risk(data: WaterQualityInput, response: Response):
+    """
+    Predict disease occurrence based on water quality parameters using Hybrid approach (Rules + ML).
+    """
+    try:
+        refresh_model_if_changed()
+
+        key = predict_cache_key(data)
+        if key is None:
+            return {"error": "Prediction failed: readings must be finite numbers"}
+        result = prediction_cache.get(key)
+        if result is None:
+            result = (await compute_pool.run(run_predictions, [data]))[0]
+            prediction_cache.set(key, result)
+
+        # A cached verdict may come from another reading in the same intervals: the text
+        # quoting the values (suggested changes, issue descriptions) is built for this one
+        suggestions, suggestions_map = ExpertRules.generate_suggestions(data)
+        return {
+            **result,
+            "suggestions": suggestions,
+            "suggestions_map": suggestions_map,
+            "detailed_solutions": ExpertRules.get_detailed_solutions(data),
+            "input_values": {
+                "temperature": data.temperature,
+                "ph": data.ph,
+                "dissolved_oxygen": data.dissolved_oxygen,
+                "turbidity": data.turbidity
+            }
         }
-        
+    except ExecutorBusy as e:
+        return busy_response(response, "Prediction", e)
     except Exception as e:
         return {"error": f"Prediction failed: {str(e)}"}
 
+class BatchPredictRequest(BaseModel):
+    readings: list # List of WaterQualityInput-shaped dicts, validated per row
+
+def predict_batch(readings):
+    """
+    Validate and predict a list of raw readings, returning the serialized JSON body.
+    Runs entirely on the compute executor so validation and encoding of large
+    batches stay off the event loop too.
+    """
+    results = [None] * len(readings)
+    valid_rows, valid_slots = [], []
+    for i, reading in enumerate(readings):
+        try:
+            valid_rows.append(WaterQualityInput.model_validate(reading))
+            valid_slots.append(i)
+        except Exception as e:
+            results[i] = {"index": i, "error": f"Invalid reading: {str(e)}"}
+
+    if valid_rows:
+        try:
+            for i, result in zip(valid_slots, run_predictions(valid_rows)):
+                results[i] = {"index": i, **result}
+        except Exception as e:
+            for i in valid_slots:
+                results[i] = {"index": i, "error": f"Prediction failed: {str(e)}"}
+
+    return json.dumps({
+        "count": len(results),
+        "errors": sum(1 for r in results if "error" in r),
+        "results": results
+    })
+
+@app.post("/predict/batch")
+async def predict_disease_risk_batch(request: BatchPredictRequest, response: Response):
+    """
+    Predict many readings in one call. Invalid rows get an "error" entry in their
+    slot instead of failing the whole batch.
+    """
+    try:
+        body = await compute_pool.run(predict_batch, request.readings)
+    except ExecutorBusy as e:
+        return busy_response(response, "Prediction", e)
+    return Response(content=body, media_type="application/json")
+
 class ForecastRequest(BaseModel):
-    history: list # List of sensor data dicts
+    history: list = [] # List of sensor data dicts
     timeframe: str = "5m" # Default to 5 minutes
+    station_id: str | None = None # Use the server-side history instead of `history`
+    points: int = 60 # Projection samples per parameter in the compact response
+    full: bool = False # Opt in to one projected value per 5s step (17,280 per parameter for 24h)
+    method: str = "linear" # One of FORECAST_METHODS
+
+class StationReading(WaterQualityInput):
+    timestamp: str | None = None
+
+def forecast_history(history, timeframe, points, full, method):
+    """Forecast from a client-supplied history with the given method."""
+    if method == "linear":
+        if not full:
+            return Forecaster.compact_trends(history, timeframe, points)
+        start_time, projections, insights = Forecaster.predict_trends(history, timeframe)
+        return {"start_time": start_time, "projections": projections, "insights": insights}
+
+    # Other methods replay the history through a fresh model
+    model = FORECAST_METHODS[method]()
+    for reading in history:
+        model.append(reading)
+    if full:
+        start_time, projections, insights = model.forecast(timeframe)
+        return {"start_time": start_time, "projections": projections, "insights": insights}
+    return model.compact_forecast(timeframe, points)
+
+def history_fingerprint(history):
+    """Cheap content hash of a forecast history list."""
+    return hashlib.blake2b(json.dumps(history, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
 
 @app.post("/api/forecast")
-def get_forecast(request: ForecastRequest):
-    from logic import Forecaster
-    start_time, projections, insights = Forecaster.predict_trends(request.history, request.timeframe)
+async def get_forecast(request: ForecastRequest, response: Response):
+    """
+    Trend forecast. By default the response is compact: fitted coefficients,
+    `points` projection samples (at `projection_steps`) and threshold-crossing
+    times. Set `full` for the per-step projection lists.
+
+    Results for a given (history, timeframe, points, full, method) are memoized,
+    and identical requests arriving together share one computation.
+    """
+    if request.method not in FORECAST_METHODS:
+        return {"error": f"Unknown forecast method: {request.method}"}
+    try:
+        if request.station_id is not None and not request.history:
+            return await forecast_station(request.station_id, response, request.timeframe, request.points,
+                                          request.full, request.method)
+
+        args = (request.history, request.timeframe, request.points, request.full, request.method)
+        key = (history_fingerprint(request.history),) + args[1:]
+        return await forecast_memo.get_or_compute(key, lambda: compute_pool.run(forecast_history, *args))
+    except ExecutorBusy as e:
+        return busy_response(response, "Forecast", e)
+    except ValueError as e:
+        return {"error": f"Forecast failed: {str(e)}"}
+
+@app.post("/api/stations/{station_id}/readings")
+async def add_station_reading(station_id: str, reading: StationReading, response: Response):
+    """
+    Append a reading to a station's rolling history (O(1); updates the trend fit).
+    """
+    if not STATION_ID_PATTERN.fullmatch(station_id):
+        return {"error": "Invalid station id: use 1-64 letters, digits, '_', '.', ':' or '-'"}
+    data = reading.model_dump()
+    try:
+        stations.append(station_id, data, reading.timestamp)
+    except ValueError as e:
+        return {"error": f"Invalid reading: {str(e)}"}
+    if timeseries is not None:
+        try:
+            timestamp = datetime.fromisoformat(reading.timestamp).timestamp() if reading.timestamp else None
+        except ValueError:
+            timestamp = None
+        try:
+            refused = await compute_pool.run(store_readings, [(station_id, data)], timestamp, stateful=True)
+        except ExecutorBusy as e:
+            return busy_response(response, "Storing the reading", e)
+        if refused:
+            return {"error": f"Storing the reading failed: station limit ({TIMESERIES_MAX_STATIONS}) reached"}
+    return {"station_id": station_id, "history_length": len(stations.model(station_id))}
+
+@app.get("/api/stations/{station_id}/history")
+async def get_station_history(station_id: str, response: Response, start: float | None = None,
+                              end: float | None = None, channels: str | None = None, max_points: int = 1000):
+    """
+    Stored readings of a station with start <= timestamp < end (epoch seconds).
+
+    `channels` is a comma-separated subset; when the range holds more than
+    `max_points` rows, every k-th row is returned so charts stay light.
+    """
+    if timeseries is None:
+        return {"error": "Time-series store is disabled"}
+    names = tuple(channels.split(",")) if channels else timeseries.channels
+    unknown = [name for name in names if name not in timeseries.channels]
+    if unknown:
+        return {"error": f"Unknown channels: {', '.join(unknown)}"}
+
+    def read():
+        rows = timeseries.query(station_id, start, end, names)
+        count = len(rows["timestamp"])
+        step = max(1, math.ceil(count / max_points)) if max_points > 0 else 1
+        # NaN (channel not reported) becomes null
+        series = {
+            name: [v if v == v else None for v in round_float32(rows[name][::step]).tolist()]
+            for name in names
+        }
+        return {"station_id": station_id, "count": count, "step": step,
+                "timestamp": rows["timestamp"][::step].tolist(), **series}
+
+    try:
+        return await compute_pool.run(read, stateful=True)
+    except ExecutorBusy as e:
+        return busy_response(response, "History query", e)
+
+@app.get("/api/stations/{station_id}/forecast")
+async def forecast_station(station_id: str, response: Response, timeframe: str = "5m", points: int = 60,
+                           full: bool = False, method: str = "linear"):
+    """
+    Forecast from the server-side state of a station, without shipping the history.
+    """
+    if method not in FORECAST_METHODS:
+        return {"error": f"Unknown forecast method: {method}"}
+    try:
+        if station_id not in stations and not await compute_pool.run(seed_station, station_id, stateful=True):
+            return {"error": f"Unknown station: {station_id}"}
+        # The first query of a method builds and warms up its model
+        model = await compute_pool.run(stations.model, station_id, method, stateful=True)
+        if not full:
+            result = await compute_pool.run(model.compact_forecast, timeframe, points, stateful=True)
+            return {"station_id": station_id, "method": method, **result}
+        start_time, projections, insights = await compute_pool.run(model.forecast, timeframe, stateful=True)
+    except ExecutorBusy as e:
+        return busy_response(response, "Forecast", e)
     return {
+        "station_id": station_id,
+        "method": method,
         "start_time": start_time,
         "projections": projections,
         "insights": insights
     }
 
+def summarize_weather(current_weather, aqi):
+    """Dashboard fields of an OpenWeather current-weather response."""
+    return {
+        "temp": current_weather['main']['temp'] if current_weather else None,
+        "humidity": current_weather['main']['humidity'] if current_weather else None,
+        "pressure": current_weather['main']['pressure'] if current_weather else None,
+        "wind_speed": current_weather['wind']['speed'] if current_weather else None,
+        "aqi": aqi,
+        "access":  "Connected" if current_weather else "Failed (Check API Key)",
+        "description": current_weather['weather'][0]['description'] if current_weather else "N/A",
+        "icon": current_weather['weather'][0]['icon'] if current_weather else None
+    }
+
 @app.get("/api/weather-impact")
 async def get_weather_impact(abnormal: bool = False):
     """
     Get real-time weather data and its impact on water quality.
     """
     try:
-        current_weather = await weather_service.get_current_weather(abnormal=abnormal)
-        forecast = await weather_service.get_forecast() # Forecast mocking handled inside service if needed
+        # Forecast mocking handled inside service if needed
+        current_weather, forecast = await weather_service.get_weather_and_forecast(abnormal=abnormal)
         
         impact_analysis = weather_service.analyze_impact(current_weather, forecast)
         
@@ -174,22 +749,86 @@ async def get_weather_impact(abnormal: bool = False):
         aqi = weather_service._get_mock_aqi(abnormal=abnormal)
         
         return {
-            "weather": {
-                "temp": current_weather['main']['temp'] if current_weather else None,
-                "humidity": current_weather['main']['humidity'] if current_weather else None,
-                "pressure": current_weather['main']['pressure'] if current_weather else None,
-                "wind_speed": current_weather['wind']['speed'] if current_weather else None,
-                "aqi": aqi,
-                "access":  "Connected" if current_weather else "Failed (Check API Key)",
-                "description": current_weather['weather'][0]['description'] if current_weather else "N/A",
-                "icon": current_weather['weather'][0]['icon'] if current_weather else None
-            },
+            "weather": summarize_weather(current_weather, aqi),
             "impact_analysis": impact_analysis,
             "digital_twin_location": "Burrishoole Catchment, Ireland"
         }
     except Exception as e:
         return {"error": f"Weather analysis failed: {str(e)}"}
 
+class WeatherSite(BaseModel):
+    site: str
+    lat: float
+    lon: float
+
+class WeatherSitesRequest(BaseModel):
+    sites: list[WeatherSite]
+    concurrency: int | None = None # Sites fetched at once (default WEATHER_SITE_CONCURRENCY)
+
+@app.post("/api/weather-impact/sites")
+async def get_weather_impact_sites(request: WeatherSitesRequest):
+    """
+    Weather and impact analysis for many farm sites in one call.
+    Sites are refreshed concurrently (bounded) through the shared weather cache.
+    """
+    try:
+        results = await weather_service.analyze_sites([site.model_dump() for site in request.sites], request.concurrency)
+        aqi = weather_service._get_mock_aqi()
+        return {
+            "count": len(results),
+            "sites": [
+                {
+                    "site": result["site"],
+                    "lat": result["lat"],
+                    "lon": result["lon"],
+                    "weather": summarize_weather(result["weather"], aqi),
+                    "impact_analysis": result["impact_analysis"]
+                }
+                for result in results
+            ]
+        }
+    except Exception as e:
+        return {"error": f"Weather analysis failed: {str(e)}"}
+
+@app.get("/api/cache-stats")
+async def get_cache_stats():
+    """
+    Hit/miss/eviction counters for the caches (weather: upstream fetches and coalesced callers;
+    diagnosis: memory and SQLite tiers with lookup latency).
+    """
+    return {
+        "predict": prediction_cache.stats(),
+        "forecast": forecast_memo.stats(),
+        "weather": {**weather_service.cache.stats(), "failures": weather_service.failures.stats()},
+        # Counts the SQLite rows: off the event loop like the other disk-tier calls
+        "diagnosis": await asyncio.to_thread(cv_service.cache.stats)
+    }
+
+@app.get("/api/mqtt-stats")
+async def get_mqtt_stats():
+    """
+    MQTT bridge connection, queue depth, overflow and lag counters.
+    """
+    if mqtt_bridge is None:
+        return {"enabled": False}
+    return {"enabled": True, **mqtt_bridge.stats()}
+
+@app.get("/api/timeseries-stats")
+async def get_timeseries_stats():
+    """
+    Stations, segments and rows held by the time-series store.
+    """
+    if timeseries is None:
+        return {"enabled": False}
+    return {"enabled": True, **timeseries.stats()}
+
+@app.get("/api/executor-stats")
+async def get_executor_stats():
+    """
+    Queue depth and throughput counters for the compute executor.
+    """
+    return compute_pool.stats()
+
 @app.get("/")
 async def root():
     mode = "Hybrid (Rules + ML)" if model else "Action-Based Expert Rules"
@@ -267,3 +906,10 @@ async def diagnose_fish(file: UploadFile = File(...)):
     except Exception as e:
         print(f"Error in diagnose endpoint: {e}")
         return {"error": f"Upload failed: {str(e)}"}
+
+@app.get("/api/diagnose-stats")
+async def get_diagnose_stats():
+    """
+    Upload preprocessing (bytes in/out, time spent) and diagnosis cache counters.
+    """
+    return await asyncio.to_thread(cv_service.stats)
@@ -0,0 +1,266 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+from sensor_frames import TOPIC_RAW, DEFAULT_STATION, parse_frame
+
+class ReadingQueue:
+    """
+    Bounded asyncio queue of live sensor readings with an explicit overflow policy.
+
+    "drop_oldest": FIFO; when full, the oldest pending reading is discarded.
+    "coalesce": at most one pending reading per station; a newer reading replaces
+        the pending one and keeps its place in line. When full of distinct
+        stations, the oldest station's reading is discarded.
+
+    Readings are timestamped on entry so queue lag (enqueue -> dequeue) can be reported.
+    Not thread-safe: put() and get_batch() run on the event loop.
+    """
+
+    POLICIES = ("drop_oldest", "coalesce")
+
+    def __init__(self, maxsize=1000, policy="drop_oldest"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = OrderedDict() # key -> (enqueued_at, station, reading)
+        self._seq = 0
+        self._ready = asyncio.Event()
+        self._lags = deque(maxlen=1000) # seconds, most recent dequeues
+        self.enqueued = 0
+        self.dequeued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, station, reading):
+        self.enqueued += 1
+        if self.policy == "coalesce" and station in self._items:
+            enqueued_at, _, _ = self._items[station]
+            self._items[station] = (enqueued_at, station, reading)
+            self.coalesced += 1
+            return
+        if len(self._items) >= self.maxsize:
+            self._items.popitem(last=False)
+            self.dropped += 1
+        if self.policy == "coalesce":
+            key = station
+        else:
+            key = self._seq
+            self._seq += 1
+        self._items[key] = (time.monotonic(), station, reading)
+        self.max_depth = max(self.max_depth, len(self._items))
+        self._ready.set()
+
+    async def get_batch(self, max_items=256):
+        """Wait for at least one reading, then take up to `max_items` as (station, reading) pairs, oldest first."""
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        now = time.monotonic()
+        batch = []
+        while self._items and len(batch) < max_items:
+            _, (enqueued_at, station, reading) = self._items.popitem(last=False)
+            self._lags.append(now - enqueued_at)
+            batch.append((station, reading))
+        self.dequeued += len(batch)
+        return batch
+
+    def stats(self):
+        lags = np.array(self._lags) * 1e3 if self._lags else np.zeros(1)
+        oldest = next(iter(self._items.values()))[0] if self._items else None
+        return {
+            "policy": self.policy,
+            "depth": len(self._items),
+            "maxsize": self.maxsize,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "dequeued": self.dequeued,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "lag_ms_p50": round(float(np.percentile(lags, 50)), 3),
+            "lag_ms_p99": round(float(np.percentile(lags, 99)), 3),
+            "oldest_pending_ms": round((time.monotonic() - oldest) * 1e3, 3) if oldest is not None else 0.0
+        }
+
+class MQTTBridge:
+    """
+    Asyncio-native MQTT subscriber for the API process.
+
+    paho's socket is driven from the event loop (add_reader/add_writer), so no
+    network thread is started and message callbacks run on the loop. Only
+    connect()/reconnect(), which may block on DNS and the TCP handshake, run in a
+    worker thread. Parsed readings go into a ReadingQueue; a consumer task hands
+    them in batches to `handle_batch`, and reconnects are retried in the background.
+    """
+
+    def __init__(self, handle_batch, host="localhost", port=1883, queue=None, batch_size=256,
+                 topics=(TOPIC_RAW, TOPIC_RAW + "/#")):
+        """
+        Args:
+            handle_batch: Async callable taking a list of (station, readings) pairs.
+            host, port: Broker address.
+            queue: ReadingQueue between the socket and the analysis (default: 1000, drop_oldest).
+            batch_size: Maximum readings passed to one handle_batch call.
+            topics: Topic filters to subscribe to.
+        """
+        self.handle_batch = handle_batch
+        self.host = host
+        self.port = port
+        self.queue = queue if queue is not None else ReadingQueue()
+        self.batch_size = batch_size
+        self.topics = topics
+        self.client = None
+        self.connected = False
+        self.received = 0
+        self.malformed = 0
+        self.handler_errors = 0
+        self._loop = None
+        self._loop_thread = None
+        self._tasks = set()
+        self._misc = None
+        self._stopping = False
+
+    # ---------------------------
+    # Lifecycle
+    # ---------------------------
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        self._spawn(self._consume())
+        self._spawn(self._connect())
+        return self
+
+    async def stop(self):
+        self._stopping = True
+        if self.client is not None and self.connected:
+            self.client.disconnect()
+        tasks = [task for task in (*self._tasks, self._misc) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, coro):
+        # Finished tasks drop out of the set, so a flapping broker does not grow it
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _connect(self, delay=0.0):
+        # Retry with capped exponential backoff until connected (or stopped)
+        while not self._stopping:
+            await asyncio.sleep(delay)
+            try:
+                if self.client.is_connected() or self.connected:
+                    return
+                # DNS lookup and TCP connect block: keep them off the event loop
+                if delay == 0.0:
+                    await asyncio.to_thread(self.client.connect, self.host, self.port, 60)
+                else:
+                    await asyncio.to_thread(self.client.reconnect)
+                return
+            except OSError as e:
+                print(f"MQTT connect to {self.host}:{self.port} failed: {e}")
+                delay = min(max(delay * 2, 1.0), 30.0)
+
+    # ---------------------------
+    # paho callbacks (on the event loop, except the socket hooks called from connect()/reconnect())
+    # ---------------------------
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        self.connected = not reason_code.is_failure
+        if self.connected:
+            client.subscribe([(topic, 0) for topic in self.topics])
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        self.connected = False
+        if not self._stopping:
+            self._spawn(self._connect(delay=1.0))
+
+    def _on_message(self, client, userdata, msg):
+        self.submit(msg.topic, msg.payload)
+
+    def _on_loop(self, fn, *args):
+        # Socket hooks also fire in the connect thread; the loop's selector is only touched from the loop.
+        # Hooks queued from that thread run in order, before anything the loop reads from the new socket.
+        if threading.get_ident() == self._loop_thread:
+            fn(*args)
+        else:
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._on_loop(self._open_socket, client, sock)
+
+    def _open_socket(self, client, sock):
+        self._loop.add_reader(sock, client.loop_read)
+        self._misc = self._loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        # paho closes the socket right after this hook: unregister by descriptor
+        self._on_loop(self._close_socket, sock.fileno())
+
+    def _close_socket(self, fd):
+        self._loop.remove_reader(fd)
+        self._loop.remove_writer(fd)
+        if self._misc is not None:
+            self._misc.cancel()
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self._loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self._loop.remove_writer, sock.fileno())
+
+    async def _misc_loop(self):
+        # Keepalive pings and retries
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    # ---------------------------
+    # Readings
+    # ---------------------------
+    def submit(self, topic, payload):
+        """Parse one frame and enqueue it (the overflow policy applies here)."""
+        self.received += 1
+        readings, station = parse_frame(payload)
+        if readings is None:
+            self.malformed += 1
+            return
+        if station is None:
+            prefix = TOPIC_RAW + "/"
+            station = topic[len(prefix):] if topic.startswith(prefix) else DEFAULT_STATION
+        self.queue.put(station, readings)
+
+    async def _consume(self):
+        while True:
+            batch = await self.queue.get_batch(self.batch_size)
+            try:
+                await self.handle_batch(batch)
+            except Exception as e:
+                self.handler_errors += 1
+                print(f"MQTT analysis failed: {e}")
+
+    def stats(self):
+        return {
+            "broker": f"{self.host}:{self.port}",
+            "connected": self.connected,
+            "received": self.received,
+            "malformed": self.malformed,
+            "handler_errors": self.handler_errors,
+            "queue": self.queue.stats()
+        }
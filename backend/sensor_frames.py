@@ -0,0 +1,279 @@
+"""
+Sensor frame codec shared by the MQTT ingest service, the gateway and the API.
+
+Two wire formats are accepted, told apart by the first byte:
+
+Text (legacy), as written by Sensors_FormatPayload:
+    "PH=7.20,TUR=12.00,SAL=15.00,NH3=0.02,T=28.5"
+
+Binary, 19 bytes little-endian (FRAME_DTYPE):
+    version     u8   FRAME_VERSION (0x81; the high bit never starts a text frame)
+    station     u16  node id, reported as station "node-<id>"
+    seq         u16  per-node sequence number (wraps)
+    ph          i16  x100
+    turbidity   u16  x10    (0.1 NTU, up to 6553.4)
+    salinity    u16  x100
+    ammonia     u16  x1000  (finer than the text format's 0.01 mg/L)
+    temperature i16  x100
+    dissolved_oxygen u16 x100
+    crc         u16  CRC-16/CCITT-FALSE of the preceding 17 bytes
+A channel the node does not measure carries the type's extreme value
+(-32768 / 65535) and decodes to NaN. Replayed frames may carry a trailer after
+the CRC with the gateway's receive time (see stamp_frame).
+"""
+import math
+import re
+import struct
+from binascii import crc_hqx
+
+import numpy as np
+
+TOPIC_RAW = "water/raw"
+TOPIC_ROLLUP = "water/rollup"
+
+# Sensors_FormatPayload keys -> reading fields. DO= and ID=<station> are accepted
+# for nodes that send them; channels a frame lacks are NaN, which the rules skip.
+FIELDS = {
+    b"PH": "ph",
+    b"TUR": "turbidity",
+    b"SAL": "salinity",
+    b"NH3": "ammonia",
+    b"T": "temperature",
+    b"DO": "dissolved_oxygen",
+}
+CHANNELS = tuple(FIELDS.values())
+DEFAULT_STATION = "stm32"
+
+# Exact Sensors_FormatPayload layout: matched with one regex and converted in bulk
+CANONICAL = re.compile(rb"PH=([^,]*),TUR=([^,]*),SAL=([^,]*),NH3=([^,]*),T=([^,]*)\Z")
+CANONICAL_CHANNELS = [CHANNELS.index(name) for name in ("ph", "turbidity", "salinity", "ammonia", "temperature")]
+
+FRAME_VERSION = 0x81
+FRAME_DTYPE = np.dtype([
+    ("version", "u1"), ("station", "<u2"), ("seq", "<u2"),
+    ("ph", "<i2"), ("turbidity", "<u2"), ("salinity", "<u2"),
+    ("ammonia", "<u2"), ("temperature", "<i2"), ("dissolved_oxygen", "<u2"),
+    ("crc", "<u2"),
+])
+FRAME_SIZE = FRAME_DTYPE.itemsize
+FRAME_BODY = struct.Struct("<BHHhHHHhH") # everything the CRC covers
+FRAME_STAMP = struct.Struct("<d") # optional receive-time trailer
+SCALES = {"ph": 100, "turbidity": 10, "salinity": 100, "ammonia": 1000, "temperature": 100, "dissolved_oxygen": 100}
+# channel -> (lowest, highest, missing) raw value
+LIMITS = {
+    name: (-32767, 32767, -32768) if FRAME_DTYPE[name].kind == "i" else (0, 65534, 65535)
+    for name in CHANNELS
+}
+_VERSION_BYTE = bytes([FRAME_VERSION])
+_ENCODING = [(name, SCALES[name]) + LIMITS[name] for name in CHANNELS]
+
+def station_name(station_id):
+    return f"node-{station_id}"
+
+def crc16(data):
+    return crc_hqx(data, 0xFFFF)
+
+def encode_frame(readings, station=0, seq=0):
+    """
+    Pack one reading into a binary frame.
+
+    Args:
+        readings: Channel -> value; absent or NaN channels are sent as missing.
+            Values outside a channel's range are clamped.
+        station: Node id (0-65535).
+        seq: Sequence number, taken modulo 65536.
+
+    Returns:
+        FRAME_SIZE bytes.
+    """
+    raw = []
+    for name, scale, lowest, highest, missing in _ENCODING:
+        value = readings.get(name)
+        if value is None or value != value:
+            raw.append(missing)
+        else:
+            raw.append(min(max(round(value * scale), lowest), highest))
+    body = FRAME_BODY.pack(FRAME_VERSION, station, seq & 0xFFFF, *raw)
+    return body + crc16(body).to_bytes(2, "little")
+
+def is_binary(payload):
+    return payload[:1] == _VERSION_BYTE
+
+def decode_frame(payload):
+    """
+    Unpack one binary frame.
+
+    Returns:
+        (readings, station, seq): channel -> float for the channels present,
+        "node-<id>" and the sequence number. (None, None, None) if the frame has
+        the wrong size, version or CRC.
+    """
+    if len(payload) not in (FRAME_SIZE, FRAME_SIZE + FRAME_STAMP.size) or payload[0] != FRAME_VERSION:
+        return None, None, None
+    body = payload[:FRAME_BODY.size]
+    if crc16(body) != int.from_bytes(payload[FRAME_BODY.size:FRAME_SIZE], "little"):
+        return None, None, None
+    _, station, seq, *raw = FRAME_BODY.unpack(body)
+    readings = {
+        name: value / SCALES[name] for name, value in zip(CHANNELS, raw) if value != LIMITS[name][2]
+    }
+    return readings, station_name(station), seq
+
+def decode_batch(buffer, verify=True):
+    """
+    Decode concatenated binary frames in one pass.
+
+    Args:
+        buffer: bytes-like holding n * FRAME_SIZE bytes, e.g. b"".join(payloads)
+            or a slice of a spool segment. It is viewed in place, not copied.
+        verify: Check version and CRC of every frame.
+
+    Returns:
+        (records, columns, valid): the FRAME_DTYPE structured view of the
+        buffer, CHANNELS -> float64 arrays (NaN where missing) and a bool mask
+        of frames that passed verification.
+    """
+    records = np.frombuffer(buffer, dtype=FRAME_DTYPE)
+    columns = {}
+    for name in CHANNELS:
+        raw = records[name]
+        values = raw / SCALES[name]
+        values[raw == LIMITS[name][2]] = np.nan
+        columns[name] = values
+    valid = np.ones(len(records), dtype=bool)
+    if verify and len(records):
+        view = memoryview(buffer).cast("B")
+        body = FRAME_BODY.size
+        crcs = np.fromiter(
+            (crc16(view[i:i + body]) for i in range(0, len(records) * FRAME_SIZE, FRAME_SIZE)),
+            dtype=np.uint16, count=len(records)
+        )
+        valid = (records["version"] == FRAME_VERSION) & (crcs == records["crc"])
+    return records, columns, valid
+
+def stamp_frame(payload, received_at):
+    """
+    Attach the gateway's receive time to a frame that is published late (replayed from the spool).
+
+    Text frames get ",TS=<epoch>"; binary frames get an 8-byte float64 trailer after the CRC.
+    """
+    if is_binary(payload):
+        return payload[:FRAME_SIZE] + FRAME_STAMP.pack(received_at)
+    return payload + b",TS=%.3f" % received_at
+
+def parse_frame(payload):
+    """
+    Parse one sensor frame, binary or text.
+
+    Args:
+        payload: bytes or str, e.g. b"PH=7.20,TUR=12.00,SAL=15.00,NH3=0.02,T=28.5".
+
+    Returns:
+        (readings, station): field -> float for the keys present, and the
+        station ("node-<id>" for binary frames, the ID= value or None for text).
+        Returns (None, None) for malformed frames, including text values such
+        as "nan" or "inf" that float() accepts but no sensor reports.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if is_binary(payload):
+        readings, station, _ = decode_frame(payload)
+        return readings, station
+    readings = {}
+    station = None
+    try:
+        for part in payload.split(b","):
+            key, value = part.split(b"=", 1)
+            key = key.strip().upper()
+            if key == b"ID":
+                station = value.strip().decode()
+            elif key in FIELDS:
+                readings[FIELDS[key]] = float(value)
+                if not math.isfinite(readings[FIELDS[key]]):
+                    raise ValueError(f"non-finite {key.decode()}")
+    except (ValueError, UnicodeDecodeError):
+        return None, None
+    if not readings:
+        return None, None
+    return readings, station
+
+def parse_batch(messages, return_index=False):
+    """
+    Parse a list of (topic, payload) messages into columns.
+
+    Binary frames are decoded together with decode_batch. Text frames in the
+    exact Sensors_FormatPayload layout take a fast path (one regex match each,
+    one bulk float conversion per batch); anything else goes through parse_frame.
+
+    Returns:
+        (columns, stations, malformed): CHANNELS -> float64 arrays (NaN where a
+        frame lacks the channel), the station of each parsed frame (node-<id>
+        for binary frames; ID=, else the topic suffix after water/raw/, else
+        DEFAULT_STATION for text) and the number of frames that could not be parsed.
+        With return_index, also an int array giving each parsed frame's position in `messages`.
+    """
+    rows = np.full((len(messages), len(CHANNELS)), np.nan)
+    stations = []
+    fast_rows, fast_values = [], []
+    binary_rows, binary_payloads = [], []
+    source = []
+    prefix = TOPIC_RAW + "/"
+    n = 0
+    for position, (topic, payload) in enumerate(messages):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if len(payload) == FRAME_SIZE and payload[0] == FRAME_VERSION:
+            binary_rows.append(n)
+            binary_payloads.append(payload)
+            stations.append(None) # read from the frame below
+            source.append(position)
+            n += 1
+            continue
+        match = CANONICAL.match(payload)
+        if match is not None:
+            fast_rows.append(n)
+            fast_values.append(match.groups())
+            station = None
+        else:
+            readings, station = parse_frame(payload)
+            if readings is None:
+                continue
+            for name, value in readings.items():
+                rows[n, CHANNELS.index(name)] = value
+        if station is None:
+            station = topic[len(prefix):] if topic.startswith(prefix) else DEFAULT_STATION
+        stations.append(station)
+        source.append(position)
+        n += 1
+
+    source = np.array(source, dtype=np.int64)
+    valid = np.ones(n, dtype=bool)
+    if binary_payloads:
+        records, columns, ok = decode_batch(b"".join(binary_payloads))
+        rows[binary_rows] = np.column_stack([columns[name] for name in CHANNELS])
+        for i, station in zip(binary_rows, records["station"].tolist()):
+            stations[i] = station_name(station)
+        valid[binary_rows] = ok
+    if fast_values:
+        try:
+            rows[np.ix_(fast_rows, CANONICAL_CHANNELS)] = np.array(fast_values).astype(np.float64)
+        except ValueError:
+            # Some value is not a number: convert row by row and drop the bad frames
+            for i, values in zip(fast_rows, fast_values):
+                try:
+                    rows[i, CANONICAL_CHANNELS] = [float(v) for v in values]
+                except ValueError:
+                    valid[i] = False
+        # "nan"/"inf" convert fine but are not readings; every channel of the layout is present
+        fast_rows = np.array(fast_rows)
+        valid[fast_rows] &= np.isfinite(rows[np.ix_(fast_rows, CANONICAL_CHANNELS)]).all(axis=1)
+    if not valid.all():
+        rows[:valid.sum()] = rows[:n][valid]
+        stations = [station for station, ok in zip(stations, valid) if ok]
+        source = source[valid]
+        n = len(stations)
+
+    columns = {name: rows[:n, i] for i, name in enumerate(CHANNELS)}
+    if return_index:
+        return columns, stations, len(messages) - n, source
+    return columns, stations, len(messages) - n
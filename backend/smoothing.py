@@ -0,0 +1,104 @@
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from logic import Forecaster
+from station_history import TrendModel
+
+class HoltForecaster(TrendModel):
+    """
+    Holt's linear exponential smoothing (level + trend) for every Forecaster parameter.
+
+    State is two floats per parameter, updated in O(1) per reading, so memory per
+    station is constant regardless of how long the station has been streaming.
+    """
+
+    PARAMS = Forecaster.PARAMS
+
+    def __init__(self, alpha=0.5, beta=0.1):
+        """
+        Args:
+            alpha: Level smoothing factor (0-1); higher follows new readings faster.
+            beta: Trend smoothing factor (0-1).
+        """
+        self.alpha = alpha
+        self.beta = beta
+        self.level = np.zeros(len(self.PARAMS))
+        self.trend = np.zeros(len(self.PARAMS))
+        self.last = np.zeros(len(self.PARAMS))
+        self.count = 0
+        self.last_timestamp = None
+        self._lock = threading.Lock()
+
+    def append(self, reading, timestamp=None):
+        y = self.values_of(reading)
+        with self._lock:
+            self._update(y)
+            self.last = y
+            self.count += 1
+            self.last_timestamp = timestamp or reading.get("timestamp") or datetime.now().isoformat()
+
+    def _update(self, y):
+        if self.count == 0:
+            self.level = y.copy()
+            return
+        level = self.alpha * y + (1 - self.alpha) * (self.level + self.trend)
+        self.trend = self.beta * (level - self.level) + (1 - self.beta) * self.trend
+        self.level = level
+
+    def fit(self):
+        """
+        The smoothed level/trend expressed as a line in Forecaster's convention
+        (x = n - 1 is the latest reading, where the line equals the level).
+        """
+        with self._lock:
+            n = self.count
+            level, trend, last = self.level.copy(), self.trend.copy(), self.last.copy()
+        intercept = level - trend * (n - 1)
+        return {
+            param: (float(trend[i]), float(intercept[i]), float(last[i]))
+            for i, param in enumerate(self.PARAMS)
+        }
+
+class HoltWintersForecaster(HoltForecaster):
+    """
+    Additive Holt-Winters: Holt's level + trend plus a seasonal offset per position
+    in a cycle of `season_length` readings (e.g. 17,280 five-second readings = one
+    day, for the diurnal DO/temperature swing). Memory per station is fixed at
+    season_length values per parameter; seasonal offsets start at zero and are
+    learned as readings arrive.
+    """
+
+    def __init__(self, alpha=0.5, beta=0.1, gamma=0.1, season_length=17280):
+        """
+        Args:
+            gamma: Seasonal smoothing factor (0-1).
+            season_length: Readings per seasonal cycle.
+        """
+        super().__init__(alpha, beta)
+        self.gamma = gamma
+        self.season_length = season_length
+        self.season = np.zeros((season_length, len(self.PARAMS)))
+
+    def _update(self, y):
+        slot = self.count % self.season_length
+        if self.count == 0:
+            self.level = y.copy()
+            return
+        deseasonalized = y - self.season[slot]
+        level = self.alpha * deseasonalized + (1 - self.alpha) * (self.level + self.trend)
+        self.trend = self.beta * (level - self.level) + (1 - self.beta) * self.trend
+        self.season[slot] = self.gamma * (y - level) + (1 - self.gamma) * self.season[slot]
+        self.level = level
+
+    def seasonal(self, horizon=None):
+        # Offset h steps ahead of the latest reading (reading number count - 1), for h in 1..horizon.
+        # Only those rows are copied (a 5-minute forecast reads 60 of the 17,280).
+        rows = self.season_length if horizon is None else min(horizon, self.season_length)
+        with self._lock:
+            season = self.season.take(np.arange(self.count, self.count + rows) % self.season_length, axis=0)
+        return {
+            param: (lambda h, i=i: season[(np.asarray(h) - 1) % rows, i])
+            for i, param in enumerate(self.PARAMS)
+        }
@@ -0,0 +1,204 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from logic import Forecaster
+
+class TrendModel:
+    """
+    Base for per-station forecasting backends that are updated one reading at a time.
+
+    Subclasses maintain `count` and `last_timestamp`, implement append() and fit()
+    (param -> (slope, intercept, current_value) in Forecaster's convention) and may
+    add a seasonal component via seasonal().
+    """
+
+    PARAMS = Forecaster.PARAMS
+    count = 0
+    last_timestamp = None
+
+    @classmethod
+    def values_of(cls, reading):
+        """PARAMS of a reading as an array. Raises ValueError for NaN/inf, which would poison the state."""
+        y = np.array([float(reading[param]) for param in cls.PARAMS])
+        if not np.isfinite(y).all():
+            raise ValueError(f"Non-finite reading: {dict(zip(cls.PARAMS, y.tolist()))}")
+        return y
+
+    def __len__(self):
+        return self.count
+
+    def seasonal(self, horizon=None):
+        """Optional param -> f(step offsets 1..horizon) added to the line; None if the model has none."""
+        return None
+
+    def forecast(self, timeframe='5m'):
+        """Same contract as Forecaster.predict_trends, computed from the model state."""
+        if self.count < 5:
+            return None, {}, [] # Not enough data
+        forecast_steps = Forecaster.STEPS_MAP.get(timeframe, 60)
+        seasonal = self.seasonal(self.horizon(forecast_steps))
+        projections, insights = Forecaster.project(self.fit(), self.count, forecast_steps, seasonal=seasonal)
+        return self.last_timestamp, projections, insights
+
+    def compact_forecast(self, timeframe='5m', points=60):
+        """Same contract as Forecaster.compact_trends."""
+        if self.count < 5:
+            return Forecaster.compact(None, 0, None) # Not enough data
+        seasonal = self.seasonal(self.horizon(Forecaster.STEPS_MAP.get(timeframe, 60)))
+        return Forecaster.compact(self.fit(), self.count, self.last_timestamp, timeframe, points, seasonal)
+
+    @staticmethod
+    def horizon(forecast_steps):
+        # Steps a forecast looks ahead: its own, and the 5-minute window of Forecaster.project's insights
+        return max(forecast_steps, 60)
+
+class StationHistory(TrendModel):
+    """
+    Fixed-size ring buffer of recent readings for one station.
+
+    Alongside the raw values it keeps the running sums Σy and Σxy per parameter
+    (x = 0..n-1 over the window, oldest first; Σx and Σx² follow from n), so the
+    least-squares slope/intercept used by Forecaster is available in O(1)
+    after every append instead of refitting the whole window.
+    """
+
+    PARAMS = Forecaster.PARAMS
+    # Rebuild the running sums from the buffer this often to cancel float drift
+    RESYNC_EVERY = 10_000
+
+    def __init__(self, capacity=20):
+        self.capacity = capacity
+        self.values = np.zeros((capacity, len(self.PARAMS)))
+        self.start = 0 # slot of the oldest reading
+        self.count = 0
+        self.sum_y = np.zeros(len(self.PARAMS))
+        self.sum_xy = np.zeros(len(self.PARAMS))
+        self.last_timestamp = None
+        self._appends = 0
+        self._lock = threading.Lock()
+
+    def append(self, reading, timestamp=None):
+        """Add one reading (dict with every key in PARAMS) in O(1)."""
+        y = self.values_of(reading)
+        with self._lock:
+            if self.count == self.capacity:
+                # Drop the oldest (x = 0) and shift every remaining x down by one
+                self.sum_y -= self.values[self.start]
+                self.sum_xy -= self.sum_y
+                slot = self.start
+                self.start = (self.start + 1) % self.capacity
+            else:
+                slot = (self.start + self.count) % self.capacity
+                self.count += 1
+
+            self.values[slot] = y
+            self.sum_y += y
+            self.sum_xy += (self.count - 1) * y
+            self.last_timestamp = timestamp or reading.get("timestamp") or datetime.now().isoformat()
+
+            self._appends += 1
+            if self._appends % self.RESYNC_EVERY == 0:
+                self._resync()
+
+    def _resync(self):
+        window = self.window()
+        self.sum_y = window.sum(axis=0)
+        self.sum_xy = np.arange(self.count) @ window
+
+    def window(self):
+        """Readings in chronological order, shape (n, len(PARAMS))."""
+        return np.roll(self.values, -self.start, axis=0)[:self.count]
+
+    def fit(self):
+        """
+        Least-squares line per parameter over the current window.
+
+        Returns:
+            param -> (slope, intercept, current_value), the input Forecaster.project expects.
+        """
+        with self._lock:
+            n = self.count
+            sum_y = self.sum_y.copy()
+            sum_xy = self.sum_xy.copy()
+            current = self.values[(self.start + n - 1) % self.capacity].copy()
+
+        sum_x = n * (n - 1) / 2
+        sum_xx = (n - 1) * n * (2 * n - 1) / 6
+        slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x ** 2)
+        intercept = (sum_y - slope * sum_x) / n
+        return {
+            param: (float(slope[i]), float(intercept[i]), float(current[i]))
+            for i, param in enumerate(self.PARAMS)
+        }
+
+class StationRegistry:
+    """
+    Per-station forecasting state, created on first use.
+
+    A station starts with the `eager` methods, which see every reading. Every
+    other method (a Holt-Winters table is ~550 KB per station) is built the
+    first time it is queried for that station, warmed up from `history`, and
+    fed every reading from then on.
+
+    At most `max_stations` stations are kept; the least recently used one is
+    released to make room (its state can be rebuilt from `history`).
+    """
+
+    def __init__(self, factories, eager=("linear",), history=None, max_stations=None):
+        """
+        Args:
+            factories: method name -> zero-argument callable returning a new TrendModel.
+            eager: Methods built as soon as a station is first seen.
+            history: Optional callable station_id -> [(reading, timestamp), ...] of
+                recent readings, oldest first, replayed into a lazily built model.
+            max_stations: Stations kept before the least recently used is released (None: no limit).
+        """
+        self.factories = factories
+        self.eager = tuple(eager)
+        self.history = history
+        self.max_stations = max_stations
+        self.stations = OrderedDict() # station_id -> {method: TrendModel}, least recently used first
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def get(self, station_id):
+        with self._lock:
+            models = self.stations.get(station_id)
+            if models is None:
+                models = {method: self.factories[method]() for method in self.eager}
+                self.stations[station_id] = models
+                if self.max_stations is not None and len(self.stations) > self.max_stations:
+                    self.stations.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self.stations.move_to_end(station_id)
+        return models
+
+    def model(self, station_id, method="linear"):
+        models = self.get(station_id)
+        model = models.get(method)
+        if model is None:
+            # Warm up outside the lock, so other stations are not held up by this replay;
+            # if two requests race, the first model published wins
+            model = self.factories[method]()
+            for reading, timestamp in (self.history(station_id) if self.history else ()):
+                model.append(reading, timestamp)
+            with self._lock:
+                model = models.setdefault(method, model)
+        return model
+
+    def append(self, station_id, reading, timestamp=None):
+        TrendModel.values_of(reading) # reject before any model has taken it
+        for model in list(self.get(station_id).values()):
+            model.append(reading, timestamp)
+
+    def release(self, station_id):
+        """Drop a station's state (e.g. when a replay session ends)."""
+        with self._lock:
+            self.stations.pop(station_id, None)
+
+    def __contains__(self, station_id):
+        return station_id in self.stations
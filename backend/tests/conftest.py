@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from fakes import FakeOpenWeather, fake_cv_service
+
+@pytest.fixture
+def openweather():
+    """A running FakeOpenWeather with a small upstream latency."""
+    with FakeOpenWeather(latency=0.05) as fake:
+        yield fake
+
+@pytest.fixture
+def weather(openweather):
+    """WeatherService pointed at the fake; the tests drive it with asyncio.run."""
+    from weather_service import WeatherService
+
+    service = WeatherService(base_url=openweather.base_url)
+    service.api_key = "test"
+    return service
+
+@pytest.fixture
+def cv_service(monkeypatch):
+    """Factory of CVServices with a FakeVisionModel and a memory-only diagnosis cache."""
+    monkeypatch.setenv("DIAGNOSIS_CACHE_PATH", "none")
+    return fake_cv_service
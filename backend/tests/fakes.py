@@ -0,0 +1,149 @@
+"""
+Local stand-ins for the upstream services, shared by the tests (through the
+fixtures in conftest.py) and by benchmarks.py.
+"""
+import asyncio
+import contextlib
+import io
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+class FakeOpenWeather:
+    """
+    OpenWeather API on 127.0.0.1 (HTTP/1.1 keep-alive), answering after `latency` seconds.
+
+    `calls` counts requests per endpoint ("weather", "forecast") and TCP
+    connections under "connections". Set `status` to make every request fail.
+    Current temperature is TEMP; rain depends on the latitude, so locations differ.
+    """
+
+    TEMP = 14.2
+
+    def __init__(self, latency=0.0, port=0):
+        self.latency = latency
+        self.status = 200
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/data/2.5"
+
+    def _count(self, key):
+        with self._lock:
+            self.calls[key] += 1
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                fake._count("connections")
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                endpoint = url.path.rsplit("/", 1)[-1]
+                lat = float(parse_qs(url.query).get("lat", ["0"])[0])
+                fake._count(endpoint)
+                time.sleep(fake.latency)
+                status = fake.status
+                if status != 200:
+                    payload = {"cod": status, "message": "upstream failure"}
+                elif endpoint == "weather":
+                    payload = {"main": {"temp": fake.TEMP, "humidity": 81, "pressure": 1012}, "wind": {"speed": 5.1},
+                               "weather": [{"description": "light rain", "icon": "10d"}], "rain": {"1h": lat % 3}}
+                elif endpoint == "forecast":
+                    payload = {"list": [{"dt": 1700000000 + 10800 * i, "main": {"temp": 13.0 + i * 0.2},
+                                         "rain": {"3h": 1.5}} for i in range(40)]}
+                else:
+                    status, payload = 404, {"cod": 404}
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FakeVisionModel:
+    """
+    Stand-in for the Gemini model behind CVService: waits `latency` seconds and
+    returns a "Healthy" JSON diagnosis. `uploads` records the (MIME type, bytes)
+    of every image it was sent.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.uploads = []
+
+    async def generate_content_async(self, parts):
+        self.calls += 1
+        image = parts[1]
+        self.uploads.append((image["mime_type"], image["data"]))
+        await asyncio.sleep(self.latency)
+        text = json.dumps({"disease_name": "Healthy", "confidence": "High",
+                           "reasoning": f"No lesions visible ({len(image['data'])} bytes).", "status": "Healthy"})
+        return SimpleNamespace(text=text)
+
+def fake_cv_service(model=None, cache=None, **kwargs):
+    """
+    CVService (constructed without its start-up output) diagnosing with `model`
+    (default: a FakeVisionModel) and caching in `cache` (default: memory only).
+    Other keyword arguments go to CVService.
+    """
+    from cv_service import CVService
+    from diagnosis_cache import DiagnosisCache
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        service = CVService(**kwargs)
+    service.model = model if model is not None else FakeVisionModel()
+    service.cache = cache if cache is not None else DiagnosisCache(None)
+    return service
+
+def phone_photo(rng, width=4032, height=3024, quality=92):
+    """Synthetic phone photo: smooth shading plus sensor noise, JPEG with EXIF (orientation, GPS)."""
+    from PIL import Image
+
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([120 + 60 * np.sin(x / 300 + c) * np.cos(y / 200 - c) for c in range(3)], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 6, base.shape), 0, 255).astype(np.uint8)
+    exif = Image.Exif()
+    exif[0x0112] = 6 # rotated 90 degrees, as phones in portrait write it
+    exif[0x010F] = "PhoneMaker"
+    exif[0x8825] = {1: "N", 2: (53.0, 56.0, 0.0), 3: "W", 4: (9.0, 35.0, 0.0)}
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, format="JPEG", quality=quality, exif=exif)
+    return out.getvalue()
@@ -0,0 +1,68 @@
+"""CVService upload path against a fake model: what is actually sent for a phone photo."""
+import asyncio
+import io
+
+import numpy as np
+from PIL import Image
+
+from fakes import phone_photo
+
+def diagnose(service, *uploads):
+    async def run():
+        return [await service.diagnose_image(data) for data in uploads]
+
+    return asyncio.run(run())
+
+def test_phone_photo_is_sent_upright_downscaled_and_without_metadata(cv_service):
+    photo = phone_photo(np.random.default_rng(1), width=1600, height=1200)
+    service = cv_service(preprocess=True, max_edge=512, duplicate_distance=-1)
+    result, = diagnose(service, photo)
+
+    assert result["status"] == "Healthy"
+    (mime_type, sent), = service.model.uploads
+    assert mime_type == "image/jpeg"
+    with Image.open(io.BytesIO(sent)) as image:
+        # EXIF orientation 6 is applied before the metadata is dropped: the landscape frame stands upright
+        assert image.format == "JPEG"
+        assert image.size == (384, 512)
+        assert not image.getexif()
+        assert "icc_profile" not in image.info
+    assert len(sent) < len(photo)
+    stats = service.stats()
+    assert stats["bytes_in"] == len(photo) and stats["bytes_out"] == len(sent)
+    assert stats["prep_failures"] == 0
+
+def test_small_image_keeps_its_size(cv_service):
+    out = io.BytesIO()
+    Image.new("RGB", (300, 200), (40, 120, 200)).save(out, format="PNG")
+    service = cv_service(preprocess=True, max_edge=512, duplicate_distance=-1)
+    diagnose(service, out.getvalue())
+
+    (mime_type, sent), = service.model.uploads
+    with Image.open(io.BytesIO(sent)) as image:
+        assert (mime_type, image.format, image.size) == ("image/jpeg", "JPEG", (300, 200))
+
+def test_without_preprocessing_the_upload_is_sent_as_is(cv_service):
+    photo = phone_photo(np.random.default_rng(2), width=800, height=600)
+    service = cv_service(preprocess=False, duplicate_distance=-1)
+    diagnose(service, photo)
+
+    assert service.model.uploads == [("image/jpeg", photo)]
+
+def test_undecodable_upload_is_sent_unchanged(cv_service):
+    data = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4 # PNG signature, corrupt body
+    service = cv_service(preprocess=True, duplicate_distance=-1)
+    result, = diagnose(service, data)
+
+    assert result["status"] == "Healthy"
+    assert service.model.uploads == [("image/png", data)]
+    assert service.stats()["prep_failures"] == 1
+
+def test_repeated_upload_is_answered_from_the_cache(cv_service):
+    photo = phone_photo(np.random.default_rng(3), width=800, height=600)
+    service = cv_service(preprocess=True, duplicate_distance=-1)
+    first, = diagnose(service, photo)
+    second, = diagnose(service, photo)
+
+    assert service.model.calls == 1
+    assert second == first
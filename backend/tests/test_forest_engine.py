@@ -0,0 +1,85 @@
+"""CompiledForest must give exactly what the sklearn forest it was compiled from gives."""
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+
+from conftest import BACKEND_DIR
+from forest_engine import CompiledForest
+from train_disease_model import generate_synthetic_data
+
+FEATURES = ["temperature", "ph", "dissolved_oxygen", "turbidity"]
+LOW = np.array([10.0, 4.0, 1.0, 0.0])
+HIGH = np.array([40.0, 10.0, 12.0, 100.0])
+
+def random_rows(n, columns=FEATURES, seed=0):
+    low = LOW[[FEATURES.index(c) for c in columns]]
+    high = HIGH[[FEATURES.index(c) for c in columns]]
+    return pd.DataFrame(np.random.default_rng(seed).uniform(low, high, (n, len(columns))), columns=columns)
+
+def split_rows(engine, base):
+    """One row per split, with that input placed exactly on the split as sklearn sees it (and on either side)."""
+    nodes = np.flatnonzero(~np.isnan(engine.threshold))
+    feature = engine.feature[nodes]
+    scale = engine.scale[feature] if engine.scale is not None else 1.0
+    mean = engine.mean[feature] if engine.mean is not None else 0.0
+    raw = engine.threshold[nodes] * scale + mean
+    rows = np.repeat(base.to_numpy()[:1], 3 * len(nodes), axis=0)
+    values = np.concatenate([raw, np.nextafter(raw, -np.inf), np.nextafter(raw, np.inf)])
+    rows[np.arange(len(rows)), np.tile(feature, 3)] = values
+    return pd.DataFrame(rows, columns=base.columns)
+
+def assert_same(engine, model, scaler, df):
+    inputs = scaler.transform(df) if scaler is not None else df
+    labels, proba = engine.predict(engine.matrix_from(df))
+    np.testing.assert_array_equal(labels, model.predict(inputs))
+    np.testing.assert_allclose(proba, model.predict_proba(inputs), rtol=0, atol=1e-9)
+
+def fitted(scaled):
+    train = random_rows(2_000, seed=1)
+    # Labels from thresholds on the raw readings, plus noise, so the trees split on every input
+    rng = np.random.default_rng(2)
+    y = (train["dissolved_oxygen"] < 5).astype(int) + (train["ph"] > 8.2) * 2 + (rng.random(len(train)) < 0.1)
+    scaler = StandardScaler().fit(train) if scaled else None
+    model = RandomForestClassifier(n_estimators=25, max_depth=8, random_state=0)
+    # Behind a scaler the model is fitted on an array and names come from the scaler, as in production
+    model.fit(scaler.transform(train) if scaled else train, y)
+    return model, scaler, train
+
+@pytest.mark.parametrize("scaled", [False, True], ids=["plain", "scaler"])
+def test_fitted_forest_matches_sklearn(scaled):
+    model, scaler, train = fitted(scaled)
+    engine = CompiledForest.from_sklearn(model, scaler=scaler)
+    assert_same(engine, model, scaler, train)
+    assert_same(engine, model, scaler, random_rows(5_000, seed=3))
+    assert_same(engine, model, scaler, split_rows(engine, train))
+
+def test_disease_model_matches_sklearn():
+    model = joblib.load(os.path.join(BACKEND_DIR, "disease_model.pkl"))
+    engine = CompiledForest.from_sklearn(model)
+    np.random.seed(0)
+    # Rows from the generator the model was trained on
+    train = generate_synthetic_data(200)[engine.feature_names]
+    assert_same(engine, model, None, train)
+    assert_same(engine, model, None, random_rows(5_000, engine.feature_names))
+    assert_same(engine, model, None, split_rows(engine, train))
+
+def test_production_model_with_scaler_matches_sklearn():
+    model = joblib.load(os.path.join(BACKEND_DIR, "production_model.pkl"))
+    scaler = joblib.load(os.path.join(BACKEND_DIR, "production_scaler.pkl"))
+    engine = CompiledForest.from_sklearn(model, scaler=scaler)
+    rows = random_rows(5_000, engine.feature_names)
+    assert_same(engine, model, scaler, rows)
+    assert_same(engine, model, scaler, split_rows(engine, rows))
+
+def test_single_row():
+    model = joblib.load(os.path.join(BACKEND_DIR, "disease_model.pkl"))
+    engine = CompiledForest.from_sklearn(model)
+    row = random_rows(1, engine.feature_names)
+    labels, proba = engine.predict(row.to_numpy()[0])
+    assert labels.shape == (1,) and proba.shape == (1, len(model.classes_))
+    assert_same(engine, model, None, row)
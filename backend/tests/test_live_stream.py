@@ -0,0 +1,89 @@
+"""LiveBroadcaster: one evaluation per tick for any number of SSE subscribers, and bounded mailboxes for slow ones."""
+import asyncio
+
+from live_stream import LiveBroadcaster
+
+class CountingSource:
+    """produce() for a broadcaster: counts its calls and numbers its frames."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return {"reading": self.calls}
+
+def frame_id(payload):
+    return int(payload.split(b"\n", 1)[0][len(b"id: "):])
+
+def test_thousand_subscribers_share_one_evaluation_per_tick():
+    source = CountingSource()
+    frames = 5
+
+    async def run():
+        broadcaster = LiveBroadcaster(source, interval=0.05)
+        streams = [broadcaster.stream() for _ in range(1_000)]
+
+        async def subscriber(stream):
+            received = [frame_id(await stream.__anext__()) for _ in range(frames)]
+            await stream.aclose()
+            return received
+
+        received = await asyncio.gather(*(subscriber(stream) for stream in streams))
+        await broadcaster.close()
+        return broadcaster, received
+
+    broadcaster, received = asyncio.run(run())
+    # The source is read once per tick, not once per subscriber
+    assert source.calls == broadcaster.ticks
+    assert broadcaster.ticks < 2 * frames
+    assert broadcaster.frames_sent >= 1_000 * frames
+    for ids in received:
+        assert len(ids) == frames
+        assert ids == sorted(set(ids)) # in order, never the same frame twice
+    assert not broadcaster.subscribers
+
+def test_stalled_subscribers_keep_only_the_freshest_frames():
+    source = CountingSource()
+
+    async def run(buffer):
+        broadcaster = LiveBroadcaster(source, interval=0.005, buffer=buffer)
+        stalled = [broadcaster.stream() for _ in range(50)]
+        for stream in stalled:
+            await stream.__anext__() # subscribe, then never read again
+        await asyncio.sleep(0.2)
+        depths = [subscription.queue.qsize() for subscription in broadcaster.subscribers]
+        ticks, dropped = broadcaster.ticks, broadcaster.frames_dropped
+        # A stalled client that resumes gets the latest frames, not the backlog
+        latest = frame_id(broadcaster.latest)
+        resumed = [frame_id(await stalled[0].__anext__()) for _ in range(buffer)]
+        for stream in stalled:
+            await stream.aclose()
+        await broadcaster.close()
+        return ticks, dropped, depths, latest, resumed
+
+    for buffer in (1, 3):
+        ticks, dropped, depths, latest, resumed = asyncio.run(run(buffer))
+        assert ticks > 2 * buffer
+        assert max(depths) == buffer
+        # Every frame past the first (read) and the `buffer` kept replaced an older one
+        assert dropped == 50 * (ticks - 1 - buffer)
+        assert resumed[-1] >= latest and resumed == sorted(resumed)
+
+def test_tick_stops_when_the_last_subscriber_leaves():
+    source = CountingSource()
+
+    async def run():
+        broadcaster = LiveBroadcaster(source, interval=0.01)
+        stream = broadcaster.stream()
+        await stream.__anext__()
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+        calls = source.calls
+        await asyncio.sleep(0.05)
+        return broadcaster, calls
+
+    broadcaster, calls = asyncio.run(run())
+    assert not broadcaster.subscribers
+    assert broadcaster._task is None
+    assert source.calls == calls
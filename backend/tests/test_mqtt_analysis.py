@@ -0,0 +1,39 @@
+"""MQTT ingest output: per-frame messages on water/analysis keep the original contract, batches go to their own topic."""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "MQTT"))
+import mqtt_analysis
+
+FRAMES = [
+    ("water/raw/pond-1", b"PH=7.20,TUR=12.00,SAL=15.00,NH3=0.02,T=28.5"),
+    ("water/raw/pond-2", b"PH=5.10,TUR=40.00,SAL=15.00,T=33.0"),
+]
+
+def run(**kwargs):
+    published = []
+    service = mqtt_analysis.IngestService(lambda topic, payload: published.append((topic, json.loads(payload))),
+                                          batch_size=len(FRAMES), **kwargs)
+    service.process(FRAMES)
+    return published
+
+def test_each_frame_is_published_to_the_analysis_topic():
+    published = run()
+    frames = [message for topic, message in published if topic == "water/analysis"]
+    assert [message["station"] for message in frames] == ["pond-1", "pond-2"]
+    assert [message["status"] for message in frames] == ["POLLUTED", "SAFE"]
+    assert all(isinstance(message["timestamp"], float) for message in frames)
+    assert frames[0]["readings"] == {"ph": 7.2, "turbidity": 12.0, "salinity": 15.0, "ammonia": 0.02, "temperature": 28.5}
+    assert "ammonia" not in frames[1]["readings"]
+    assert frames[1]["risk_level"] != "Optimal" and frames[1]["alerts"]
+
+def test_batch_document_goes_to_its_own_topic():
+    published = run()
+    batches = [message for topic, message in published if topic == "water/analysis/batch"]
+    assert len(batches) == 1 and batches[0]["count"] == len(FRAMES)
+    assert batches[0]["readings"]["ammonia"] == [0.02, None]
+
+def test_topics_can_be_turned_off():
+    assert [topic for topic, _ in run(batch_topic=None)] == ["water/analysis"] * len(FRAMES)
+    assert [topic for topic, _ in run(topic="")] == ["water/analysis/batch"]
@@ -0,0 +1,16 @@
+"""StationRegistry: bounded number of stations, least recently used released first."""
+from station_history import StationHistory, StationRegistry
+
+READING = {"temperature": 27.0, "ph": 7.2, "dissolved_oxygen": 6.5, "turbidity": 3.0}
+
+def test_least_recently_used_station_is_released():
+    registry = StationRegistry({"linear": lambda: StationHistory(capacity=5)}, max_stations=3)
+    for station in ("a", "b", "c"):
+        registry.append(station, READING)
+    registry.append("a", READING) # "b" is now the least recently used
+    registry.append("d", READING)
+
+    assert "b" not in registry
+    assert all(station in registry for station in ("a", "c", "d"))
+    assert len(registry.stations) == 3 and registry.evicted == 1
+    assert len(registry.model("a")) == 2
@@ -0,0 +1,52 @@
+"""TimeSeriesStore: the station limit, and queries running while retention deletes segments."""
+import threading
+
+import numpy as np
+import pytest
+
+from timeseries_store import TimeSeriesStore
+
+def test_new_stations_beyond_the_limit_are_refused(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), segment_rows=16, max_stations=2)
+    store.append_one("pond-1", 1.0, {"ph": 7.0})
+    store.append_one("pond-2", 1.0, {"ph": 7.1})
+    with pytest.raises(ValueError):
+        store.append_one("pond-3", 1.0, {"ph": 7.2})
+    # Known stations keep accepting readings
+    store.append_one("pond-1", 2.0, {"ph": 7.3})
+    assert sorted(store.stations()) == ["pond-1", "pond-2"]
+    assert len(list(tmp_path.iterdir())) == 2
+    assert store.count("pond-1") == 2
+
+def test_queries_are_consistent_while_retention_deletes_segments(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), segment_rows=64, max_open=4)
+    stop = threading.Event()
+    errors = []
+
+    def writer():
+        t = 0
+        while not stop.is_set():
+            store.append("pond", np.arange(t, t + 32, dtype=np.float64), {"ph": np.full(32, 7.0)})
+            t += 32
+            store.enforce_retention(max_age=256, now=t)
+
+    def reader():
+        while not stop.is_set():
+            try:
+                rows = store.query("pond", channels=("ph",))
+                latest = store.latest("pond", 100, ("ph",))
+                assert np.all(np.diff(rows["timestamp"]) == 1) and np.all(rows["ph"] == 7.0)
+                assert len(latest["timestamp"]) <= 100 and np.all(np.diff(latest["timestamp"]) == 1)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    stop.wait(1.0)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors[0]
+    assert store.deleted_segments > 10
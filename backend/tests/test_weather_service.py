@@ -0,0 +1,82 @@
+"""WeatherService caching against a local fake OpenWeather: coalescing, stale-while-revalidate and the negative cache."""
+import asyncio
+
+from cache import StaleWhileRevalidate, TTLCache
+
+SITES = [(53.93, -9.58), (52.10, -8.40)]
+
+def upstream(fake):
+    return fake.calls["weather"] + fake.calls["forecast"]
+
+def test_concurrent_callers_share_one_upstream_call_per_key(weather, openweather):
+    async def run():
+        try:
+            first = await asyncio.gather(*(weather.get_weather_and_forecast(lat=lat, lon=lon)
+                                           for _ in range(100) for lat, lon in SITES))
+            again = await asyncio.gather(*(weather.get_weather_and_forecast(lat=lat, lon=lon)
+                                           for _ in range(100) for lat, lon in SITES))
+            return first, again
+        finally:
+            await weather.aclose()
+
+    first, again = asyncio.run(run())
+    # One call per (endpoint, location), however many callers arrived while it was in flight
+    assert openweather.calls["weather"] == len(SITES)
+    assert openweather.calls["forecast"] == len(SITES)
+    assert all(current["main"]["temp"] == openweather.TEMP for current, _ in first + again)
+    assert all(len(forecast["list"]) == 40 for _, forecast in first + again)
+    assert weather.cache.stats()["coalesced"] == 2 * len(SITES) * 99
+    # Pooled connections: far fewer than the 4 requests' worth of handshakes per caller
+    assert openweather.calls["connections"] <= 2 * len(SITES)
+
+def test_stale_entry_is_served_while_one_refresh_runs(weather, openweather):
+    weather.TTLS = {"weather": 0.1, "forecast": 0.1}
+    weather.cache = StaleWhileRevalidate(stale_ttl=60)
+
+    async def run():
+        try:
+            await weather.get_weather_and_forecast()
+            await asyncio.sleep(0.15)
+            calls = upstream(openweather)
+            # Past the TTL: answered from the stale entry, without waiting for upstream
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            results = await asyncio.gather(*(weather.get_weather_and_forecast() for _ in range(50)))
+            waited = loop.time() - started
+            await asyncio.sleep(openweather.latency * 4)
+            return calls, results, waited
+        finally:
+            await weather.aclose()
+
+    calls, results, waited = asyncio.run(run())
+    assert calls == 2
+    assert waited < openweather.latency
+    assert all(current["main"]["temp"] == openweather.TEMP for current, _ in results)
+    # One background refresh per endpoint
+    assert upstream(openweather) == 4
+    assert weather.cache.stats()["stale_hits"] == 100
+
+def test_failed_fetch_is_remembered_for_the_negative_ttl(weather, openweather):
+    weather.failures = TTLCache(ttl=0.3)
+    openweather.status = 503
+
+    async def run():
+        try:
+            failed = [await weather.get_weather_and_forecast() for _ in range(10)]
+            calls = upstream(openweather)
+            openweather.status = 200
+            still_failed = await weather.get_weather_and_forecast()
+            await asyncio.sleep(0.35)
+            recovered = await weather.get_weather_and_forecast()
+            return failed, calls, still_failed, recovered
+        finally:
+            await weather.aclose()
+
+    failed, calls, still_failed, recovered = asyncio.run(run())
+    mock = weather._get_mock_weather()
+    # Ten polls while upstream is down: one attempt per endpoint, then the mock data
+    assert calls == 2
+    assert all(current == mock for current, _ in failed)
+    assert still_failed[0] == mock
+    assert recovered[0]["main"]["temp"] == openweather.TEMP
+    assert upstream(openweather) == 4
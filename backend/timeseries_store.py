@@ -0,0 +1,341 @@
+import bisect
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import unquote
+
+import numpy as np
+
+from sensor_frames import CHANNELS
+
+class Segment:
+    """
+    One fixed-capacity columnar segment file.
+
+    Layout: a 64-byte header (magic, version, channel count, capacity, rows),
+    then `capacity` float64 timestamps, then `capacity` float32 values per
+    channel. The file is created at full size (sparse), so columns never move
+    and can be memory-mapped once.
+    """
+
+    MAGIC = b"AQTS"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHHQQ")
+    HEADER_SIZE = 64
+    ROWS_OFFSET = 16
+
+    def __init__(self, path, capacity, rows, first, last):
+        self.path = path
+        self.capacity = capacity
+        self.rows = rows
+        self.first = first # first timestamp (None while empty)
+        self.last = last
+
+    @classmethod
+    def create(cls, path, channels, capacity):
+        with open(path + ".tmp", "wb") as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, channels, capacity, 0).ljust(cls.HEADER_SIZE, b"\0"))
+            f.truncate(cls.HEADER_SIZE + capacity * (8 + 4 * channels))
+        os.replace(path + ".tmp", path)
+        return cls(path, capacity, 0, None, None)
+
+    @classmethod
+    def open(cls, path, channels):
+        with open(path, "rb") as f:
+            magic, version, n_channels, capacity, rows = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            if magic != cls.MAGIC or version != cls.VERSION or n_channels != channels:
+                raise ValueError(f"Not a {channels}-channel segment: {path}")
+            first = last = None
+            if rows:
+                first = struct.unpack("<d", os.pread(f.fileno(), 8, cls.HEADER_SIZE))[0]
+                last = struct.unpack("<d", os.pread(f.fileno(), 8, cls.HEADER_SIZE + 8 * (rows - 1)))[0]
+        return cls(path, capacity, rows, first, last)
+
+    def columns(self, channels):
+        """Memory-map the file; returns (header view, timestamps, channel -> values), all views of one mapping."""
+        mm = np.memmap(self.path, dtype=np.uint8, mode="r+")
+        header = mm[:self.HEADER_SIZE]
+        offset = self.HEADER_SIZE
+        timestamps = mm[offset:offset + 8 * self.capacity].view("<f8")
+        offset += 8 * self.capacity
+        values = {}
+        for name in channels:
+            values[name] = mm[offset:offset + 4 * self.capacity].view("<f4")
+            offset += 4 * self.capacity
+        return header, timestamps, values
+
+class TimeSeriesStore:
+    """
+    Embedded append-only time-series store, one directory per station.
+
+    Each station is a sequence of columnar segments (timestamp + float32 per
+    channel) memory-mapped on demand. Timestamps must not decrease within a
+    station, so range queries are two binary searches, and retention deletes
+    whole segments. Query results are read-only views of the mapped files
+    (no copy) as long as the range lies within one segment.
+    """
+
+    # Station ids come from clients and MQTT topics, so they never become path components as
+    # is ("..", "/" or a percent-encoded "." would escape root): the directory is the hex of the id
+    DIR_PREFIX = "s-"
+
+    def __init__(self, root, channels=CHANNELS, segment_rows=1 << 20, max_open=256, max_stations=None):
+        """
+        Args:
+            root: Directory holding one subdirectory per station.
+            channels: Value columns, stored as float32 (NaN = missing).
+            segment_rows: Rows per segment file.
+            max_open: Segments kept memory-mapped (least recently used are unmapped).
+            max_stations: Most stations stored (None: no limit); appends for new
+                stations beyond it raise ValueError. Each new station costs a directory
+                and a segment file, so this bounds what arbitrary station ids can use.
+        """
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.channels = tuple(channels)
+        self.segment_rows = segment_rows
+        self.max_open = max_open
+        self.max_stations = max_stations
+        self._segments = {} # station -> [Segment], oldest first
+        self._starts = {} # station -> first timestamps of its segments, for bisect
+        self._mapped = OrderedDict() # segment path -> columns()
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.out_of_order = 0
+        self.deleted_segments = 0
+        for name in os.listdir(root):
+            if not os.path.isdir(os.path.join(root, name)):
+                continue
+            if name.startswith(self.DIR_PREFIX):
+                station = bytes.fromhex(name[len(self.DIR_PREFIX):]).decode()
+            else:
+                # Written by an older version (percent-encoded name): move to the hex name
+                station = unquote(name)
+                os.rename(os.path.join(root, name), self._station_dir(station))
+            self._load_station(station)
+
+    def _station_dir(self, station):
+        return os.path.join(self.root, self.DIR_PREFIX + station.encode().hex())
+
+    def _load_station(self, station):
+        directory = self._station_dir(station)
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".seg"))
+        segments = [Segment.open(os.path.join(directory, name), len(self.channels)) for name in names]
+        self._segments[station] = segments
+        self._starts[station] = [s.first for s in segments if s.rows]
+        self._locks[station] = threading.Lock()
+
+    def _station_lock(self, station):
+        lock = self._locks.get(station)
+        if lock is None:
+            with self._lock:
+                lock = self._locks.get(station)
+                if lock is None:
+                    if self.max_stations is not None and len(self._locks) >= self.max_stations:
+                        raise ValueError(f"Station limit reached ({self.max_stations}): {station!r} not stored")
+                    os.makedirs(self._station_dir(station), exist_ok=True)
+                    self._segments[station] = []
+                    self._starts[station] = []
+                    lock = self._locks[station] = threading.Lock()
+        return lock
+
+    def _columns(self, segment):
+        with self._lock:
+            columns = self._mapped.get(segment.path)
+            if columns is None:
+                columns = self._mapped[segment.path] = segment.columns(self.channels)
+                if len(self._mapped) > self.max_open:
+                    # Views handed out earlier keep their own reference to the mapping
+                    self._mapped.popitem(last=False)
+            else:
+                self._mapped.move_to_end(segment.path)
+            return columns
+
+    def _new_segment(self, station):
+        segments = self._segments[station]
+        seq = int(os.path.basename(segments[-1].path)[:-4]) + 1 if segments else 0
+        segment = Segment.create(os.path.join(self._station_dir(station), f"{seq:012d}.seg"),
+                                 len(self.channels), self.segment_rows)
+        segments.append(segment)
+        return segment
+
+    # ---------------------------
+    # Writing
+    # ---------------------------
+    def append(self, station, timestamps, values):
+        """
+        Append rows for one station.
+
+        Args:
+            timestamps: Epoch seconds, non-decreasing and not older than the
+                station's last stored row; rows that break this are dropped.
+            values: channel -> array-like of the same length (absent channels are NaN).
+
+        Returns:
+            Number of rows stored.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64).ravel()
+        n = len(timestamps)
+        columns = {name: np.asarray(values[name], dtype=np.float32) if name in values else None for name in self.channels}
+        with self._station_lock(station):
+            segments = self._segments[station]
+            last = segments[-1].last if segments and segments[-1].rows else -np.inf
+            keep = np.diff(timestamps, prepend=last) >= 0
+            if not keep.all():
+                # Only the running maximum can be kept in an append-only, sorted column
+                keep = timestamps >= np.maximum.accumulate(np.concatenate(([last], timestamps)))[:-1]
+                self.out_of_order += int(n - keep.sum())
+                timestamps = timestamps[keep]
+                columns = {name: col[keep] if col is not None else None for name, col in columns.items()}
+                n = len(timestamps)
+
+            written = 0
+            while written < n:
+                segment = segments[-1] if segments and segments[-1].rows < segments[-1].capacity else self._new_segment(station)
+                header, ts, cols = self._columns(segment)
+                start = segment.rows
+                count = min(n - written, segment.capacity - start)
+                ts[start:start + count] = timestamps[written:written + count]
+                for name in self.channels:
+                    column = columns[name]
+                    cols[name][start:start + count] = column[written:written + count] if column is not None else np.nan
+                if start == 0:
+                    segment.first = float(timestamps[written])
+                    self._starts[station].append(segment.first)
+                segment.last = float(timestamps[written + count - 1])
+                # Publish the row count only after the data is in place
+                segment.rows = start + count
+                header[Segment.ROWS_OFFSET:Segment.ROWS_OFFSET + 8].view("<u8")[0] = segment.rows
+                written += count
+        return n
+
+    def append_one(self, station, timestamp, readings):
+        """Append one reading (channel -> value) at `timestamp` (epoch seconds)."""
+        return self.append(station, [timestamp], {name: [readings[name]] for name in self.channels if readings.get(name) is not None})
+
+    def flush(self):
+        """msync every mapped segment."""
+        with self._lock:
+            mapped = list(self._mapped.values())
+        for header, _, _ in mapped:
+            header.flush()
+
+    # ---------------------------
+    # Reading
+    # ---------------------------
+    def stations(self):
+        return [station for station, segments in list(self._segments.items()) if segments]
+
+    def count(self, station):
+        return sum(segment.rows for segment in list(self._segments.get(station, ())))
+
+    def query_segments(self, station, start=None, end=None, channels=None):
+        """
+        Rows with start <= timestamp < end, as one dict of read-only views per segment touched.
+
+        Returns:
+            List of {"timestamp": float64 view, channel: float32 view, ...}; nothing is copied.
+        """
+        lock = self._locks.get(station)
+        if lock is None:
+            return []
+        channels = self.channels if channels is None else channels
+        parts = []
+        # Retention removes segments under the station lock: map them under it too. The views
+        # keep their mapping alive after the lock is released, even if the file is deleted.
+        with lock:
+            segments = self._segments[station]
+            starts = self._starts[station]
+            first = 0 if start is None else max(bisect.bisect_left(starts, start) - 1, 0)
+            last = len(starts) if end is None else bisect.bisect_left(starts, end)
+            for segment in segments[first:last]:
+                n = segment.rows
+                if n == 0:
+                    continue
+                _, ts, cols = self._columns(segment)
+                ts = ts[:n]
+                lo = 0 if start is None else int(np.searchsorted(ts, start, "left"))
+                hi = n if end is None else int(np.searchsorted(ts, end, "left"))
+                if hi <= lo:
+                    continue
+                part = {"timestamp": ts[lo:hi]}
+                for name in channels:
+                    part[name] = cols[name][lo:hi]
+                for view in part.values():
+                    view.flags.writeable = False
+                parts.append(part)
+        return parts
+
+    def query(self, station, start=None, end=None, channels=None):
+        """
+        Rows with start <= timestamp < end as one dict of arrays.
+
+        A range inside one segment is returned as views of the mapped file;
+        a range spanning segments is concatenated (copied).
+        """
+        parts = self.query_segments(station, start, end, channels)
+        if len(parts) == 1:
+            return parts[0]
+        names = ("timestamp",) + tuple(self.channels if channels is None else channels)
+        if not parts:
+            return {name: np.empty(0, dtype=np.float64 if name == "timestamp" else np.float32) for name in names}
+        return {name: np.concatenate([part[name] for part in parts]) for name in names}
+
+    def latest(self, station, n, channels=None):
+        """The last `n` rows of a station (views when they lie in its last segment)."""
+        lock = self._locks.get(station)
+        if lock is None or n <= 0:
+            return self.query(station, start=np.inf, channels=channels)
+        with lock:
+            segments = self._segments[station]
+            # Walk back from the newest segment until n rows are covered
+            remaining, first = n, len(segments)
+            while first > 0 and remaining > 0:
+                first -= 1
+                remaining -= segments[first].rows
+            start_ts = segments[first].first if segments else np.inf
+            if remaining < 0:
+                _, ts, _ = self._columns(segments[first])
+                start_ts = float(ts[-remaining])
+        result = self.query(station, start=start_ts, channels=channels)
+        # Equal timestamps at the boundary can add a few rows
+        return {name: values[-n:] for name, values in result.items()}
+
+    # ---------------------------
+    # Retention
+    # ---------------------------
+    def enforce_retention(self, max_age, now=None):
+        """
+        Delete whole segments whose newest row is older than `max_age` seconds.
+
+        Returns:
+            Number of segments deleted.
+        """
+        cutoff = (now or time.time()) - max_age
+        deleted = 0
+        for station in list(self._segments):
+            with self._station_lock(station):
+                segments = self._segments[station]
+                # The newest segment stays so appends keep their place
+                while len(segments) > 1 and segments[0].rows and segments[0].last < cutoff:
+                    segment = segments.pop(0)
+                    self._starts[station].pop(0)
+                    with self._lock:
+                        self._mapped.pop(segment.path, None)
+                    os.remove(segment.path)
+                    deleted += 1
+        self.deleted_segments += deleted
+        return deleted
+
+    def stats(self):
+        segments = [segment for station in list(self._segments.values()) for segment in list(station)]
+        return {
+            "stations": len(self.stations()),
+            "segments": len(segments),
+            "rows": sum(segment.rows for segment in segments),
+            "mapped_segments": len(self._mapped),
+            "out_of_order_dropped": self.out_of_order,
+            "deleted_segments": self.deleted_segments
+        }
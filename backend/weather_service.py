@@ -1,19 +1,105 @@
+import asyncio
 import httpx
 import os
 from dotenv import load_dotenv
 
+from cache import StaleWhileRevalidate, TTLCache
+
 load_dotenv()
 
 class WeatherService:
     BASE_URL = "https://api.openweathermap.org/data/2.5"
+    # Seconds an upstream response is fresh, per endpoint: current conditions update
+    # about every 10 minutes, the 3-hourly forecast far less often
+    TTLS = {
+        "weather": float(os.getenv("WEATHER_CURRENT_TTL", "600")),
+        "forecast": float(os.getenv("WEATHER_FORECAST_TTL", "1800")),
+    }
+    # Seconds past the TTL a response is still served while it is refetched in the background
+    STALE_TTL = float(os.getenv("WEATHER_STALE_TTL", "3600"))
+    # Seconds a failed fetch is remembered: callers get the mock data without retrying upstream
+    NEGATIVE_TTL = float(os.getenv("WEATHER_NEGATIVE_TTL", "60"))
+    # Locations (x endpoints) kept in the cache
+    CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "256"))
+    # One pooled client for all upstream calls (no TCP/TLS handshake per request)
+    TIMEOUT = httpx.Timeout(float(os.getenv("WEATHER_TIMEOUT", "10")), connect=float(os.getenv("WEATHER_CONNECT_TIMEOUT", "5")))
+    LIMITS = httpx.Limits(max_connections=int(os.getenv("WEATHER_MAX_CONNECTIONS", "20")), max_keepalive_connections=20)
+    # Sites refreshed at once by analyze_sites, and the most a caller may ask for
+    SITE_CONCURRENCY = int(os.getenv("WEATHER_SITE_CONCURRENCY", "10"))
+    MAX_SITE_CONCURRENCY = int(os.getenv("WEATHER_MAX_SITE_CONCURRENCY", "50"))
     
-    def __init__(self):
+    def __init__(self, base_url=None):
         self.api_key = os.getenv("OPENWEATHER_API_KEY")
+        self.base_url = base_url or os.getenv("OPENWEATHER_BASE_URL", self.BASE_URL)
         # Burrishoole Catchment, Co. Mayo, Ireland (approx coords)
         self.lat = 53.93
         self.lon = -9.58
+        # Shared by every dashboard: upstream calls depend on the TTLs, not on the number of viewers
+        self.cache = StaleWhileRevalidate(stale_ttl=self.STALE_TTL, maxsize=self.CACHE_SIZE)
+        self.failures = TTLCache(maxsize=self.CACHE_SIZE, ttl=self.NEGATIVE_TTL) # key -> error message
+        self._client = None
+        self._client_loop = None
+        self._closing = set() # close tasks of discarded clients, referenced until done
+
+    def _http(self):
+        # Pooled connections belong to the event loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            if self._client is not None:
+                self._discard(self._client, self._client_loop)
+            self._client = httpx.AsyncClient(timeout=self.TIMEOUT, limits=self.LIMITS)
+            self._client_loop = loop
+        return self._client
+
+    def _discard(self, client, loop):
+        # Close a client left behind by another event loop, on that loop if it still runs
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            task = asyncio.ensure_future(self._close_quietly(client))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close_quietly(client):
+        try:
+            await client.aclose()
+        except Exception:
+            pass # its connections died with their loop
+
+    async def aclose(self):
+        """Close the pooled client (app shutdown)."""
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    async def _fetch(self, endpoint, lat, lon):
+        params = {
+            "lat": lat,
+            "lon": lon,
+            "appid": self.api_key,
+            "units": "metric"
+        }
+        response = await self._http().get(f"{self.base_url}/{endpoint}", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def _get(self, endpoint, lat=None, lon=None):
+        """Cached upstream call for one location; raises if there is nothing cached and the fetch fails."""
+        lat = self.lat if lat is None else lat
+        lon = self.lon if lon is None else lon
+        key = (endpoint, lat, lon)
+        error = self.failures.get(key)
+        if error is not None:
+            raise RuntimeError(f"{error} (cached failure)")
+        try:
+            return await self.cache.get(key, lambda: self._fetch(endpoint, lat, lon), ttl=self.TTLS[endpoint])
+        except Exception as e:
+            # Without this, every poll of a dashboard waits for the upstream timeout again
+            self.failures.set(key, str(e) or type(e).__name__)
+            raise
         
-    async def get_current_weather(self, abnormal=False):
+    async def get_current_weather(self, abnormal=False, lat=None, lon=None):
         if abnormal:
              return self._get_mock_weather(abnormal=True)
 
@@ -21,21 +107,11 @@ class WeatherService:
             print("Weather API Key missing. Using Mock Data.")
             return self._get_mock_weather()
             
-        async with httpx.AsyncClient() as client:
-            try:
-                url = f"{self.BASE_URL}/weather"
-                params = {
-                    "lat": self.lat,
-                    "lon": self.lon,
-                    "appid": self.api_key,
-                    "units": "metric"
-                }
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                return response.json()
-            except Exception as e:
-                print(f"Weather API Error: {e}. Switching to Mock Data.")
-                return self._get_mock_weather()
+        try:
+            return await self._get("weather", lat, lon)
+        except Exception as e:
+            print(f"Weather API Error: {e}. Switching to Mock Data.")
+            return self._get_mock_weather()
 
     def _get_mock_weather(self, abnormal=False):
         """Return a plausible weather response for demo purposes."""
@@ -58,25 +134,45 @@ class WeatherService:
             "aqi": 2
         }
 
-    async def get_forecast(self):
+    async def get_forecast(self, lat=None, lon=None):
         if not self.api_key:
             return self._get_mock_forecast()
             
-        async with httpx.AsyncClient() as client:
-            try:
-                url = f"{self.BASE_URL}/forecast"
-                params = {
-                    "lat": self.lat,
-                    "lon": self.lon,
-                    "appid": self.api_key,
-                    "units": "metric"
-                }
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                return response.json()
-            except Exception as e:
-                print(f"Weather Forecast Error: {e}. Switching to Mock Data.")
-                return self._get_mock_forecast()
+        try:
+            return await self._get("forecast", lat, lon)
+        except Exception as e:
+            print(f"Weather Forecast Error: {e}. Switching to Mock Data.")
+            return self._get_mock_forecast()
+
+    async def get_weather_and_forecast(self, abnormal=False, lat=None, lon=None):
+        """Current weather and forecast for one location, fetched concurrently."""
+        return await asyncio.gather(self.get_current_weather(abnormal, lat, lon), self.get_forecast(lat, lon))
+
+    async def analyze_sites(self, sites, concurrency=None):
+        """
+        Weather and impact analysis for many locations in one call.
+
+        Args:
+            sites: List of {"site": name, "lat": float, "lon": float}.
+            concurrency: Sites fetched at once (default SITE_CONCURRENCY), clamped to
+                1..MAX_SITE_CONCURRENCY.
+
+        Returns:
+            One {"site", "lat", "lon", "weather", "forecast", "impact_analysis"} per site, in input order.
+        """
+        semaphore = asyncio.Semaphore(max(1, min(concurrency or self.SITE_CONCURRENCY, self.MAX_SITE_CONCURRENCY)))
+
+        async def analyze(site):
+            async with semaphore:
+                weather, forecast = await self.get_weather_and_forecast(lat=site["lat"], lon=site["lon"])
+            return {
+                **site,
+                "weather": weather,
+                "forecast": forecast,
+                "impact_analysis": self.analyze_impact(weather, forecast)
+            }
+
+        return await asyncio.gather(*(analyze(site) for site in sites))
 
     def _get_mock_forecast(self):
         """Return a plausible forecast response for demo purposes."""
@@ -296,12 +296,9 @@ export default function App() {
 
   const [history, setHistory] = useState<any[]>([]);
 
-  // Fetch live data from backend
-  const fetchSensorData = async () => {
+  // Apply one live data frame pushed by the backend
+  const handleLiveData = (data: any) => {
     try {
-      const response = await fetch('http://localhost:8000/api/live-data');
-      const data = await response.json();
-
       if (data && data.sensor_data) {
         setSensorData({
           ph: data.sensor_data.ph,
@@ -318,7 +315,7 @@ export default function App() {
         });
       }
     } catch (error) {
-      console.error('Error fetching live data:', error);
+      console.error('Error applying live data:', error);
     }
   };
 
@@ -373,17 +370,17 @@ export default function App() {
     });
   };
 
-  // Simulate live data updates
+  // Live data updates pushed by the backend (one server tick shared by all dashboards)
   useEffect(() => {
-    // Only run interval if NOT in simulation mode
+    // Only subscribe if NOT in simulation mode
     // In simulation mode, values are STATIC (frozen) until reset
     if (!isSimulating) {
-      const interval = setInterval(() => {
-        fetchSensorData();
-      }, 5000);
-      return () => clearInterval(interval);
+      const source = new EventSource('http://localhost:8000/api/live-stream');
+      source.onmessage = (event) => handleLiveData(JSON.parse(event.data));
+      source.onerror = (error) => console.error('Live stream error:', error); // EventSource reconnects by itself
+      return () => source.close();
     }
-    // No interval in simulation mode - static values persist
+    // No subscription in simulation mode - static values persist
   }, [isSimulating]);
 
   const handleSendMessage = async () => {
@@ -703,8 +700,7 @@ export default function App() {
                           </button>
                           <button
                             onClick={() => {
-                              setIsSimulating(false);
-                              fetchSensorData(); // Resume immediately
+                              setIsSimulating(false); // Resubscribing delivers the latest frame immediately
                             }}
                             className="bg-emerald-500/20 hover:bg-emerald-500/40 text-emerald-300 text-xs px-3 py-1.5 rounded border border-emerald-500/50 transition-colors"
                           >
@@ -12,6 +12,7 @@ interface PredictiveAnalysisProps {
 
 export function PredictiveAnalysis({ history, currentData }: PredictiveAnalysisProps) {
     const [forecasts, setForecasts] = useState<any>(null);
+    const [projectionSteps, setProjectionSteps] = useState<number[] | null>(null);
     const [insights, setInsights] = useState<string[]>([]);
     const [solutions, setSolutions] = useState<any[]>([]);
     const [loading, setLoading] = useState(false);
@@ -31,6 +32,8 @@ export function PredictiveAnalysis({ history, currentData }: PredictiveAnalysisP
                     const data = await response.json();
                     if (data.projections) {
                         setForecasts(data.projections);
+                        // Compact responses sample the horizon; each value sits at this many steps ahead
+                        setProjectionSteps(data.projection_steps ?? null);
                         setInsights(data.insights);
                     }
                 } catch (error) {
@@ -81,9 +84,9 @@ export function PredictiveAnalysis({ history, currentData }: PredictiveAnalysisP
 
         const lastIdx = historical.length - 1;
 
-        // Append forecast
+        // Append forecast at its step offset (full responses have one value per step)
         const prediction = forecasts[param].map((val: number, i: number) => ({
-            time: lastIdx + i + 1,
+            time: lastIdx + (projectionSteps ? projectionSteps[i] : i + 1),
             actual: null,
             predicted: val
         }));
@@ -108,7 +111,7 @@ export function PredictiveAnalysis({ history, currentData }: PredictiveAnalysisP
                     <ResponsiveContainer width="100%" height="100%">
                         <LineChart data={getChartData(param)}>
                             <CartesianGrid strokeDasharray="3 3" stroke="#334155" opacity={0.5} />
-                            <XAxis hide />
+                            <XAxis dataKey="time" type="number" domain={['dataMin', 'dataMax']} hide />
                             <YAxis stroke="#94a3b8" fontSize={10} domain={['auto', 'auto']} tickFormatter={(val) => val.toFixed(1)} />
                             <Tooltip contentStyle={{ backgroundColor: '#1e293b', borderColor: '#334155', color: '#f8fafc' }} formatter={(val: number) => [val?.toFixed(2), "Value"]} labelStyle={{ display: 'none' }} />
                             <Line type="monotone" dataKey="actual" stroke={color} strokeWidth={2} dot={false} />